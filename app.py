@@ -1,49 +1,206 @@
-from flask import Flask, render_template, request, jsonify
-from services.weather import get_region_weather, fetch_open_meteo, code_to_icon_desc
-from services.rates import get_cbr_rates
-from services.news import get_headlines
+from flask import Blueprint, Flask, current_app, render_template, request, jsonify, g
+from jinja2 import FileSystemBytecodeCache
+from services.weather import CITIES, get_region_weather_versioned, refresh_region_weather
+from services.rates import get_cbr_rates_versioned, refresh_rates, search_rates_json
+from services.news import get_headlines_versioned, refresh_headlines
 from services.geo import search_cities  # файл services/geo.py
-import requests  # <— для крипто-API
+from services.fanout import run_parallel
+from services.forecast_cache import get_forecast_versioned, parse_coords, quantize, stats as forecast_stats
+from services.httpcache import CACHE_CONTROL, cache_for, encoded_etag, make_etag, pages, responses
+from services.cache import CACHES, track_stale
+from services import admission, crypto, forecast, forecast_grid, geocoder, metrics, rates_history, resilience, http_client, stream, warmstate
+from services.scheduler import scheduler, every, cbr_cadence
+import gzip
+import os
+import time
+from datetime import date
 
-app = Flask(__name__)
+bp = Blueprint("site", __name__)
 
-# Фолбэк для фиатных валют: флаг и символ
-FIAT_META = {"USD":{"emoji":"🇺🇸","symbol":"$"},"EUR":{"emoji":"🇪🇺","symbol":"€"},"GBP":{"emoji":"🇬🇧","symbol":"£"},"CNY":{"emoji":"🇨🇳","symbol":"¥"},"JPY":{"emoji":"🇯🇵","symbol":"¥"},"TRY":{"emoji":"🇹🇷","symbol":"₺"},"KZT":{"emoji":"🇰🇿","symbol":"₸"},"UAH":{"emoji":"🇺🇦","symbol":"₴"},"AED":{"emoji":"🇦🇪","symbol":"د.إ"},"BYN":{"emoji":"🇧🇾","symbol":"Br"},"AMD":{"emoji":"🇦🇲","symbol":"֏"},"AZN":{"emoji":"🇦🇿","symbol":"₼"},"EGP":{"emoji":"🇪🇬","symbol":"E£"},"CDF":{"emoji":"🇨🇩","symbol":"FC"}}
+
+
+# -----------------------------
+# Фоновое обновление данных
+# -----------------------------
+# Обработчики запросов только читают кэш: данные обновляются заранее,
+# до истечения TTL (см. services/scheduler.py). SCHEDULER=0 — отключить.
+
+# После обновления курсов, новостей и погоды переписывается снимок
+# services/warmstate.py — с него стартуют новые воркеры.
+
+scheduler.add_job("cbr_rates", warmstate.saving(refresh_rates), cbr_cadence)
+scheduler.add_job("headlines", warmstate.saving(refresh_headlines), every(240))
+scheduler.add_job("region_weather", warmstate.saving(refresh_region_weather), every(3000))
+scheduler.add_job("crypto_coins", crypto.refresh_coin_list, every(6 * 3600))
+scheduler.add_job("crypto_prices", crypto.refresh_snapshot, every(240))
+scheduler.add_job("forecast_grid", forecast_grid.refresh, every(forecast_grid.REFRESH_SECONDS))
+scheduler.add_job("rates_history_backfill", rates_history.backfill, every(86400))
+
+@bp.before_app_request
+def _start_scheduler():
+    # запускаем в воркере (после fork), а не при импорте
+    if os.getenv("SCHEDULER", "1") != "0":
+        scheduler.start()
+
+
+# -----------------------------
+# Метрики
+# -----------------------------
+# Задержка, статус и размер ответа по шаблону маршрута (services/metrics.py);
+# /metrics отдаёт сумму по всем воркерам в формате Prometheus.
+
+@bp.before_app_request
+def _metrics_start():
+    g.started = time.perf_counter()
+    g.profile = metrics.start_profile()
+
+@bp.after_app_request
+def _metrics_record(response):
+    started = getattr(g, "started", None)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics.observe_request(route, request.method, response.status_code, elapsed, response.calculate_content_length())
+    metrics.finish_profile(g.profile, route, elapsed)
+    return response
+
+
+# -----------------------------
+# Устаревшие данные
+# -----------------------------
+# Если источник недоступен, кэш отдаёт последнее удачное значение;
+# такие ответы помечаются заголовком X-Data-Stale со списком кэшей.
+
+@bp.before_app_request
+def _track_stale():
+    g.stale_sources = track_stale()
+
+@bp.after_app_request
+def _stale_header(response):
+    sources = getattr(g, "stale_sources", None)
+    if sources:
+        response.headers["X-Data-Stale"] = ",".join(sorted(sources))
+    return response
+
+
+# -----------------------------
+# Допуск запросов
+# -----------------------------
+# Лимит на клиента для маршрутов, которые ходят во внешние API, и 429 вместо
+# ожидания, когда очередь к источнику переполнена (services/admission.py).
+
+@bp.before_app_request
+def _admission():
+    route = request.url_rule.rule if request.url_rule else None
+    ip = admission.client_ip(request.remote_addr, request.headers.get("X-Forwarded-For"))
+    retry_after = admission.check(route, ip)
+    if retry_after is not None:
+        return _too_many_requests("rate limit exceeded", retry_after)
+
+@bp.app_errorhandler(admission.Overloaded)
+def _overloaded(e):
+    return _too_many_requests(str(e), e.retry_after)
+
+def _too_many_requests(message, retry_after):
+    response = jsonify({"error": message})
+    response.status_code = 429
+    response.headers["Retry-After"] = admission.retry_after_header(retry_after)
+    return response
+
+
+# -----------------------------
+# Кэширование ответов
+# -----------------------------
+# ETag считается из версий данных (время их записи в кэш). Совпал
+# If-None-Match — отвечаем 304 без рендеринга; иначе берём готовое
+# сжатое тело из services/httpcache.py, рендерим только при промахе.
+
+def _cached_response(etag, render, kind, mimetype="text/html; charset=utf-8"):
+    cache = cache_for(kind)
+    gzipped = "gzip" in request.accept_encodings
+    tag = encoded_etag(etag, gzipped)
+    if request.if_none_match.contains(tag):
+        cache.not_modified += 1
+        response = current_app.response_class(status=304)
+    else:
+        body = cache.get_gzip(etag, render)
+        if gzipped:
+            response = current_app.response_class(body, mimetype=mimetype)
+            response.headers["Content-Encoding"] = "gzip"
+        else:
+            response = current_app.response_class(gzip.decompress(body), mimetype=mimetype)
+    response.set_etag(tag)
+    response.headers["Cache-Control"] = CACHE_CONTROL[kind]
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
 
 
 # -----------------------------
 # Страницы
 # -----------------------------
 
-@app.route("/")
+# Дедлайн на сбор данных главной страницы (секунды)
+INDEX_DEADLINE = 10
+
+@bp.route("/")
 def index():
-    weather = get_region_weather()
-    rates, rates_updated = get_cbr_rates(["USD", "EUR", "CNY"])
-    headlines = get_headlines(limit=10)  # было 8 → стало 10
-    return render_template(
-        "index.html",
-        title="Погода, Новости и Курсы валют",
-        weather=weather,
-        rates=rates,
-        rates_updated=rates_updated,
-        headlines=headlines,
+    # погода, курсы и новости собираются одновременно: время ответа —
+    # самый медленный источник, а не сумма всех. Каждый источник отдаёт
+    # данные вместе с их версией — ETag соответствует именно им
+    results = run_parallel(
+        {
+            "weather": get_region_weather_versioned,
+            "rates": lambda: get_cbr_rates_versioned(["USD", "EUR", "CNY"]),
+            "headlines": lambda: get_headlines_versioned(limit=10),  # было 8 → стало 10
+        },
+        timeout=INDEX_DEADLINE,
+        pool="page",
     )
+    weather, weather_ver = results["weather"][0] or (None, None)
+    if weather is None:
+        weather = [{"city": c["name"], "error": str(results["weather"][1])} for c in CITIES]
+    (rates, rates_updated), rates_ver = results["rates"][0] or (({}, ""), None)
+    headlines, headlines_ver = results["headlines"][0] or ([], None)
+
+    def render():
+        return render_template(
+            "index.html",
+            title="Погода, Новости и Курсы валют",
+            weather=weather,
+            rates=rates,
+            rates_updated=rates_updated,
+            headlines=headlines,
+        )
+
+    versions = (weather_ver, rates_ver, headlines_ver)
+    failed = any(err is not None for _, err in results.values()) or any("error" in w for w in weather)
+    if failed or None in versions:
+        # страницу с ошибками не кэшируем
+        return render()
+    return _cached_response(make_etag("index", *versions), render, "page")
 
-@app.route("/rates")
+@bp.route("/rates")
 def rates_page():
     # на самой странице «Курсы валют» — только поиск (карточки основных курсов НЕ показываем)
     return render_template("rates.html", title="Курсы ЦБ РФ")
 
-@app.route("/news")
+@bp.route("/news")
 def news_page():
-    headlines = get_headlines(limit=20)
-    return render_template("news.html", title="Новости", headlines=headlines)
+    headlines, version = get_headlines_versioned(limit=20)
 
-@app.route("/weather")
+    def render():
+        return render_template("news.html", title="Новости", headlines=headlines)
+
+    if version is None:
+        return render()
+    return _cached_response(make_etag("news", version), render, "page")
+
+@bp.route("/weather")
 def weather_search_page():
     return render_template("weather_search.html", title="Поиск по местоположению")
 
-@app.route("/weather/7days")
+@bp.route("/weather/7days")
 def weather_weekly_page():
     return render_template("weather_weekly.html", title="Погода на 7 дней")
 
@@ -52,254 +209,188 @@ def weather_weekly_page():
 # Внутренние API (JSON)
 # -----------------------------
 
-@app.get("/api/cities")
+@bp.get("/api/cities")
 def api_cities():
     q = (request.args.get("q") or "").strip()
     results = search_cities(q, count=7, lang="ru")
     return jsonify(results)
 
-@app.get("/api/weather")
-def api_weather():
-    try:
-        lat = float(request.args["lat"])
-        lon = float(request.args["lon"])
-    except (KeyError, ValueError):
-        return jsonify({"error": "lat and lon are required floats"}), 400
-
-    data = fetch_open_meteo(
-        lat, lon,
-        hourly=["temperature_2m", "apparent_temperature", "precipitation", "weather_code", "wind_speed_10m"],
-        daily=["temperature_2m_max", "temperature_2m_min", "precipitation_sum", "wind_speed_10m_max", "sunrise", "sunset"],
-        forecast_days=1,
+# Наборы полей прогноза. Недельный запрос берёт надмножество дневного
+# (включая почасовые поля), чтобы «сегодня» отдавалось из его кэша.
+WEATHER_HOURLY = ["temperature_2m", "apparent_temperature", "precipitation", "weather_code", "wind_speed_10m"]
+WEATHER_DAILY = ["temperature_2m_max", "temperature_2m_min", "precipitation_sum", "wind_speed_10m_max", "sunrise", "sunset"]
+WEEKLY_DAILY = ["weather_code", *WEATHER_DAILY]
+
+def _coords():
+    return parse_coords(request.args.get("lat"), request.args.get("lon"))
+
+def _weather_response(kind, coords, version, build):
+    if version is None:
+        return current_app.response_class(forecast.dumps(build()), mimetype="application/json")
+    etag = make_etag(
+        "weather", kind, quantize(coords[0]), quantize(coords[1]),
+        request.args.get("format"), version,
     )
+    return _cached_response(etag, lambda: forecast.dumps(build()), "weather", "application/json")
 
-    cur = data.get("current", {}) or {}
-    hourly_block = data.get("hourly", {}) or {}
-    hourly_times = hourly_block.get("time") or []
-
-    def pick(block, key, idx):
-        arr = block.get(key) or []
-        if not isinstance(arr, list):
-            return None
-        try:
-            return arr[idx]
-        except IndexError:
-            return None
-
-    hourly_points = [
-        {
-            "time": iso_time,
-            "temp": pick(hourly_block, "temperature_2m", idx),
-            "feels": pick(hourly_block, "apparent_temperature", idx),
-            "precip": pick(hourly_block, "precipitation", idx),
-            "code": pick(hourly_block, "weather_code", idx),
-            "wind": pick(hourly_block, "wind_speed_10m", idx),
-        }
-        for idx, iso_time in enumerate(hourly_times)
-    ]
-
-    daily = data.get("daily", {}) or {}
-
-    def pick_first(block, key):
-        arr = block.get(key) or []
-        if isinstance(arr, list) and arr:
-            return arr[0]
-        return None
-
-    daily_summary = {
-        "time": pick_first(daily, "time"),
-        "temp_max": pick_first(daily, "temperature_2m_max"),
-        "temp_min": pick_first(daily, "temperature_2m_min"),
-        "precip_sum": pick_first(daily, "precipitation_sum"),
-        "wind_max": pick_first(daily, "wind_speed_10m_max"),
-        "sunrise": pick_first(daily, "sunrise"),
-        "sunset": pick_first(daily, "sunset"),
-    }
-
-    code = cur.get("weather_code")
-    icon, desc, anim = code_to_icon_desc(int(code) if code is not None else -1)
+# ?format=columns — массивы Open-Meteo как есть, без словаря на каждый час/день
 
-    return jsonify(
-        {
-            "current": {
-                "temp": cur.get("temperature_2m"),
-                "feels": cur.get("apparent_temperature"),
-                "precip": cur.get("precipitation"),
-                "wind": cur.get("wind_speed_10m"),
-                "wdir": cur.get("wind_direction_10m"),
-                "time": cur.get("time"),
-                "code": code,
-                "icon": icon,
-                "desc": desc,
-                "anim": anim,
-            },
-            "hourly": hourly_points,
-            "hourly_units": data.get("hourly_units", {}),
-            "daily": daily_summary,
-            "daily_units": data.get("daily_units", {}),
-        }
+@bp.get("/api/weather")
+def api_weather():
+    coords = _coords()
+    if coords is None:
+        return jsonify({"error": "lat in [-90, 90] and lon in [-180, 180] are required"}), 400
+
+    data, version = get_forecast_versioned(
+        *coords,
+        hourly=WEATHER_HOURLY,
+        daily=WEATHER_DAILY,
+        forecast_days=1,
     )
+    shape = forecast.columns_today if request.args.get("format") == "columns" else forecast.shape_today
+    return _weather_response("today", coords, version, lambda: shape(data))
 
 
-@app.get("/api/weather/weekly")
+@bp.get("/api/weather/weekly")
 def api_weather_weekly():
-    try:
-        lat = float(request.args["lat"])
-        lon = float(request.args["lon"])
-    except (KeyError, ValueError):
-        return jsonify({"error": "lat and lon are required floats"}), 400
-
-    data = fetch_open_meteo(
-        lat, lon,
-        daily=["weather_code", "temperature_2m_max", "temperature_2m_min", "precipitation_sum", "wind_speed_10m_max", "sunrise", "sunset"],
+    coords = _coords()
+    if coords is None:
+        return jsonify({"error": "lat in [-90, 90] and lon in [-180, 180] are required"}), 400
+
+    data, version = get_forecast_versioned(
+        *coords,
+        hourly=WEATHER_HOURLY,
+        daily=WEEKLY_DAILY,
         forecast_days=7,
     )
-
-    daily = data.get("daily", {}) or {}
-    times = daily.get("time") or []
-
-    def pick(block, key, idx):
-        arr = block.get(key) or []
-        if not isinstance(arr, list):
-            return None
-        try:
-            return arr[idx]
-        except IndexError:
-            return None
-
-    days = []
-    for idx, iso_date in enumerate(times):
-        code = pick(daily, "weather_code", idx)
-        icon, desc, anim = code_to_icon_desc(int(code) if code is not None else -1)
-        days.append(
-            {
-                "time": iso_date,
-                "code": code,
-                "icon": icon,
-                "desc": desc,
-                "anim": anim,
-                "temp_max": pick(daily, "temperature_2m_max", idx),
-                "temp_min": pick(daily, "temperature_2m_min", idx),
-                "precip_sum": pick(daily, "precipitation_sum", idx),
-                "wind_max": pick(daily, "wind_speed_10m_max", idx),
-                "sunrise": pick(daily, "sunrise", idx),
-                "sunset": pick(daily, "sunset", idx),
-            }
-        )
-
-    return jsonify(
-        {
-            "days": days,
-            "units": data.get("daily_units", {}),
-            "timezone": data.get("timezone_abbreviation"),
-        }
-    )
+    shape = forecast.columns_weekly if request.args.get("format") == "columns" else forecast.shape_weekly
+    return _weather_response("weekly", coords, version, lambda: shape(data))
 
 # ------- Новый API: поиск курсов криптовалют (CoinGecko, в RUB) -------
 # /api/crypto/search?q=btc
 # Возвращает структуру items, совместимую с /api/rates/search (code/name/value/symbol/emoji/...)
-CG_BASE = "https://api.coingecko.com/api/v3"
-
-_CRYPTO_EMOJI = {
-    "bitcoin": "₿", "btc": "₿",
-    "ethereum": "Ξ", "eth": "Ξ",
-    "litecoin": "Ł", "ltc": "Ł",
-    "monero": "ɱ", "xmr": "ɱ",
-    "ripple": "✕", "xrp": "✕",
-    "toncoin": "🧿", "ton": "🧿",
-    "tether": "₮", "usdt": "₮",
-    "binancecoin": "Ⓑ", "bnb": "Ⓑ",
-}
-
-@app.get("/api/crypto/search")
+# Поиск идёт по локальному каталогу монет и снимку цен (services/crypto.py)
+@bp.get("/api/crypto/search")
 def api_crypto_search():
     q = (request.args.get("q") or "").strip()
     if not q:
         return jsonify({"updated": "", "items": []})
 
     try:
-        # 1) найдем подходящие монеты
-        s = requests.get(f"{CG_BASE}/search", params={"query": q}, timeout=12)
-        s.raise_for_status()
-        coins = (s.json() or {}).get("coins", [])[:8]
-        if not coins:
-            return jsonify({"updated": "", "items": []})
-
-        ids = ",".join([c["id"] for c in coins])
-        # 2) цены и 24h динамика в RUB
-        m = requests.get(
-            f"{CG_BASE}/coins/markets",
-            params={"vs_currency": "rub", "ids": ids, "price_change_percentage": "24h", "per_page": 8, "page": 1, "sparkline": "false"},
-            timeout=12,
-        )
-        m.raise_for_status()
-        markets = m.json() or []
-
-        items = []
-        for it in markets:
-            code = (it.get("symbol") or "").upper()
-            name = it.get("name") or ""
-            price = it.get("current_price")
-            change_pct = it.get("price_change_percentage_24h")
-            # аккуратные поля под существующий рендер
-            key = (name or code).lower()
-            emoji = _CRYPTO_EMOJI.get(key) or _CRYPTO_EMOJI.get((code or "").lower()) or "¤"
-            items.append({
-                "code": code,
-                "name": name,
-                "value": price,
-                "symbol": "₽",
-                "emoji": emoji,
-                "accent": "from-emerald-700/40 to-cyan-700/30",
-                "change": None,
-                "change_percent": change_pct,
-            })
-        return jsonify({"updated": "CoinGecko • 24h", "items": items})
+        items = crypto.search(q)
+    except admission.Overloaded:
+        raise
     except Exception as e:
         return jsonify({"updated": "", "items": [], "error": str(e)}), 502
+    if items is None:
+        return jsonify({"updated": "", "items": []})
+    payload = {"updated": "CoinGecko • 24h", "items": items}
+    if g.stale_sources:
+        payload["stale"] = True
+    return jsonify(payload)
 
 
-@app.get("/api/rates/search")
+@bp.get("/api/rates/search")
 def api_rates_search():
-    query = (request.args.get("q") or "").strip().lower()
-    rates, updated = get_cbr_rates(None)
-
-    if query:
-        def _match(item):
-            code, payload = item
-            name = (payload.get("name") or "").lower()
-            return query in code.lower() or query in name
-        filtered = [item for item in rates.items() if _match(item)]
-    else:
-        filtered = list(rates.items())
+    # индекс строится один раз на обновление курсов; ответ — готовые байты JSON
+    q = request.args.get("q") or ""
+    body, version = search_rates_json(q)
+    if version is None:
+        return current_app.response_class(body, mimetype="application/json")
+    return _cached_response(
+        make_etag("rates", version, q.strip().lower()), lambda: body, "rates", "application/json"
+    )
 
-    filtered.sort(key=lambda item: item[0])
-    filtered = filtered[:10]
 
+# /api/rates/history?code=USD&from=2024-01-01&to=2024-12-31&step=week
+# step — число дней или day/week/month/quarter/year; без step точек не больше MAX_POINTS
+@bp.get("/api/rates/history")
+def api_rates_history():
+    code = (request.args.get("code") or "").strip().upper()
+    if not code:
+        return jsonify({"error": "code is required"}), 400
+    try:
+        start = date.fromisoformat(request.args["from"]) if request.args.get("from") else None
+        end = date.fromisoformat(request.args["to"]) if request.args.get("to") else None
+        raw_step = request.args.get("step")
+        step = rates_history.STEPS.get(raw_step) or int(raw_step) if raw_step else None
+    except ValueError:
+        return jsonify({"error": "from/to must be YYYY-MM-DD, step a number of days or day/week/month/quarter/year"}), 400
+    if step is not None and step < 1:
+        return jsonify({"error": "step must be positive"}), 400
+
+    points = rates_history.get_history().series(code, start, end, step)
+    if points is None:
+        return jsonify({"error": f"no history for {code}"}), 404
+    payload = {"code": code, "from": start and start.isoformat(), "to": end and end.isoformat(), "points": points}
+    return current_app.response_class(forecast.dumps(payload), mimetype="application/json")
+
+
+# /api/stream?topics=rates,region_weather,news — Server-Sent Events (services/stream.py).
+# Бесконечный ответ занял бы синхронный воркер gunicorn целиком (и был бы
+# убит по его таймауту), поэтому поток отдаёт только asgi.py.
+STREAM_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+@bp.get("/api/stream")
+def api_stream():
+    return jsonify({"error": "event stream is served only in async mode (asgi:app)"}), 501
+
+
+@bp.get("/api/cache/stats")
+def api_cache_stats():
     return jsonify(
         {
-            "updated": updated,
-            "items": [
-                {
-                    "code": code,
-                    "name": payload.get("name"),
-                    "value": payload.get("value"),
-                    "symbol": payload.get("symbol") or FIAT_META.get(code, {}).get("symbol"),
-                    "emoji": payload.get("emoji") or FIAT_META.get(code, {}).get("emoji"),
-                    "accent": payload.get("accent"),
-                    "change": payload.get("change"),
-                    "change_percent": payload.get("change_percent"),
-                }
-                for code, payload in filtered
-            ],
+            "caches": {name: cache.stats() for name, cache in CACHES.items()},
+            "forecast": forecast_stats(),
+            "responses": responses.stats(),
+            "pages": pages.stats(),
+            "scheduler": scheduler.status(),
+            "upstreams": resilience.status(),
+            "http": http_client.timings(),
+            "admission": admission.stats(),
+            "stream": stream.hub.stats(),
         }
     )
 
 
-@app.route("/health")
+@bp.get("/metrics")
+def metrics_endpoint():
+    return current_app.response_class(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@bp.route("/health")
 def health():
     return {"status": "ok"}, 200
 
 
+# -----------------------------
+# Сборка приложения
+# -----------------------------
+# Фабрика для gunicorn --preload: шаблоны компилируются, индекс геокодера
+# собирается и открывается, снимок данных загружается один раз в мастере,
+# воркеры получают всё готовым после fork.
+# Без --preload байткод шаблонов берётся из JINJA_CACHE_DIR, а не компилируется
+# в каждом воркере заново.
+
+JINJA_CACHE_DIR = os.getenv("JINJA_CACHE_DIR", ".cache/jinja")
+
+def create_app():
+    app = Flask(__name__)
+    app.register_blueprint(bp)
+    if JINJA_CACHE_DIR:
+        os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(JINJA_CACHE_DIR)
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    geocoder.prepare()
+    restored = warmstate.load()
+    if restored:
+        app.logger.info("warm state: %d cache entries restored", restored)
+    return app
+
+
+app = create_app()
+
+
 if __name__ == "__main__":
     app.run(debug=True)
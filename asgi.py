@@ -0,0 +1,252 @@
+import asyncio
+import gzip
+import logging
+import os
+import time
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+
+from app import app as flask_app, STREAM_HEADERS, WEATHER_HOURLY, WEATHER_DAILY, WEEKLY_DAILY
+from services import admission, crypto, forecast, http_client, metrics, stream
+from services.cache import track_stale
+from services.forecast_cache import aget_forecast_versioned, parse_coords, quantize
+from services.geo import asearch_cities
+from services.httpcache import CACHE_CONTROL, cache_for, encoded_etag, make_etag
+from services.rates import asearch_rates_json
+from services.scheduler import scheduler
+
+# Асинхронный режим: API, которые ждут внешние источники, обслуживаются
+# корутинами — один процесс держит сотни ожиданий Open-Meteo/CoinGecko без
+# потока на каждое. Остальные маршруты (страницы, служебные) уходят
+# в Flask-приложение через WsgiToAsgi. Синхронный режим (gunicorn app:app)
+# продолжает работать как раньше.
+#
+#   uvicorn asgi:app --host 0.0.0.0 --port $PORT
+#   gunicorn asgi:app -k uvicorn.workers.UvicornWorker
+
+log = logging.getLogger(__name__)
+
+_wsgi = WsgiToAsgi(flask_app)
+
+
+class Request:
+    def __init__(self, scope):
+        self.path = scope["path"]
+        self.args = {k: v[0] for k, v in parse_qs(scope["query_string"].decode("latin-1")).items()}
+        self.headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope["headers"]}
+        # кэши, отдавшие устаревшие данные (заголовок X-Data-Stale)
+        self.stale = track_stale()
+
+    def etag_matches(self, etag):
+        raw = self.headers.get("if-none-match")
+        if not raw:
+            return False
+        tags = {t.strip().removeprefix("W/").strip('"') for t in raw.split(",")}
+        return etag in tags or "*" in tags
+
+    def accepts_gzip(self):
+        return "gzip" in self.headers.get("accept-encoding", "")
+
+
+class Response:
+    def __init__(self, body=b"", status=200, mimetype="application/json", headers=None):
+        self.body = body
+        self.status = status
+        self.headers = {"Content-Type": mimetype, **(headers or {})}
+
+    def _headers(self):
+        return [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in self.headers.items()]
+
+    async def __call__(self, send, receive):
+        headers = self._headers()
+        headers.append((b"content-length", str(len(self.body)).encode()))
+        await send({"type": "http.response.start", "status": self.status, "headers": headers})
+        await send({"type": "http.response.body", "body": self.body})
+
+
+class StreamingResponse(Response):
+    # тело — асинхронный генератор; отдаётся, пока клиент не отключится
+    def __init__(self, chunks, mimetype, headers=None):
+        super().__init__(status=200, mimetype=mimetype, headers=headers)
+        self.chunks = chunks
+
+    async def __call__(self, send, receive):
+        await send({"type": "http.response.start", "status": self.status, "headers": self._headers()})
+        pump = asyncio.ensure_future(self._pump(send))
+        disconnect = asyncio.ensure_future(_wait_disconnect(receive))
+        try:
+            await asyncio.wait((pump, disconnect), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in (pump, disconnect):
+                task.cancel()
+            await asyncio.gather(pump, disconnect, return_exceptions=True)
+            await self.chunks.aclose()
+        if pump.done() and not pump.cancelled() and pump.exception() is None:
+            await send({"type": "http.response.body", "body": b""})
+
+    async def _pump(self, send):
+        async for chunk in self.chunks:
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+
+
+async def _wait_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+def _json(payload, status=200):
+    return Response(forecast.dumps(payload), status)
+
+
+def _too_many_requests(message, retry_after):
+    headers = {"Retry-After": admission.retry_after_header(retry_after)}
+    return Response(forecast.dumps({"error": message}), 429, headers=headers)
+
+
+def _cached(request, etag, render, kind):
+    # то же, что app._cached_response, но без контекста Flask
+    gzipped = request.accepts_gzip()
+    tag = encoded_etag(etag, gzipped)
+    headers = {"ETag": f'"{tag}"', "Cache-Control": CACHE_CONTROL[kind], "Vary": "Accept-Encoding"}
+    cache = cache_for(kind)
+    if request.etag_matches(tag):
+        cache.not_modified += 1
+        return Response(status=304, headers=headers)
+    body = cache.get_gzip(etag, render)
+    if gzipped:
+        return Response(body, headers={**headers, "Content-Encoding": "gzip"})
+    return Response(gzip.decompress(body), headers=headers)
+
+
+# -----------------------------
+# Маршруты
+# -----------------------------
+
+def _coords(request):
+    return parse_coords(request.args.get("lat"), request.args.get("lon"))
+
+
+async def _weather(request, kind, daily, days, shapes):
+    coords = _coords(request)
+    if coords is None:
+        return _json({"error": "lat in [-90, 90] and lon in [-180, 180] are required"}, 400)
+    data, version = await aget_forecast_versioned(
+        *coords, hourly=WEATHER_HOURLY, daily=daily, forecast_days=days,
+    )
+    fmt = request.args.get("format")
+    shape = shapes[fmt == "columns"]
+    if version is None:
+        return _json(shape(data))
+    etag = make_etag("weather", kind, quantize(coords[0]), quantize(coords[1]), fmt, version)
+    return _cached(request, etag, lambda: forecast.dumps(shape(data)), "weather")
+
+
+async def api_weather(request):
+    return await _weather(request, "today", WEATHER_DAILY, 1, (forecast.shape_today, forecast.columns_today))
+
+
+async def api_weather_weekly(request):
+    return await _weather(request, "weekly", WEEKLY_DAILY, 7, (forecast.shape_weekly, forecast.columns_weekly))
+
+
+async def api_cities(request):
+    q = (request.args.get("q") or "").strip()
+    return _json(await asearch_cities(q, count=7, lang="ru"))
+
+
+async def api_crypto_search(request):
+    q = (request.args.get("q") or "").strip()
+    if not q:
+        return _json({"updated": "", "items": []})
+    try:
+        items = await crypto.asearch(q)
+    except admission.Overloaded:
+        raise
+    except Exception as e:
+        return _json({"updated": "", "items": [], "error": str(e)}, 502)
+    if items is None:
+        return _json({"updated": "", "items": []})
+    payload = {"updated": "CoinGecko • 24h", "items": items}
+    if request.stale:
+        payload["stale"] = True
+    return _json(payload)
+
+
+async def api_rates_search(request):
+    q = request.args.get("q") or ""
+    body, version = await asearch_rates_json(q)
+    if version is None:
+        return Response(body)
+    return _cached(request, make_etag("rates", version, q.strip().lower()), lambda: body, "rates")
+
+
+async def api_stream(request):
+    # SSE без потока на соединение: ожидание — asyncio.Event в общем цикле
+    try:
+        topics = stream.parse_topics(request.args.get("topics"))
+    except ValueError as e:
+        return _json({"error": str(e)}, 400)
+    try:
+        chunks = await stream.aopen_events(topics, request.headers.get("last-event-id"))
+    except stream.TooManyClients:
+        return _json({"error": "too many stream clients"}, 503)
+    return StreamingResponse(chunks, "text/event-stream", STREAM_HEADERS)
+
+
+ROUTES = {
+    "/api/weather": api_weather,
+    "/api/weather/weekly": api_weather_weekly,
+    "/api/cities": api_cities,
+    "/api/crypto/search": api_crypto_search,
+    "/api/rates/search": api_rates_search,
+    "/api/stream": api_stream,
+}
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            if os.getenv("SCHEDULER", "1") != "0":
+                scheduler.start()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await http_client.aclose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    handler = ROUTES.get(scope["path"]) if scope["type"] == "http" else None
+    if handler is None or scope["method"] not in ("GET", "HEAD"):
+        return await _wsgi(scope, receive, send)
+
+    started = time.perf_counter()
+    request = Request(scope)
+    client = scope.get("client") or (None,)
+    retry_after = await admission.acheck(request.path, admission.client_ip(client[0], request.headers.get("x-forwarded-for")))
+    try:
+        if retry_after is not None:
+            response = _too_many_requests("rate limit exceeded", retry_after)
+        else:
+            response = await handler(request)
+    except admission.Overloaded as e:
+        response = _too_many_requests(str(e), e.retry_after)
+    except Exception:
+        log.exception("unhandled error in %s", request.path)
+        response = Response(b"Internal Server Error", 500, "text/plain; charset=utf-8")
+    metrics.observe_request(
+        request.path, scope["method"], response.status, time.perf_counter() - started,
+        None if isinstance(response, StreamingResponse) else len(response.body),
+    )
+    if request.stale:
+        response.headers["X-Data-Stale"] = ",".join(sorted(request.stale))
+    if scope["method"] == "HEAD":
+        if isinstance(response, StreamingResponse):
+            await response.chunks.aclose()
+            response = Response(status=response.status, headers=response.headers)
+        response.body = b""
+    await response(send, receive)
@@ -0,0 +1,361 @@
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Локальные заменители внешних источников для нагрузочных тестов.
+# Ответы повторяют форму того, что разбирают services/weather.py, geo.py,
+# rates.py, news.py и crypto.py; задержка, разброс и доля ошибок настраиваются.
+#
+#   python -m bench.fake_upstreams --port 8900 --latency 0.08 --jitter 0.04 --error-rate 0.01
+#
+# env() возвращает переменные окружения, направляющие приложение сюда.
+
+MSK = timezone(timedelta(hours=3))
+
+HOURLY_UNITS = {
+    "temperature_2m": "°C", "apparent_temperature": "°C", "precipitation": "mm",
+    "weather_code": "wmo code", "wind_speed_10m": "km/h",
+}
+DAILY_UNITS = {
+    "temperature_2m_max": "°C", "temperature_2m_min": "°C", "precipitation_sum": "mm",
+    "wind_speed_10m_max": "km/h", "weather_code": "wmo code", "sunrise": "iso8601", "sunset": "iso8601",
+}
+WEATHER_CODES = (0, 1, 2, 3, 45, 51, 61, 63, 71, 80, 95)
+
+CURRENCIES = [
+    ("USD", "Доллар США", 1, 92.5), ("EUR", "Евро", 1, 100.1), ("CNY", "Китайский юань", 1, 12.7),
+    ("GBP", "Фунт стерлингов", 1, 117.3), ("JPY", "Японских иен", 100, 61.2),
+    ("TRY", "Турецких лир", 10, 27.1), ("KZT", "Казахстанских тенге", 100, 18.6),
+    ("BYN", "Белорусский рубль", 1, 28.4), ("UAH", "Украинских гривен", 10, 22.3),
+    ("AMD", "Армянских драмов", 100, 23.9), ("AZN", "Азербайджанский манат", 1, 54.4),
+    ("AED", "Дирхам ОАЭ", 1, 25.2), ("CHF", "Швейцарский франк", 1, 106.8),
+    ("INR", "Индийских рупий", 10, 11.0), ("BRL", "Бразильский реал", 1, 16.9),
+    ("HKD", "Гонконгский доллар", 1, 11.9), ("SGD", "Сингапурский доллар", 1, 70.6),
+    ("CAD", "Канадский доллар", 1, 67.2), ("AUD", "Австралийский доллар", 1, 61.0),
+    ("PLN", "Польский злотый", 1, 23.4), ("SEK", "Шведских крон", 10, 88.1),
+    ("NOK", "Норвежских крон", 10, 85.5), ("CZK", "Чешских крон", 10, 40.0),
+    ("HUF", "Венгерских форинтов", 100, 25.4), ("RSD", "Сербских динаров", 100, 85.7),
+    ("GEL", "Грузинский лари", 1, 34.0), ("KGS", "Киргизских сомов", 100, 106.0),
+    ("TJS", "Таджикских сомони", 10, 86.7), ("UZS", "Узбекских сумов", 10000, 72.9),
+    ("MDL", "Молдавских леев", 10, 52.3), ("THB", "Таиландских батов", 10, 27.0),
+    ("VND", "Вьетнамских донгов", 10000, 37.4), ("EGP", "Египетских фунтов", 10, 19.1),
+    ("ZAR", "Южноафриканских рэндов", 10, 51.4), ("KRW", "Вон Республики Корея", 1000, 68.6),
+    ("IDR", "Индонезийских рупий", 10000, 58.9), ("QAR", "Катарский риал", 1, 25.4),
+    ("CDF", "Конголезских франков", 1000, 32.5),
+]
+
+CITY_NAMES = [
+    "Москва", "Мурманск", "Муром", "Санкт-Петербург", "Самара", "Саратов", "Петрозаводск",
+    "Пермь", "Псков", "Новгород", "Новосибирск", "Калининград", "Казань", "Екатеринбург",
+    "Омск", "Томск", "Тверь", "Тула", "Владивосток", "Воронеж",
+]
+
+REAL_COINS = [
+    ("bitcoin", "btc", "Bitcoin"), ("ethereum", "eth", "Ethereum"), ("tether", "usdt", "Tether"),
+    ("binancecoin", "bnb", "BNB"), ("ripple", "xrp", "XRP"), ("toncoin", "ton", "Toncoin"),
+    ("litecoin", "ltc", "Litecoin"), ("monero", "xmr", "Monero"), ("solana", "sol", "Solana"),
+    ("dogecoin", "doge", "Dogecoin"),
+]
+N_COINS = 3000
+N_FEEDS = 2
+ITEMS_PER_FEED = 50
+
+
+def _coins():
+    rnd = random.Random(1)
+    coins = list(REAL_COINS)
+    for i in range(N_COINS - len(coins)):
+        sym = "".join(rnd.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rnd.randint(2, 5)))
+        coins.append((f"{sym}-coin-{i}", sym, f"{sym.title()} Coin {i}"))
+    return coins
+
+
+COINS = _coins()
+COIN_RANK = {c[0]: i for i, c in enumerate(COINS)}
+
+
+def _market(coin):
+    coin_id, symbol, name = coin
+    seed = int(hashlib.md5(coin_id.encode()).hexdigest()[:8], 16)
+    return {
+        "id": coin_id,
+        "symbol": symbol,
+        "name": name,
+        "current_price": round(1 + seed % 10_000_000 / 100, 2),
+        "market_cap_rank": COIN_RANK[coin_id] + 1,
+        "price_change_percentage_24h": round((seed % 2000 - 1000) / 100, 2),
+    }
+
+
+# -----------------------------
+# Ответы
+# -----------------------------
+
+def forecast_point(lat, lon, hourly, daily, days, now):
+    rnd = random.Random(hash((round(lat, 2), round(lon, 2))))
+    start = now.replace(minute=0, second=0, microsecond=0, hour=0)
+    out = {
+        "latitude": lat,
+        "longitude": lon,
+        "timezone": "Europe/Moscow",
+        "timezone_abbreviation": "MSK",
+        "utc_offset_seconds": 10800,
+        "current": {
+            "time": now.strftime("%Y-%m-%dT%H:%M"),
+            "temperature_2m": round(rnd.uniform(-20, 30), 1),
+            "apparent_temperature": round(rnd.uniform(-25, 30), 1),
+            "precipitation": round(rnd.uniform(0, 3), 1),
+            "weather_code": rnd.choice(WEATHER_CODES),
+            "wind_speed_10m": round(rnd.uniform(0, 20), 1),
+            "wind_direction_10m": rnd.randint(0, 359),
+        },
+    }
+    if hourly:
+        times = [(start + timedelta(hours=h)).strftime("%Y-%m-%dT%H:%M") for h in range(24 * days)]
+        block = {"time": times}
+        for field in hourly:
+            if field == "weather_code":
+                block[field] = [rnd.choice(WEATHER_CODES) for _ in times]
+            else:
+                block[field] = [round(rnd.uniform(-20, 30), 1) for _ in times]
+        out["hourly"] = block
+        out["hourly_units"] = {"time": "iso8601", **{f: HOURLY_UNITS.get(f, "") for f in hourly}}
+    if daily:
+        dates = [start + timedelta(days=d) for d in range(days)]
+        block = {"time": [d.strftime("%Y-%m-%d") for d in dates]}
+        for field in daily:
+            if field == "sunrise":
+                block[field] = [d.replace(hour=7, minute=12).strftime("%Y-%m-%dT%H:%M") for d in dates]
+            elif field == "sunset":
+                block[field] = [d.replace(hour=18, minute=40).strftime("%Y-%m-%dT%H:%M") for d in dates]
+            elif field == "weather_code":
+                block[field] = [rnd.choice(WEATHER_CODES) for _ in dates]
+            else:
+                block[field] = [round(rnd.uniform(-20, 30), 1) for _ in dates]
+        out["daily"] = block
+        out["daily_units"] = {"time": "iso8601", **{f: DAILY_UNITS.get(f, "") for f in daily}}
+    return out
+
+
+def forecast(params):
+    lats = [float(x) for x in params.get("latitude", "0").split(",")]
+    lons = [float(x) for x in params.get("longitude", "0").split(",")]
+    hourly = [f for f in params.get("hourly", "").split(",") if f]
+    daily = [f for f in params.get("daily", "").split(",") if f]
+    days = int(params.get("forecast_days") or 7)
+    now = datetime.now(MSK)
+    points = [forecast_point(lat, lon, hourly, daily, days, now) for lat, lon in zip(lats, lons)]
+    # Open-Meteo: одна точка — объект, несколько — массив
+    return points[0] if len(points) == 1 else points
+
+
+def geocoding(params):
+    name = (params.get("name") or "").lower()
+    count = int(params.get("count") or 5)
+    results = []
+    for i, city in enumerate(CITY_NAMES):
+        if city.lower().startswith(name[:3]):
+            results.append({
+                "id": 1000 + i,
+                "name": city,
+                "latitude": 50 + i * 0.7,
+                "longitude": 30 + i * 1.3,
+                "country": "Россия",
+                "admin1": f"Область {i}",
+            })
+    return {"results": results[:count], "generationtime_ms": 0.4}
+
+
+def cbr_daily(day):
+    rnd = random.Random(day.toordinal())
+    valute = {}
+    for i, (code, name, nominal, base) in enumerate(CURRENCIES):
+        value = round(base * (1 + rnd.uniform(-0.02, 0.02)), 4)
+        valute[code] = {
+            "ID": f"R01{i:03d}",
+            "NumCode": f"{840 + i:03d}",
+            "CharCode": code,
+            "Nominal": nominal,
+            "Name": name,
+            "Value": value,
+            "Previous": round(value * (1 + rnd.uniform(-0.01, 0.01)), 4),
+        }
+    stamp = datetime.combine(day, datetime.min.time(), MSK).replace(hour=11, minute=30)
+    return {
+        "Date": stamp.isoformat(),
+        "PreviousDate": (stamp - timedelta(days=1)).isoformat(),
+        "PreviousURL": "//www.cbr-xml-daily.ru/archive/previous/daily_json.js",
+        "Timestamp": stamp.isoformat(),
+        "Valute": valute,
+    }
+
+
+def rss(feed_no, now):
+    items = []
+    for i in range(ITEMS_PER_FEED):
+        # новая запись каждые 5 минут: лента обновляется, как настоящая
+        ts = now - timedelta(minutes=5 * i + now.minute % 5)
+        n = int(ts.timestamp()) // 300
+        items.append(
+            "<item>"
+            f"<title>Новость {feed_no}-{n}: событие дня</title>"
+            f"<link>http://news.local/{feed_no}/{n}</link>"
+            f"<guid>news-{feed_no}-{n}</guid>"
+            f"<pubDate>{format_datetime(ts)}</pubDate>"
+            f"<description>Текст новости {n}</description>"
+            "</item>"
+        )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<rss version="2.0"><channel>'
+        f"<title>Лента {feed_no}</title><link>http://news.local/{feed_no}</link>"
+        f"<description>Тестовая лента</description>{''.join(items)}"
+        "</channel></rss>"
+    ).encode()
+
+
+def coins_markets(params):
+    ids = params.get("ids")
+    per_page = int(params.get("per_page") or 100)
+    if ids:
+        wanted = set(ids.split(","))
+        coins = [c for c in COINS if c[0] in wanted]
+    else:
+        page = int(params.get("page") or 1)
+        coins = COINS[(page - 1) * per_page:page * per_page]
+    return [_market(c) for c in coins[:per_page]]
+
+
+def coins_search(params):
+    q = (params.get("query") or "").lower()
+    found = [c for c in COINS if c[1].startswith(q) or c[2].lower().startswith(q)][:25]
+    return {"coins": [{"id": c[0], "symbol": c[1].upper(), "name": c[2]} for c in found]}
+
+
+# -----------------------------
+# Сервер
+# -----------------------------
+
+class Settings:
+    def __init__(self, latency=0.05, jitter=0.02, error_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.requests = {}
+        self._lock = threading.Lock()
+
+    def count(self, route):
+        with self._lock:
+            self.requests[route] = self.requests.get(route, 0) + 1
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # иначе заголовки и тело ждут delayed ACK (~40 мс)
+    settings = Settings()
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body=b"", content_type="application/json", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _conditional(self, body, content_type):
+        # ETag от содержимого: 304, если клиент уже видел эту версию
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self._send(304, headers={"ETag": etag})
+        else:
+            self._send(200, body, content_type, {"ETag": etag})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        s = self.settings
+        s.count(url.path)
+        time.sleep(max(0.0, random.gauss(s.latency, s.jitter)))
+        if random.random() < s.error_rate:
+            return self._send(503, b'{"error":"unavailable"}')
+
+        path = url.path
+        if path == "/v1/forecast":
+            body = json.dumps(forecast(params)).encode()
+        elif path == "/v1/search":
+            body = json.dumps(geocoding(params), ensure_ascii=False).encode()
+        elif path == "/daily_json.js":
+            body = json.dumps(cbr_daily(datetime.now(MSK).date()), ensure_ascii=False).encode()
+            return self._conditional(body, "application/javascript; charset=utf-8")
+        elif path.startswith("/archive/"):
+            y, m, d = (int(x) for x in path.split("/")[2:5])
+            day = datetime(y, m, d).date()
+            if day.weekday() in (6, 0):  # как у ЦБ: по воскресеньям и понедельникам курса нет
+                return self._send(404, b'{"error":"not found"}')
+            body = json.dumps(cbr_daily(day), ensure_ascii=False).encode()
+        elif path.startswith("/rss/"):
+            feed_no = path.rsplit("/", 1)[-1].split(".")[0]
+            return self._conditional(rss(feed_no, datetime.now(timezone.utc)), "application/rss+xml; charset=utf-8")
+        elif path == "/api/v3/coins/list":
+            body = json.dumps([{"id": c[0], "symbol": c[1], "name": c[2]} for c in COINS]).encode()
+        elif path == "/api/v3/coins/markets":
+            body = json.dumps(coins_markets(params)).encode()
+        elif path == "/api/v3/search":
+            body = json.dumps(coins_search(params)).encode()
+        else:
+            return self._send(404, b'{"error":"not found"}')
+        self._send(200, body)
+
+
+def env(base):
+    """Переменные окружения приложения для работы с заменителями по адресу base."""
+    return {
+        "OPEN_METEO_FORECAST_URL": f"{base}/v1/forecast",
+        "OPEN_METEO_GEOCODING_URL": f"{base}/v1/search",
+        "CBR_DAILY_URL": f"{base}/daily_json.js",
+        "CBR_ARCHIVE_URL": f"{base}/archive/{{day:%Y/%m/%d}}/daily_json.js",
+        "COINGECKO_BASE_URL": f"{base}/api/v3",
+        "NEWS_FEEDS": ",".join(f"{base}/rss/{i}.xml" for i in range(N_FEEDS)),
+    }
+
+
+def serve(host="127.0.0.1", port=0, latency=0.05, jitter=0.02, error_rate=0.0):
+    """Запускает сервер в фоновом потоке; возвращает (server, base_url)."""
+    handler = type("BenchHandler", (Handler,), {"settings": Settings(latency, jitter, error_rate)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="fake Open-Meteo / CBR / CoinGecko / RSS upstreams")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=0.05, help="mean response delay, seconds")
+    parser.add_argument("--jitter", type=float, default=0.02, help="delay standard deviation, seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of 503 responses")
+    args = parser.parse_args(argv)
+    server, base = serve(args.host, args.port, args.latency, args.jitter, args.error_rate)
+    for k, v in env(base).items():
+        print(f"export {k}={v}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+import argparse
+import http.client
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from urllib.parse import quote, urlparse
+
+from bench import fake_upstreams
+
+# Нагрузочный прогон маршрутов сайта против локальных заменителей источников.
+#
+#   python -m bench.run                                 # gunicorn app:app, все маршруты
+#   python -m bench.run --server uvicorn --workers 2    # asgi.py
+#   python -m bench.run --routes /api/weather,/news -c 32 -n 1000
+#   python -m bench.run compare bench/results/A.json bench/results/B.json
+#
+# Сценарии:
+#   cold — свежий процесс приложения на каждый маршрут, у каждого запроса
+#          свои параметры: кэши пусты, каждый запрос идёт к источнику
+#          (для / и /news холодным оказывается только первое обращение);
+#   warm — параметры из небольшого набора, прогретого перед замером.
+# Результат — JSON в bench/results/<время>-<коммит>.json.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "bench", "results")
+
+ROUTES = (
+    "/",
+    "/news",
+    "/api/weather",
+    "/api/weather/weekly",
+    "/api/cities",
+    "/api/rates/search",
+    "/api/crypto/search",
+)
+
+SERVERS = {
+    "gunicorn": lambda port, workers, threads: [
+        sys.executable, "-m", "gunicorn", "app:app", "-b", f"127.0.0.1:{port}",
+        "-w", str(workers), "--threads", str(threads), "--log-level", "warning",
+    ],
+    "uvicorn": lambda port, workers, threads: [
+        sys.executable, "-m", "uvicorn", "asgi:app", "--host", "127.0.0.1", "--port", str(port),
+        "--workers", str(workers), "--log-level", "warning",
+    ],
+    "flask": lambda port, workers, threads: [
+        sys.executable, "-m", "flask", "--app", "app", "run", "--port", str(port),
+    ],
+}
+
+WARM_POOL = 20
+
+
+# -----------------------------
+# Параметры запросов
+# -----------------------------
+
+def _coords(i):
+    # точки в разных ячейках сетки прогноза
+    return f"lat={55 + (i % 400) * 0.05:.4f}&lon={30 + (i // 400) * 0.05:.4f}"
+
+
+RATE_QUERIES = ["usd", "eur", "доллар", "юань", "фунт", "kzt", "try", "франк", "иен", "д", "ев", "cny"]
+CRYPTO_QUERIES = ["btc", "eth", "bitcoin", "ton", "sol", "doge", "xrp", "usdt", "ltc", "bnb"]
+CITY_QUERIES = ["мос", "мур", "санкт", "пет", "пск", "нов", "кал", "каз", "омск", "тве", "вла", "вор"]
+
+
+def paths(route, n, cold):
+    """n путей для маршрута; cold — без повторов параметров."""
+    pool = range(n) if cold else [i % WARM_POOL for i in range(n)]
+    out = []
+    for i in pool:
+        if route in ("/", "/news"):
+            out.append(route)
+        elif route.startswith("/api/weather"):
+            out.append(f"{route}?{_coords(i)}")
+        elif route == "/api/cities":
+            q = CITY_QUERIES[i % len(CITY_QUERIES)] + (str(i) if cold else "")
+            out.append(f"{route}?q={quote(q)}")
+        elif route == "/api/rates/search":
+            # данные курсов одни на все запросы: холодным будет первый
+            out.append(f"{route}?q={quote(RATE_QUERIES[i % len(RATE_QUERIES)])}")
+        elif route == "/api/crypto/search":
+            if cold:
+                # символы разных монет, в т.ч. вне топа — догрузка цен пачками
+                q = fake_upstreams.COINS[i * 7 % len(fake_upstreams.COINS)][1]
+            else:
+                q = CRYPTO_QUERIES[i % len(CRYPTO_QUERIES)]
+            out.append(f"{route}?q={quote(q)}")
+    return out
+
+
+# -----------------------------
+# Нагрузка
+# -----------------------------
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    k = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+
+def load(base, path_list, concurrency, timeout=30):
+    """Прогоняет path_list в concurrency соединений keep-alive; возвращает сводку."""
+    target = urlparse(base)
+    lock = threading.Lock()
+    queue = iter(path_list)
+    latencies, statuses, errors = [], {}, []
+
+    def worker():
+        conn = http.client.HTTPConnection(target.hostname, target.port, timeout=timeout)
+        while True:
+            with lock:
+                path = next(queue, None)
+            if path is None:
+                break
+            started = time.perf_counter()
+            try:
+                conn.request("GET", path, headers={"Accept-Encoding": "gzip"})
+                r = conn.getresponse()
+                r.read()
+                status = r.status
+            except Exception as e:
+                conn.close()
+                conn = http.client.HTTPConnection(target.hostname, target.port, timeout=timeout)
+                status = type(e).__name__
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+                if not isinstance(status, int) or status >= 500:
+                    errors.append(status)
+        conn.close()
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    ms = lambda v: round(v * 1000, 3) if v is not None else None
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "statuses": statuses,
+        "seconds": round(wall, 3),
+        "rps": round(len(latencies) / wall, 1) if wall else 0.0,
+        "mean_ms": ms(sum(latencies) / len(latencies)) if latencies else None,
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+        "max_ms": ms(latencies[-1] if latencies else None),
+    }
+
+
+# -----------------------------
+# Приложение под нагрузкой
+# -----------------------------
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class AppProcess:
+    """Процесс приложения, направленный на заменители источников."""
+
+    def __init__(self, server, workers, threads, upstream_env):
+        self.port = _free_port()
+        self.base = f"http://127.0.0.1:{self.port}"
+        self.tmp = tempfile.TemporaryDirectory(prefix="bench-")
+        env = {
+            **os.environ,
+            **upstream_env,
+            # без планировщика и общего кэша: замер показывает сам путь запроса
+            "SCHEDULER": "0",
+            "CACHE_BACKEND": "memory",
+            "CACHE_PERSISTENT_PATH": os.path.join(self.tmp.name, "persistent.sqlite3"),
+            "METRICS_DIR": os.path.join(self.tmp.name, "metrics"),
+            "RATES_HISTORY_DIR": os.path.join(self.tmp.name, "rates_history"),
+            "WARM_STATE_PATH": os.path.join(self.tmp.name, "warm_state.bin"),
+            "JINJA_CACHE_DIR": os.path.join(self.tmp.name, "jinja"),
+            # весь поток нагрузки идёт с одного адреса
+            "RATE_LIMITS": "off",
+        }
+        self.log = open(os.path.join(self.tmp.name, "app.log"), "w+b")
+        self.proc = subprocess.Popen(
+            SERVERS[server](self.port, workers, threads), cwd=ROOT, env=env,
+            stdout=self.log, stderr=subprocess.STDOUT,
+        )
+
+    def wait_ready(self, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.proc.poll() is not None:
+                self.log.seek(0)
+                raise RuntimeError(f"app exited: {self.log.read().decode(errors='replace')[-2000:]}")
+            try:
+                conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=1)
+                conn.request("GET", "/health")
+                if conn.getresponse().status == 200:
+                    return self
+            except OSError:
+                time.sleep(0.1)
+        raise RuntimeError("app did not become ready")
+
+    def stop(self):
+        self.proc.terminate()
+        try:
+            self.proc.wait(10)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+        self.log.close()
+        self.tmp.cleanup()
+
+
+def _git(*args):
+    try:
+        return subprocess.check_output(["git", *args], cwd=ROOT, stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def run(args):
+    routes = args.routes.split(",") if args.routes else list(ROUTES)
+    upstream_env = {}
+    fake = None
+    if not args.target:
+        fake, fake_base = fake_upstreams.serve(
+            latency=args.latency, jitter=args.jitter, error_rate=args.error_rate
+        )
+        upstream_env = fake_upstreams.env(fake_base)
+
+    def app_process():
+        return AppProcess(args.server, args.workers, args.threads, upstream_env).wait_ready()
+
+    results = {"cold": {}, "warm": {}}
+    try:
+        for route in routes:
+            app = None if args.target else app_process()
+            base = args.target or app.base
+            try:
+                results["cold"][route] = load(base, paths(route, args.requests, cold=True), args.concurrency)
+                # прогрев: каждый параметр из набора по разу, последовательно
+                load(base, paths(route, WARM_POOL, cold=False), 1)
+                results["warm"][route] = load(base, paths(route, args.requests, cold=False), args.concurrency)
+            finally:
+                if app is not None:
+                    app.stop()
+            for scenario in ("cold", "warm"):
+                r = results[scenario][route]
+                print(f"{scenario:4} {route:22} {r['rps']:>8} req/s  p50 {r['p50_ms']:>8} ms  "
+                      f"p95 {r['p95_ms']:>8} ms  p99 {r['p99_ms']:>8} ms  errors {r['errors']}")
+    finally:
+        if fake is not None:
+            fake.shutdown()
+
+    commit = _git("rev-parse", "--short", "HEAD") or "unknown"
+    report = {
+        "meta": {
+            "commit": commit,
+            "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "server": "external" if args.target else args.server,
+            "target": args.target,
+            "workers": args.workers,
+            "threads": args.threads,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "upstream": None if args.target else {
+                "latency": args.latency, "jitter": args.jitter, "error_rate": args.error_rate,
+            },
+        },
+        "results": results,
+    }
+    os.makedirs(args.out, exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    path = os.path.join(args.out, f"{stamp}-{commit}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"results -> {path}")
+    return 0
+
+
+def compare(args):
+    """Сравнивает два отчёта; код возврата 1, если p95 или req/s ухудшились больше порога."""
+    with open(args.old, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(args.new, encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"{old['meta']['commit']} -> {new['meta']['commit']}")
+    regressed = False
+    for scenario, routes in new["results"].items():
+        for route, r in routes.items():
+            o = old["results"].get(scenario, {}).get(route)
+            if o is None:
+                continue
+            d_rps = (r["rps"] - o["rps"]) / o["rps"] if o["rps"] else 0.0
+            d_p95 = (r["p95_ms"] - o["p95_ms"]) / o["p95_ms"] if o["p95_ms"] else 0.0
+            bad = d_p95 > args.threshold or d_rps < -args.threshold
+            regressed |= bad
+            print(f"{scenario:4} {route:22} req/s {o['rps']:>8} -> {r['rps']:>8} ({d_rps:+.0%})  "
+                  f"p95 {o['p95_ms']:>8} -> {r['p95_ms']:>8} ms ({d_p95:+.0%}){'  REGRESSION' if bad else ''}")
+    return 1 if regressed else 0
+
+
+def main(argv=None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if argv[:1] == ["compare"]:
+        parser = argparse.ArgumentParser(prog="python -m bench.run compare")
+        parser.add_argument("old")
+        parser.add_argument("new")
+        parser.add_argument("--threshold", type=float, default=0.2, help="allowed relative degradation")
+        return compare(parser.parse_args(argv[1:]))
+
+    parser = argparse.ArgumentParser(prog="python -m bench.run")
+    parser.add_argument("--server", choices=sorted(SERVERS), default="gunicorn")
+    parser.add_argument("--target", help="benchmark an already running app instead of spawning one")
+    parser.add_argument("--routes", help="comma-separated routes (default: all)")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("-c", "--concurrency", type=int, default=16)
+    parser.add_argument("-n", "--requests", type=int, default=500, help="requests per route and scenario")
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--out", default=RESULTS_DIR)
+    return run(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
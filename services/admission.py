@@ -0,0 +1,258 @@
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+from services import metrics
+from services.cache import get_backend, token_bucket
+
+log = logging.getLogger(__name__)
+
+# Защита квот внешних API и воркеров от одного агрессивного клиента.
+#
+# 1. Token bucket на (IP клиента, маршрут) для маршрутов, которые ходят во
+#    внешние API. Корзины — в памяти воркера или (RATE_LIMIT_STORE=shared)
+#    в общем хранилище кэша, тогда лимит общий для всех воркеров.
+# 2. Не больше N одновременных запросов к каждому источнику в процессе
+#    (resilience.call/acall). Остальные ждут в очереди; если очередь длинная
+#    или ожидание затянулось — Overloaded: кэш отдаёт устаревшее значение,
+#    если оно есть, иначе клиент получает 429.
+#
+# Обычный пользователь не упирается ни в лимит, ни в очередь: при всплеске
+# лишние запросы быстро отклоняются, а не копятся в воркерах.
+
+# маршрут -> (токенов в секунду, ёмкость корзины)
+ROUTE_LIMITS = {
+    "/api/cities": (5, 20),
+    "/api/crypto/search": (2, 10),
+    "/api/weather": (2, 10),
+    "/api/weather/weekly": (2, 10),
+    # переподключения SSE (asgi.py): у каждого соединения — подписка в хабе
+    "/api/stream": (0.5, 10),
+}
+# RATE_LIMITS="/api/cities=5:20,/api/weather=2:10" — переопределить; "off" — выключить
+if os.getenv("RATE_LIMITS"):
+    ROUTE_LIMITS = {} if os.environ["RATE_LIMITS"] == "off" else {
+        route.strip(): tuple(float(x) for x in limit.split(":"))
+        for route, limit in (item.split("=") for item in os.environ["RATE_LIMITS"].split(",") if item.strip())
+    }
+
+RATE_LIMIT_STORE = os.getenv("RATE_LIMIT_STORE", "memory")  # memory | shared
+MAX_BUCKETS = 50000
+# сколько прокси перед приложением дописывают X-Forwarded-For; по умолчанию
+# ни одного (flask run, gunicorn без прокси), за роутером Heroku — 1 (Procfile)
+TRUSTED_PROXIES = int(os.getenv("TRUSTED_PROXIES", "0"))
+
+UPSTREAM_CONCURRENCY = int(os.getenv("UPSTREAM_CONCURRENCY", "8"))
+UPSTREAM_LIMITS = {"open-meteo": 16, "open-meteo-grid": 2, "coingecko": 4}
+# дольше в очереди не ждём: быстрый отказ лучше зависшего воркера
+QUEUE_SECONDS = float(os.getenv("UPSTREAM_QUEUE_SECONDS", "3"))
+MAX_QUEUE = int(os.getenv("UPSTREAM_MAX_QUEUE", "32"))
+
+
+class Overloaded(Exception):
+    def __init__(self, message, retry_after=1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def retry_after_header(seconds):
+    return str(max(1, math.ceil(seconds)))
+
+
+# -----------------------------
+# Лимиты по клиентам
+# -----------------------------
+
+_xff_warned = False
+
+
+def client_ip(remote_addr, forwarded_for=None):
+    # адрес, который дописал последний доверенный прокси; клиент может
+    # подставить в X-Forwarded-For что угодно, но только левее
+    global _xff_warned
+    if TRUSTED_PROXIES and forwarded_for:
+        hops = [h.strip() for h in forwarded_for.split(",") if h.strip()]
+        if hops:
+            return hops[-min(TRUSTED_PROXIES, len(hops))]
+    elif forwarded_for and not _xff_warned:
+        _xff_warned = True
+        log.warning("X-Forwarded-For from %s ignored: TRUSTED_PROXIES=0, limits are per remote address",
+                    remote_addr)
+    return remote_addr or "-"
+
+
+class _MemoryBuckets:
+    def __init__(self, maxsize=MAX_BUCKETS):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take_token(self, name, rate, burst):
+        now = time.monotonic()
+        with self._lock:
+            tokens, allowed = token_bucket(self._data.pop(name, None), rate, burst, now)
+            self._data[name] = (tokens, now)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return allowed, 0.0 if allowed else (1 - tokens) / rate
+
+
+_buckets = _MemoryBuckets()
+_lock = threading.Lock()
+_rejected = {}  # маршрут -> число отказов
+
+
+def _store():
+    if RATE_LIMIT_STORE == "shared":
+        return get_backend() or _buckets
+    return _buckets
+
+
+def check(route, ip):
+    """None — запрос допущен, иначе через сколько секунд повторить."""
+    limit = ROUTE_LIMITS.get(route)
+    if limit is None:
+        return None
+    rate, burst = limit
+    try:
+        allowed, retry_after = _store().take_token(f"{route}|{ip}", rate, burst)
+    except Exception:
+        # общее хранилище недоступно — пропускаем, а не отказываем всем
+        log.warning("rate limit store failed", exc_info=True)
+        return None
+    if allowed:
+        return None
+    with _lock:
+        _rejected[route] = _rejected.get(route, 0) + 1
+    metrics.inc("nw_admission_rejected_total", route=route)
+    return retry_after
+
+
+async def acheck(route, ip):
+    """check() для event loop: общее хранилище (SQLite BEGIN IMMEDIATE или
+    запрос к Redis) может ждать — тогда проверка уходит в поток."""
+    if route not in ROUTE_LIMITS or _store() is _buckets:
+        return check(route, ip)
+    return await asyncio.to_thread(check, route, ip)
+
+
+# -----------------------------
+# Одновременные запросы к источникам
+# -----------------------------
+
+class _Waiter:
+    __slots__ = ("handed", "wake")
+
+    def __init__(self, wake):
+        self.handed = False  # место передано при освобождении
+        self.wake = wake
+
+
+class UpstreamGate:
+    """Семафор с ограниченной очередью, общий для потоков и корутин процесса."""
+
+    def __init__(self, name, limit):
+        self.name = name
+        self.limit = limit
+        self.active = 0
+        self.shed = 0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    def _enter_locked(self):
+        # True — место занято сразу; иначе в очередь (или Overloaded)
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return True
+        if len(self._waiters) >= MAX_QUEUE:
+            self._shed_locked("queue_full")
+        return False
+
+    def _shed_locked(self, reason):
+        self.shed += 1
+        metrics.inc("nw_upstream_shed_total", upstream=self.name, reason=reason)
+        raise Overloaded(f"{self.name}: too many concurrent requests ({reason})")
+
+    def _give_up(self, waiter, reason):
+        with self._lock:
+            if waiter.handed:
+                return
+            self._waiters.remove(waiter)
+            self._shed_locked(reason)
+
+    def acquire(self, timeout):
+        with self._lock:
+            if self._enter_locked():
+                return
+            event = threading.Event()
+            waiter = _Waiter(event.set)
+            self._waiters.append(waiter)
+        event.wait(timeout)
+        self._give_up(waiter, "timeout")
+
+    async def aacquire(self, timeout):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._enter_locked():
+                return
+            event = asyncio.Event()
+            waiter = _Waiter(lambda: loop.call_soon_threadsafe(event.set))
+            self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            with self._lock:
+                if not waiter.handed:
+                    self._waiters.remove(waiter)
+            if waiter.handed:
+                self.release()
+            raise
+        self._give_up(waiter, "timeout")
+
+    def release(self):
+        with self._lock:
+            waiter = self._waiters.popleft() if self._waiters else None
+            if waiter is not None:
+                waiter.handed = True  # место переходит ждущему, active не меняется
+            else:
+                self.active -= 1
+        if waiter is not None:
+            try:
+                waiter.wake()
+            except RuntimeError:
+                self.release()  # цикл событий ждущего уже закрыт — место дальше
+
+    def status(self):
+        with self._lock:
+            return {"limit": self.limit, "active": self.active, "waiting": len(self._waiters), "shed": self.shed}
+
+
+GATES = {}
+_gates_lock = threading.Lock()
+
+
+def gate(upstream):
+    with _gates_lock:
+        g = GATES.get(upstream)
+        if g is None:
+            g = GATES[upstream] = UpstreamGate(upstream, UPSTREAM_LIMITS.get(upstream, UPSTREAM_CONCURRENCY))
+        return g
+
+
+def stats():
+    with _lock:
+        rejected = dict(_rejected)
+    with _gates_lock:
+        gates = list(GATES.values())
+    return {
+        "store": RATE_LIMIT_STORE,
+        "limits": {route: {"rate": r, "burst": b} for route, (r, b) in ROUTE_LIMITS.items()},
+        "rejected": rejected,
+        "upstreams": {g.name: g.status() for g in gates},
+    }
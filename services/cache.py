@@ -1,15 +1,719 @@
+import asyncio
+import inspect
+import logging
+import os
+import pickle
+import sqlite3
+import threading
 import time
+import zlib
+from collections import OrderedDict
+from contextvars import ContextVar
 from functools import wraps
 
-def ttl_cache(ttl_seconds=600):
+from services.fanout import get_pool
+
+log = logging.getLogger(__name__)
+
+# Все кэши процесса по имени функции — для статистики и сброса
+CACHES = {}
+
+# Имена кэшей, отдавших устаревшие данные в рамках текущего запроса
+_stale_sources = ContextVar("stale_sources", default=None)
+
+
+def track_stale():
+    """Начинает учёт устаревших данных для текущего запроса; возвращает множество имён."""
+    sources = set()
+    _stale_sources.set(sources)
+    return sources
+
+
+def mark_stale(name):
+    sources = _stale_sources.get()
+    if sources is not None:
+        sources.add(name)
+
+
+# Сколько хранить запись в общем хранилище после истечения TTL: устаревшее
+# значение лучше пустого при холодном старте
+STALE_GRACE = int(os.getenv("CACHE_STALE_GRACE", "86400"))
+# Сколько секунд после истечения TTL запись отдаётся сразу, с обновлением в
+# фоне. Дальше запрос ждёт обновления, а устаревшее значение получает, только
+# если источник недоступен (ошибка, открытый breaker, перегрузка).
+MAX_STALE = int(os.getenv("CACHE_MAX_STALE", "3600"))
+
+# Сериализация: pickle, крупные значения ещё и сжимаются.
+# Первый байт — признак сжатия.
+#
+# Граница доверия: loads — это pickle.loads, то есть выполнение кода. Любой,
+# кто может писать в общее хранилище (Redis, файл SQLite, снимок warmstate),
+# может выполнить код в воркерах. Хранилище должно быть только нашим:
+# отдельный Redis (или база) с паролем/TLS, недоступный другим приложениям,
+# каталог .cache — с правами только для пользователя приложения.
+_RAW, _ZLIB = b"r", b"z"
+_COMPRESS_FROM = 1024
+
+
+def dumps(value):
+    blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    if len(blob) >= _COMPRESS_FROM:
+        return _ZLIB + zlib.compress(blob, 6)
+    return _RAW + blob
+
+
+def loads(blob):
+    blob = bytes(blob)
+    if blob[:1] == _ZLIB:
+        return pickle.loads(zlib.decompress(blob[1:]))
+    return pickle.loads(blob[1:])
+
+
+class SQLiteBackend:
+    """Общее для всех воркеров хранилище в файле SQLite (режим WAL)."""
+
+    def __init__(self, path):
+        self.path = path
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self._local = threading.local()
+        self._inherited = []
+        self._writes = 0
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY, value BLOB NOT NULL,"
+            " ts REAL NOT NULL, expires REAL NOT NULL, purge_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS locks (name TEXT PRIMARY KEY, owner TEXT NOT NULL, until REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL NOT NULL, ts REAL NOT NULL)"
+        )
+
+    def _conn(self):
+        # соединение на поток и процесс: после fork (gunicorn --preload)
+        # соединение мастера воркеру не годится
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            if conn is not None:
+                # не закрываем: close в дочернем процессе может сделать
+                # checkpoint и удалить -wal, которым пользуется родитель
+                self._inherited.append(conn)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute(
+            "SELECT value, ts, expires FROM entries WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        return loads(row[0]), row[1], row[2]
+
+    def set(self, key, value, ts, expires):
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO entries (key, value, ts, expires, purge_at) VALUES (?, ?, ?, ?, ?)",
+            (key, dumps(value), ts, expires, expires + STALE_GRACE),
+        )
+        self._writes += 1
+        if self._writes % 200 == 0:
+            conn.execute("DELETE FROM entries WHERE purge_at < ?", (time.time(),))
+
+    def acquire_lock(self, name, owner, ttl):
+        # лок с владельцем и сроком: продлить свой или занять просроченный
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT owner, until FROM locks WHERE name = ?", (name,)).fetchone()
+            if row is None or row[0] == owner or row[1] < now:
+                conn.execute(
+                    "INSERT OR REPLACE INTO locks (name, owner, until) VALUES (?, ?, ?)",
+                    (name, owner, now + ttl),
+                )
+                got = True
+            else:
+                got = False
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return got
+
+    def release_lock(self, name, owner):
+        self._conn().execute("DELETE FROM locks WHERE name = ? AND owner = ?", (name, owner))
+
+    def take_token(self, name, rate, burst):
+        # token bucket: (взят ли токен, через сколько секунд появится следующий)
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, ts FROM buckets WHERE name = ?", (name,)).fetchone()
+            tokens, allowed = token_bucket(row, rate, burst, now)
+            conn.execute("INSERT OR REPLACE INTO buckets (name, tokens, ts) VALUES (?, ?, ?)", (name, tokens, now))
+            self._writes += 1
+            if self._writes % 200 == 0:
+                # полные корзины без обращений можно забыть
+                conn.execute("DELETE FROM buckets WHERE ts < ?", (now - 3600,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return allowed, 0.0 if allowed else (1 - tokens) / rate
+
+
+class RedisBackend:
+    """Хранилище в Redis или совместимом сервере.
+
+    client — любой объект с get/set(px=, nx=)/delete/eval в стиле redis-py,
+    в тестах — tests/fake_redis.py. Значения — pickle: сервер должен быть
+    доверенным (см. «Граница доверия» выше).
+    """
+
+    _RELEASE = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+    _TAKE = """
+local b = redis.call('hmget', KEYS[1], 'tokens', 'ts')
+local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local tokens = math.min(burst, (tonumber(b[1]) or burst) + math.max(0, now - (tonumber(b[2]) or now)) * rate)
+local allowed = 0
+if tokens >= 1 then tokens = tokens - 1; allowed = 1 end
+redis.call('hset', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('pexpire', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return {allowed, tostring(tokens)}
+"""
+
+    def __init__(self, client, prefix="nw:"):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        blob = self.client.get(self.prefix + key)
+        if blob is None:
+            return None
+        return loads(blob)
+
+    def set(self, key, value, ts, expires):
+        ttl_ms = max(int((expires + STALE_GRACE - time.time()) * 1000), 1)
+        self.client.set(self.prefix + key, dumps((value, ts, expires)), px=ttl_ms)
+
+    def acquire_lock(self, name, owner, ttl):
+        key = self.prefix + "lock:" + name
+        if self.client.set(key, owner, nx=True, px=int(ttl * 1000)):
+            return True
+        current = self.client.get(key)
+        if current is not None and (current.decode() if isinstance(current, bytes) else current) == owner:
+            self.client.set(key, owner, px=int(ttl * 1000))
+            return True
+        return False
+
+    def release_lock(self, name, owner):
+        self.client.eval(self._RELEASE, 1, self.prefix + "lock:" + name, owner)
+
+    def take_token(self, name, rate, burst):
+        allowed, tokens = self.client.eval(self._TAKE, 1, self.prefix + "bucket:" + name, rate, burst, time.time())
+        tokens = float(tokens)
+        return bool(allowed), 0.0 if allowed else (1 - tokens) / rate
+
+
+def token_bucket(state, rate, burst, now):
+    # state — (токены, время) или None; возвращает (остаток, взят ли токен)
+    tokens, ts = state if state is not None else (burst, now)
+    tokens = min(burst, tokens + max(0.0, now - ts) * rate)
+    if tokens >= 1:
+        return tokens - 1, True
+    return tokens, False
+
+
+DEFAULT_SQLITE_PATH = ".cache/cache.sqlite3"
+
+
+def backend_from_url(url):
+    # CACHE_BACKEND: "" / "memory" — только память процесса,
+    # "sqlite:///path/cache.db", "redis://host:6379/0"
+    if not url or url == "memory":
+        return None
+    if url.startswith("sqlite://"):
+        return SQLiteBackend(url[len("sqlite://"):] or DEFAULT_SQLITE_PATH)
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        import redis
+        return RedisBackend(redis.Redis.from_url(url))
+    raise ValueError(f"Unknown CACHE_BACKEND: {url}")
+
+
+_backend = backend_from_url(os.getenv("CACHE_BACKEND", ""))
+
+
+def get_backend():
+    return _backend
+
+
+# Долгоживущие служебные данные (например, валидаторы HTTP) должны
+# переживать перезапуск даже без общего кэша — тогда храним их в локальном SQLite
+PERSISTENT_SQLITE_PATH = os.getenv("CACHE_PERSISTENT_PATH", ".cache/persistent.sqlite3")
+_persistent = None
+_persistent_lock = threading.Lock()
+
+
+def persistent_backend():
+    global _persistent
+    if _backend is not None:
+        return _backend
+    with _persistent_lock:
+        if _persistent is None:
+            _persistent = SQLiteBackend(PERSISTENT_SQLITE_PATH)
+        return _persistent
+
+
+def set_backend(backend):
+    global _backend
+    _backend = backend
+
+
+def _freeze(value):
+    # Списки/словари → хэшируемые кортежи, чтобы их можно было использовать в ключе
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, set):
+        return tuple(sorted(_freeze(v) for v in value))
+    return value
+
+
+class _Inflight:
+    # Один вычисляющий поток на ключ; остальные ждут на event, который
+    # взводится, как только есть что отдать (новое или устаревшее значение).
+    # Корутины ждут на asyncio.Future, чтобы не занимать поток event loop
+    __slots__ = ("event", "value", "error", "stale", "waiters")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+        self.stale = False
+        self.waiters = []
+
+    def set(self):
+        self.event.set()
+        for loop, fut in self.waiters:
+            loop.call_soon_threadsafe(_resolve, fut)
+
+    async def wait_async(self):
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self.waiters.append((loop, fut))
+        if self.event.is_set():
+            _resolve(fut)
+        await fut
+
+
+class RefreshCancelled(Exception):
+    """Вычисление значения отменили (дедлайн, отключился клиент) — ждущим нечего отдать."""
+
+
+def _resolve(fut):
+    if not fut.done():
+        fut.set_result(None)
+
+
+class TTLCache:
+    # ttl_seconds — число или функция now -> секунды (срок зависит от момента записи)
+    # shared — дублировать записи в общее хранилище (CACHE_BACKEND), если оно настроено
+    # max_stale — окно stale-while-revalidate после истечения (MAX_STALE)
+    def __init__(self, ttl_seconds=600, maxsize=128, name="", shared=True, max_stale=None):
+        self.ttl = ttl_seconds
+        self.maxsize = maxsize
+        self.name = name
+        self.shared = shared
+        self.max_stale = MAX_STALE if max_stale is None else max_stale
+        self._data = OrderedDict()  # key -> (value, ts, expires)
+        self._inflight = {}
+        self._tasks = set()  # фоновые обновления в event loop
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.shared_hits = 0
+        self.evictions = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+
+    def _expires(self, ts):
+        ttl = self.ttl(ts) if callable(self.ttl) else self.ttl
+        return ts + ttl
+
+    def _store(self, key, value, ts, expires=None):
+        self._data[key] = (value, ts, expires if expires is not None else self._expires(ts))
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            entry = self._data.get(key)
+            now = time.time()
+            if entry is not None and now <= entry[2]:
+                self.hits += 1
+                self._data.move_to_end(key)
+                return entry[0]
+            flight = self._inflight.get(key)
+            if flight is not None and entry is not None and now - entry[2] <= self.max_stale:
+                # ключ уже обновляется — отдаём устаревшее значение, не ждём
+                self.stale_hits += 1
+                mark_stale(self.name)
+                return entry[0]
+            owner = flight is None
+            if owner:
+                flight = self._inflight[key] = _Inflight()
+
+        if not owner:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            if flight.stale:
+                mark_stale(self.name)
+            return flight.value
+
+        # локальной записи нет или она устарела: другой воркер (лидер
+        # планировщика) мог уже положить более новое значение
+        entry = self._load_shared(key, entry) or entry
+        if entry is not None and time.time() <= entry[2]:
+            with self._lock:
+                self.shared_hits += 1
+                self._inflight.pop(key, None)
+            flight.value = entry[0]
+            flight.set()
+            return entry[0]
+
+        if entry is not None and time.time() - entry[2] <= self.max_stale:
+            # stale-while-revalidate: сразу отдаём последнее значение,
+            # обновление идёт в фоне
+            with self._lock:
+                self.stale_hits += 1
+            flight.value, flight.stale = entry[0], True
+            flight.set()
+            mark_stale(self.name)
+            get_pool("refresh").submit(self._revalidate, key, flight, compute)
+            return entry[0]
+
+        with self._lock:
+            self.misses += 1
+        # записи нет или она слишком старая: ждём обновления
+        return self._refresh(key, flight, compute, fallback=entry)
+
+    def _refresh(self, key, flight, compute, fallback=None):
+        try:
+            value = compute()
+            self.put(key, value)
+            if not flight.event.is_set():
+                flight.value = value
+            return value
+        except Exception as e:
+            if fallback is not None:
+                return self._serve_fallback(flight, fallback)
+            if not flight.event.is_set():
+                flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.set()
+
+    def _serve_fallback(self, flight, entry):
+        # источник недоступен — слишком старое значение лучше ошибки
+        with self._lock:
+            self.stale_hits += 1
+            self.refresh_errors += 1
+        log.info("refresh failed for %s, serving stale value", self.name, exc_info=True)
+        flight.value, flight.stale = entry[0], True
+        mark_stale(self.name)
+        return entry[0]
+
+    def _revalidate(self, key, flight, compute):
+        with self._lock:
+            self.refreshes += 1
+        try:
+            self._refresh(key, flight, compute)
+        except Exception:
+            # остаётся устаревшее значение; следующий запрос попробует снова
+            with self._lock:
+                self.refresh_errors += 1
+            log.info("background refresh failed for %s", self.name, exc_info=True)
+
+    async def aget_or_compute(self, key, acompute):
+        """Асинхронный вариант get_or_compute: acompute — корутинная функция.
+
+        Логика та же (single-flight, stale-while-revalidate), но ожидание
+        чужого вычисления и фоновое обновление не занимают потоков.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            now = time.time()
+            if entry is not None and now <= entry[2]:
+                self.hits += 1
+                self._data.move_to_end(key)
+                return entry[0]
+            flight = self._inflight.get(key)
+            if flight is not None and entry is not None and now - entry[2] <= self.max_stale:
+                self.stale_hits += 1
+                mark_stale(self.name)
+                return entry[0]
+            owner = flight is None
+            if owner:
+                flight = self._inflight[key] = _Inflight()
+
+        if not owner:
+            await flight.wait_async()
+            if flight.error is not None:
+                raise flight.error
+            if flight.stale:
+                mark_stale(self.name)
+            return flight.value
+
+        entry = await self._aload_shared(key, entry) or entry
+        if entry is not None and time.time() <= entry[2]:
+            with self._lock:
+                self.shared_hits += 1
+                self._inflight.pop(key, None)
+            flight.value = entry[0]
+            flight.set()
+            return entry[0]
+
+        if entry is not None and time.time() - entry[2] <= self.max_stale:
+            with self._lock:
+                self.stale_hits += 1
+            flight.value, flight.stale = entry[0], True
+            flight.set()
+            mark_stale(self.name)
+            task = asyncio.get_running_loop().create_task(self._arevalidate(key, flight, acompute))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            return entry[0]
+
+        with self._lock:
+            self.misses += 1
+        return await self._arefresh(key, flight, acompute, fallback=entry)
+
+    async def _arefresh(self, key, flight, acompute, fallback=None):
+        try:
+            value = await acompute()
+            await self.aput(key, value)
+            if not flight.event.is_set():
+                flight.value = value
+            return value
+        except Exception as e:
+            if fallback is not None:
+                return self._serve_fallback(flight, fallback)
+            if not flight.event.is_set():
+                flight.error = e
+            raise
+        except BaseException:
+            # задачу-владельца отменили: ждущие получают старое значение или
+            # ошибку, а не None
+            if not flight.event.is_set():
+                if fallback is not None:
+                    flight.value, flight.stale = fallback[0], True
+                else:
+                    flight.error = RefreshCancelled(f"{self.name}: refresh cancelled")
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.set()
+
+    async def _arevalidate(self, key, flight, acompute):
+        with self._lock:
+            self.refreshes += 1
+        try:
+            await self._arefresh(key, flight, acompute)
+        except Exception:
+            with self._lock:
+                self.refresh_errors += 1
+            log.info("background refresh failed for %s", self.name, exc_info=True)
+
+    def _backend(self):
+        return _backend if self.shared else None
+
+    def _shared_key(self, key):
+        return f"{self.name}:{key!r}"
+
+    def _load_shared(self, key, current=None):
+        # запись из общего хранилища, если она новее current (локальной)
+        backend = self._backend()
+        if backend is None:
+            return None
+        try:
+            shared = backend.get(self._shared_key(key))
+        except Exception:
+            log.warning("cache backend read failed for %s", self.name, exc_info=True)
+            return None
+        if shared is None or (current is not None and shared[1] <= current[1]):
+            return None
+        value, ts, expires = shared
+        with self._lock:
+            self._store(key, value, ts, expires)
+        return value, ts, expires
+
+    async def _aload_shared(self, key, current=None):
+        # SQLite/Redis — блокирующий ввод-вывод, в event loop его не делаем
+        if self._backend() is None:
+            return None
+        return await asyncio.to_thread(self._load_shared, key, current)
+
+    def peek(self, key):
+        # свежее значение без учёта в статистике и без вычисления
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and time.time() <= entry[2]:
+                self._data.move_to_end(key)
+                return entry[0]
+            return None
+
+    def put(self, key, value):
+        ts = time.time()
+        with self._lock:
+            self._store(key, value, ts)
+            expires = self._data[key][2]
+        backend = self._backend()
+        if backend is not None:
+            try:
+                backend.set(self._shared_key(key), value, ts, expires)
+            except Exception:
+                log.warning("cache backend write failed for %s", self.name, exc_info=True)
+
+    async def aput(self, key, value):
+        if self._backend() is None:
+            self.put(key, value)
+        else:
+            await asyncio.to_thread(self.put, key, value)
+
+    def version(self, key):
+        # время записи значения: меняется при каждом обновлении, одинаково во всех воркерах
+        with self._lock:
+            entry = self._data.get(key)
+            return entry[1] if entry is not None else None
+
+    def version_of(self, key, value):
+        # версия именно этого значения; None — запись успели заменить или вытеснить
+        with self._lock:
+            entry = self._data.get(key)
+            return entry[1] if entry is not None and entry[0] is value else None
+
+    def latest(self, key):
+        """(значение, версия) без вычисления: локальная запись, а если она
+        устарела — более новая из общего хранилища; (None, None) — данных нет."""
+        with self._lock:
+            entry = self._data.get(key)
+        if entry is None or time.time() > entry[2]:
+            entry = self._load_shared(key, entry) or entry
+        return (entry[0], entry[1]) if entry is not None else (None, None)
+
+    def entries(self):
+        # [(ключ, значение, время записи)] — для снимка состояния (services/warmstate.py)
+        with self._lock:
+            return [(key, value, ts) for key, (value, ts, _) in self._data.items()]
+
+    def restore(self, key, value, ts):
+        """Кладёт значение из снимка, если оно новее текущего и не старше
+        STALE_GRACE после истечения; устаревшее отдаётся по stale-while-revalidate."""
+        expires = self._expires(ts)
+        if time.time() > expires + STALE_GRACE:
+            return False
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[1] >= ts:
+                return False
+            self._store(key, value, ts, expires)
+        return True
+
+    def keys(self):
+        with self._lock:
+            return list(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.stale_hits + self.shared_hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "refreshes": self.refreshes,
+                "refresh_errors": self.refresh_errors,
+                "hit_ratio": (lookups - self.misses) / lookups if lookups else 0.0,
+            }
+
+
+def ttl_cache(ttl_seconds=600, maxsize=128, max_stale=None):
     def decorator(fn):
-        cache = {"value": None, "ts": 0}
+        sig = inspect.signature(fn)
+        cache = TTLCache(ttl_seconds, maxsize, name=f"{fn.__module__}.{fn.__qualname__}", max_stale=max_stale)
+        CACHES[cache.name] = cache
+
+        def make_key(args, kwargs):
+            # get_headlines(10) и get_headlines(limit=10) — один и тот же ключ
+            bound = sig.bind(*args, **kwargs)
+            bound.apply_defaults()
+            return _freeze(tuple(bound.arguments.items()))
+
         @wraps(fn)
         def wrapper(*args, **kwargs):
-            now = time.time()
-            if cache["value"] is None or now - cache["ts"] > ttl_seconds:
-                cache["value"] = fn(*args, **kwargs)
-                cache["ts"] = now
-            return cache["value"]
+            key = make_key(args, kwargs)
+            return cache.get_or_compute(key, lambda: fn(*args, **kwargs))
+
+        def refresh(*args, **kwargs):
+            # принудительное обновление (для фонового планировщика)
+            value = fn(*args, **kwargs)
+            cache.put(make_key(args, kwargs), value)
+            return value
+
+        def async_variant(afn):
+            # корутинный двойник fn с той же сигнатурой и общим кэшем:
+            #   @fn.cache_async
+            #   async def afn(...): ...
+            @wraps(afn)
+            async def awrapper(*args, **kwargs):
+                key = make_key(args, kwargs)
+                return await cache.aget_or_compute(key, lambda: afn(*args, **kwargs))
+
+            async def aversioned(*args, **kwargs):
+                value = await awrapper(*args, **kwargs)
+                return value, cache.version_of(make_key(args, kwargs), value)
+
+            awrapper.cache = cache
+            awrapper.cache_versioned = aversioned
+            return awrapper
+
+        def versioned(*args, **kwargs):
+            # (значение, версия) одной и той же записи — для ETag; версия,
+            # прочитанная отдельно, могла бы относиться уже к новому значению
+            value = wrapper(*args, **kwargs)
+            return value, cache.version_of(make_key(args, kwargs), value)
+
+        wrapper.cache = cache
+        wrapper.cache_async = async_variant
+        wrapper.cache_refresh = refresh
+        wrapper.cache_key = lambda *a, **kw: make_key(a, kw)
+        wrapper.cache_version = lambda *a, **kw: cache.version(make_key(a, kw))
+        wrapper.cache_versioned = versioned
+        wrapper.cache_latest = lambda *a, **kw: cache.latest(make_key(a, kw))
+        wrapper.cache_stats = cache.stats
+        wrapper.cache_clear = cache.clear
         return wrapper
     return decorator
@@ -0,0 +1,346 @@
+import asyncio
+import bisect
+import logging
+import os
+import threading
+import time
+
+from services import metrics, resilience
+from services.cache import TTLCache, CACHES, ttl_cache
+from services.fanout import get_pool
+
+log = logging.getLogger(__name__)
+
+# Поиск криптовалют без запросов к CoinGecko на каждое нажатие клавиши:
+#  - список монет (id, symbol, name) синхронизируется раз в сутки и ищется в памяти;
+#  - цены в RUB для топ-N монет обновляются одним запросом раз в несколько минут;
+#  - цены остальных монет догружаются пачками, одновременные запросы объединяются.
+
+CG_BASE = os.getenv("COINGECKO_BASE_URL", "https://api.coingecko.com/api/v3")
+
+TOP_N = 250            # монет в общем снимке цен (максимум per_page у CoinGecko)
+MAX_RESULTS = 8
+BATCH_WINDOW = 0.05    # сколько ждать, собирая id для одного запроса цен
+BATCH_MAX_IDS = 250
+
+_CRYPTO_EMOJI = {
+    "bitcoin": "₿", "btc": "₿",
+    "ethereum": "Ξ", "eth": "Ξ",
+    "litecoin": "Ł", "ltc": "Ł",
+    "monero": "ɱ", "xmr": "ɱ",
+    "ripple": "✕", "xrp": "✕",
+    "toncoin": "🧿", "ton": "🧿",
+    "tether": "₮", "usdt": "₮",
+    "binancecoin": "Ⓑ", "bnb": "Ⓑ",
+}
+
+
+def _item(market):
+    code = (market.get("symbol") or "").upper()
+    name = market.get("name") or ""
+    # аккуратные поля под существующий рендер
+    key = (name or code).lower()
+    emoji = _CRYPTO_EMOJI.get(key) or _CRYPTO_EMOJI.get((code or "").lower()) or "¤"
+    return {
+        "code": code,
+        "name": name,
+        "value": market.get("current_price"),
+        "symbol": "₽",
+        "emoji": emoji,
+        "accent": "from-emerald-700/40 to-cyan-700/30",
+        "change": None,
+        "change_percent": market.get("price_change_percentage_24h"),
+    }
+
+
+@metrics.timed("coingecko_markets")
+def _fetch_markets(params):
+    base = {"vs_currency": "rub", "price_change_percentage": "24h", "sparkline": "false"}
+    r = resilience.get("coingecko", f"{CG_BASE}/coins/markets", params={**base, **params}, max_timeout=12)
+    return r.json() or []
+
+
+@metrics.timed("coingecko_markets")
+async def _afetch_markets(params):
+    base = {"vs_currency": "rub", "price_change_percentage": "24h", "sparkline": "false"}
+    r = await resilience.aget("coingecko", f"{CG_BASE}/coins/markets", params={**base, **params}, max_timeout=12)
+    return r.json() or []
+
+
+# -----------------------------
+# Каталог монет
+# -----------------------------
+
+@metrics.timed("coingecko_coin_list")
+@ttl_cache(86400, maxsize=1)
+def _coin_list():
+    r = resilience.get("coingecko", f"{CG_BASE}/coins/list", max_timeout=20, endpoint="list")
+    return _parse_coin_list(r.json() or [])
+
+
+@metrics.timed("coingecko_coin_list")
+@_coin_list.cache_async
+async def _acoin_list():
+    r = await resilience.aget("coingecko", f"{CG_BASE}/coins/list", max_timeout=20, endpoint="list")
+    return _parse_coin_list(r.json() or [])
+
+
+def _parse_coin_list(coins):
+    return tuple(
+        (c["id"], (c.get("symbol") or "").lower(), (c.get("name") or "").lower())
+        for c in coins
+        if c.get("id")
+    )
+
+
+class CoinIndex:
+    """Отсортированные ключи (символ, название, id) для поиска по префиксу."""
+
+    MAX_CANDIDATES = 200
+
+    def __init__(self, coins):
+        self.source = coins
+        self.by_symbol = {}
+        self.search_keys = {}  # id -> (символ, название, id)
+        keys = []
+        for coin_id, symbol, name in coins:
+            self.by_symbol.setdefault(symbol, []).append(coin_id)
+            self.search_keys[coin_id] = (symbol, name, coin_id)
+            keys.append((symbol, coin_id))
+            keys.append((name, coin_id))
+            keys.append((coin_id, coin_id))
+        keys.sort()
+        self.keys = [k for k, _ in keys]
+        self.ids = [i for _, i in keys]
+
+    def candidates(self, q, ranked=()):
+        """id монет с ключом на q: точные символы, затем совпадения из ranked
+        (id снимка в порядке капитализации), затем по алфавиту до MAX_CANDIDATES.
+        Крупные монеты не теряются за алфавитным отсечением."""
+        q = q.lower()
+        out = dict.fromkeys(self.by_symbol.get(q, ()))
+        for coin_id in ranked:
+            keys = self.search_keys.get(coin_id)
+            if keys is not None and any(k.startswith(q) for k in keys):
+                out.setdefault(coin_id)
+        i = bisect.bisect_left(self.keys, q)
+        while i < len(self.keys) and self.keys[i].startswith(q) and len(out) < self.MAX_CANDIDATES:
+            out.setdefault(self.ids[i])
+            i += 1
+        return list(out)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_coin_index():
+    return _index_for(_coin_list())
+
+
+async def aget_coin_index():
+    return _index_for(await _acoin_list())
+
+
+def _index_for(coins):
+    global _index
+    if _index is None or _index.source is not coins:
+        with _index_lock:
+            if _index is None or _index.source is not coins:
+                _index = CoinIndex(coins)
+    return _index
+
+
+# -----------------------------
+# Цены
+# -----------------------------
+
+_SNAPSHOT_PARAMS = {"order": "market_cap_desc", "per_page": TOP_N, "page": 1}
+
+
+@ttl_cache(300, maxsize=1)
+def _market_snapshot():
+    # id -> (место по капитализации, элемент ответа)
+    markets = _fetch_markets(_SNAPSHOT_PARAMS)
+    return _snapshot(markets)
+
+
+@_market_snapshot.cache_async
+async def _amarket_snapshot():
+    return _snapshot(await _afetch_markets(_SNAPSHOT_PARAMS))
+
+
+def _snapshot(markets):
+    return {m["id"]: (rank, _item(m)) for rank, m in enumerate(markets) if m.get("id")}
+
+
+_NO_DATA = False  # у монеты нет рыночных данных — тоже кэшируем
+
+
+class MarketBatcher:
+    """Догружает цены монет вне снимка; id от одновременных запросов
+    собираются в один запрос к /coins/markets."""
+
+    def __init__(self, ttl=300):
+        self.cache = TTLCache(ttl, maxsize=4096, name="services.crypto.long_tail", shared=False)
+        CACHES[self.cache.name] = self.cache
+        self._lock = threading.Lock()
+        self._pending = {}  # id -> Event
+        self._running = False
+
+    def get_many(self, ids, timeout=12):
+        found, waits = {}, {}
+        with self._lock:
+            for coin_id in ids:
+                value = self.cache.peek(coin_id)
+                if value is not None:
+                    found[coin_id] = value
+                    continue
+                event = self._pending.get(coin_id)
+                if event is None:
+                    event = self._pending[coin_id] = threading.Event()
+                waits[coin_id] = event
+            if waits and not self._running:
+                self._running = True
+                get_pool("upstream").submit(self._run)
+
+        deadline = time.monotonic() + timeout
+        for coin_id, event in waits.items():
+            event.wait(max(deadline - time.monotonic(), 0))
+            value = self.cache.peek(coin_id)
+            if value is not None:
+                found[coin_id] = value
+        return {k: v for k, v in found.items() if v is not _NO_DATA}
+
+    async def aget_many(self, ids):
+        # попадания в кэш — сразу; за недостающими ждём в потоке те же
+        # события _pending, что и синхронный путь: одновременные запросы
+        # из event loop и из потоков склеиваются в один пакет
+        found, missing = {}, []
+        for coin_id in ids:
+            value = self.cache.peek(coin_id)
+            if value is not None:
+                found[coin_id] = value
+            else:
+                missing.append(coin_id)
+        found = {k: v for k, v in found.items() if v is not _NO_DATA}
+        if missing:
+            found.update(await asyncio.to_thread(self.get_many, missing))
+        return found
+
+    def _run(self):
+        time.sleep(BATCH_WINDOW)
+        while True:
+            with self._lock:
+                batch = dict(list(self._pending.items())[:BATCH_MAX_IDS])
+                if not batch:
+                    self._running = False
+                    return
+            try:
+                markets = _fetch_markets({"ids": ",".join(batch), "per_page": len(batch), "page": 1})
+                got = {m["id"]: _item(m) for m in markets if m.get("id")}
+                for coin_id in batch:
+                    self.cache.put(coin_id, got.get(coin_id, _NO_DATA))
+            except Exception:
+                # ожидающие не получат цену; сбой разбора предохранитель не видит
+                log.warning("coingecko long-tail batch failed (%d ids)", len(batch), exc_info=True)
+            finally:
+                with self._lock:
+                    for coin_id, event in batch.items():
+                        self._pending.pop(coin_id, None)
+                        event.set()
+
+
+_batcher = MarketBatcher()
+
+
+# -----------------------------
+# Поиск
+# -----------------------------
+
+def _search_remote(q):
+    # запасной путь, пока каталог монет не загружен
+    s = resilience.get("coingecko", f"{CG_BASE}/search", params={"query": q}, max_timeout=12)
+    coins = (s.json() or {}).get("coins", [])[:MAX_RESULTS]
+    if not coins:
+        return None
+    markets = _fetch_markets({"ids": ",".join(c["id"] for c in coins), "per_page": MAX_RESULTS, "page": 1})
+    return [_item(m) for m in markets]
+
+
+async def _asearch_remote(q):
+    s = await resilience.aget("coingecko", f"{CG_BASE}/search", params={"query": q}, max_timeout=12)
+    coins = (s.json() or {}).get("coins", [])[:MAX_RESULTS]
+    if not coins:
+        return None
+    markets = await _afetch_markets({"ids": ",".join(c["id"] for c in coins), "per_page": MAX_RESULTS, "page": 1})
+    return [_item(m) for m in markets]
+
+
+@metrics.timed("crypto_search")
+def search(q):
+    """Монеты по запросу в формате items /api/rates/search; None — ничего не найдено."""
+    try:
+        index = get_coin_index()
+    except Exception:
+        return _search_remote(q)
+
+    try:
+        snapshot = _market_snapshot()
+    except Exception:
+        snapshot = {}
+    candidates = index.candidates(q, snapshot)
+    if not candidates:
+        return None
+
+    chosen, missing = _choose(index, candidates, snapshot, q)
+    tail = _batcher.get_many(missing) if missing else {}
+    return _collect(chosen, snapshot, tail)
+
+
+@metrics.timed("crypto_search")
+async def asearch(q):
+    """Асинхронный search для asgi.py."""
+    try:
+        index = await aget_coin_index()
+    except Exception:
+        return await _asearch_remote(q)
+
+    try:
+        snapshot = await _amarket_snapshot()
+    except Exception:
+        snapshot = {}
+    candidates = index.candidates(q, snapshot)
+    if not candidates:
+        return None
+
+    chosen, missing = _choose(index, candidates, snapshot, q)
+    tail = await _batcher.aget_many(missing) if missing else {}
+    return _collect(chosen, snapshot, tail)
+
+
+def _choose(index, candidates, snapshot, q):
+    q_lc = q.lower()
+    exact = set(index.by_symbol.get(q_lc, ()))
+    # точное совпадение символа, затем по капитализации; монеты вне топа — в конце
+    candidates.sort(key=lambda cid: (cid not in exact, snapshot[cid][0] if cid in snapshot else TOP_N))
+    chosen = candidates[:MAX_RESULTS]
+    return chosen, [cid for cid in chosen if cid not in snapshot]
+
+
+def _collect(chosen, snapshot, tail):
+    items = []
+    for cid in chosen:
+        if cid in snapshot:
+            items.append(snapshot[cid][1])
+        elif cid in tail:
+            items.append(tail[cid])
+    return items
+
+
+def refresh_coin_list():
+    _coin_list.cache_refresh()
+
+
+def refresh_snapshot():
+    _market_snapshot.cache_refresh()
@@ -0,0 +1,51 @@
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# Отдельные пулы на уровень вложенности: страница ждёт задачи, которые сами
+# раздают запросы по городам — в одном пуле они могли бы занять все потоки
+POOL_SIZES = {
+    "page": int(os.getenv("FANOUT_PAGE_THREADS", "8")),
+    "upstream": int(os.getenv("FANOUT_UPSTREAM_THREADS", "16")),
+    "scheduler": 4,
+    "refresh": 4,
+}
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(name):
+    with _pools_lock:
+        pool = _pools.get(name)
+        if pool is None:
+            pool = _pools[name] = ThreadPoolExecutor(
+                max_workers=POOL_SIZES.get(name, 8), thread_name_prefix=f"fanout-{name}"
+            )
+        return pool
+
+
+def run_parallel(tasks, timeout, pool="upstream"):
+    """Запускает {ключ: callable} одновременно с общим дедлайном.
+
+    Возвращает {ключ: (value, error)}; задачи, не успевшие к дедлайну,
+    получают TimeoutError.
+    """
+    executor = get_pool(pool)
+    # контекст (например, учёт устаревших данных запроса) переносится в задачи
+    futures = {
+        key: executor.submit(contextvars.copy_context().run, fn)
+        for key, fn in tasks.items()
+    }
+    wait(futures.values(), timeout=timeout)
+
+    out = {}
+    for key, fut in futures.items():
+        if not fut.done():
+            fut.cancel()
+            out[key] = (None, TimeoutError(f"{key}: deadline {timeout}s exceeded"))
+            continue
+        err = fut.exception()
+        out[key] = (None, err) if err is not None else (fut.result(), None)
+    return out
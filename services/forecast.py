@@ -0,0 +1,155 @@
+import json
+
+from services.weather import CODE_DEFAULT, CODE_TABLE
+
+# Приведение ответов Open-Meteo к формату /api/weather и /api/weather/weekly.
+# Колонки ответа склеиваются в строки за один проход (zip), коды погоды
+# переводятся через готовую таблицу. format=columns отдаёт массивы как есть.
+
+try:
+    import orjson
+except ImportError:  # orjson необязателен
+    orjson = None
+
+# (поле ответа, колонка Open-Meteo)
+HOURLY_COLUMNS = (
+    ("temp", "temperature_2m"),
+    ("feels", "apparent_temperature"),
+    ("precip", "precipitation"),
+    ("code", "weather_code"),
+    ("wind", "wind_speed_10m"),
+)
+DAILY_COLUMNS = (
+    ("temp_max", "temperature_2m_max"),
+    ("temp_min", "temperature_2m_min"),
+    ("precip_sum", "precipitation_sum"),
+    ("wind_max", "wind_speed_10m_max"),
+    ("sunrise", "sunrise"),
+    ("sunset", "sunset"),
+)
+
+
+def dumps(obj):
+    """JSON в байтах: orjson, если установлен, иначе компактный json.dumps."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def _column(block, key, n):
+    # колонка длины n; отсутствующие значения — None
+    arr = block.get(key)
+    if not isinstance(arr, list):
+        return [None] * n
+    if len(arr) < n:
+        return arr + [None] * (n - len(arr))
+    return arr
+
+
+def _code_info(codes):
+    table = CODE_TABLE
+    default = CODE_DEFAULT
+    return [table.get(c, default) if c is not None else default for c in codes]
+
+
+def _rows(block, columns):
+    times = block.get("time") or []
+    n = len(times)
+    names = ("time", *(name for name, _ in columns))
+    cols = [_column(block, key, n) for _, key in columns]
+    return [dict(zip(names, values)) for values in zip(times, *cols)]
+
+
+def _current(data):
+    cur = data.get("current", {}) or {}
+    code = cur.get("weather_code")
+    icon, desc, anim = CODE_TABLE.get(code, CODE_DEFAULT)
+    return {
+        "temp": cur.get("temperature_2m"),
+        "feels": cur.get("apparent_temperature"),
+        "precip": cur.get("precipitation"),
+        "wind": cur.get("wind_speed_10m"),
+        "wdir": cur.get("wind_direction_10m"),
+        "time": cur.get("time"),
+        "code": code,
+        "icon": icon,
+        "desc": desc,
+        "anim": anim,
+    }
+
+
+def _first(block, key):
+    arr = block.get(key) or []
+    if isinstance(arr, list) and arr:
+        return arr[0]
+    return None
+
+
+def shape_today(data):
+    daily = data.get("daily", {}) or {}
+    return {
+        "current": _current(data),
+        "hourly": _rows(data.get("hourly", {}) or {}, HOURLY_COLUMNS),
+        "hourly_units": data.get("hourly_units", {}),
+        "daily": {
+            "time": _first(daily, "time"),
+            **{name: _first(daily, key) for name, key in DAILY_COLUMNS},
+        },
+        "daily_units": data.get("daily_units", {}),
+    }
+
+
+def shape_weekly(data):
+    daily = data.get("daily", {}) or {}
+    times = daily.get("time") or []
+    codes = _column(daily, "weather_code", len(times))
+    days = []
+    for row, code, (icon, desc, anim) in zip(_rows(daily, DAILY_COLUMNS), codes, _code_info(codes)):
+        days.append({"time": row.pop("time"), "code": code, "icon": icon, "desc": desc, "anim": anim, **row})
+    return {
+        "days": days,
+        "units": data.get("daily_units", {}),
+        "timezone": data.get("timezone_abbreviation"),
+    }
+
+
+# -----------------------------
+# format=columns: без построчных словарей
+# -----------------------------
+
+def _columns(block, columns):
+    times = block.get("time") or []
+    n = len(times)
+    return {"time": times, **{name: _column(block, key, n) for name, key in columns}}
+
+
+def columns_today(data):
+    daily = data.get("daily", {}) or {}
+    return {
+        "format": "columns",
+        "current": _current(data),
+        "hourly": _columns(data.get("hourly", {}) or {}, HOURLY_COLUMNS),
+        "hourly_units": data.get("hourly_units", {}),
+        "daily": {
+            "time": _first(daily, "time"),
+            **{name: _first(daily, key) for name, key in DAILY_COLUMNS},
+        },
+        "daily_units": data.get("daily_units", {}),
+    }
+
+
+def columns_weekly(data):
+    daily = data.get("daily", {}) or {}
+    out = _columns(daily, DAILY_COLUMNS)
+    codes = _column(daily, "weather_code", len(out["time"]))
+    info = _code_info(codes)
+    out["code"] = codes
+    out["icon"] = [i[0] for i in info]
+    out["desc"] = [i[1] for i in info]
+    out["anim"] = [i[2] for i in info]
+    return {
+        "format": "columns",
+        "days": out,
+        "units": data.get("daily_units", {}),
+        "timezone": data.get("timezone_abbreviation"),
+    }
@@ -0,0 +1,192 @@
+import math
+import os
+import threading
+
+from services import forecast_grid
+from services.cache import CACHES, TTLCache
+from services.weather import afetch_open_meteo, fetch_open_meteo
+
+# Шаг сетки, к которому округляются координаты (градусы): 0.01° ≈ 1 км
+GRID_DEG = float(os.getenv("FORECAST_GRID_DEG", "0.01"))
+
+# Open-Meteo пересчитывает прогноз раз в час; новые данные появляются
+# примерно к этой минуте часа
+MODEL_UPDATE_MINUTE = int(os.getenv("FORECAST_UPDATE_MINUTE", "15"))
+MIN_TTL = 300
+
+# Open-Meteo по умолчанию отдаёт 7 дней
+DEFAULT_FORECAST_DAYS = 7
+
+
+def parse_coords(lat, lon):
+    """(широта, долгота) из параметров запроса или None, если это не числа,
+    nan/inf или точка вне [-90, 90] × [-180, 180]."""
+    try:
+        lat, lon = float(lat), float(lon)
+    except (TypeError, ValueError):
+        return None
+    if not (math.isfinite(lat) and math.isfinite(lon)):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    return lat, lon
+
+
+def quantize(value, step=None):
+    step = step or GRID_DEG
+    return round(round(value / step) * step, 6)
+
+
+def _ttl_until_model_update(now):
+    # до ближайшего HH:MM_UPDATE; если до него меньше MIN_TTL — до следующего
+    hour_start = now - now % 3600
+    expires = hour_start + MODEL_UPDATE_MINUTE * 60
+    while expires - now < MIN_TTL:
+        expires += 3600
+    return expires - now
+
+
+_cache = TTLCache(_ttl_until_model_update, maxsize=2048, name="services.forecast_cache")
+CACHES[_cache.name] = _cache
+
+_lock = threading.Lock()
+_by_cell = {}  # (lat, lon) -> set(ключей) — для поиска более широких записей
+_stats = {"requests": 0, "grid_hits": 0, "hits": 0, "derived_hits": 0, "misses": 0}
+
+
+def _count(name):
+    with _lock:
+        _stats["requests"] += 1
+        _stats[name] += 1
+
+
+def _slice_days(data, hourly, daily, days):
+    # Урезает ответ на N дней до первых `days` и до запрошенных полей
+    out = {k: v for k, v in data.items() if k not in ("hourly", "daily")}
+
+    if daily:
+        block = data.get("daily") or {}
+        out["daily"] = {k: (block.get(k) or [])[:days] for k in ("time", *daily)}
+
+    if hourly:
+        block = data.get("hourly") or {}
+        times = block.get("time") or []
+        dates = []
+        for t in times:
+            d = t[:10]
+            if not dates or dates[-1] != d:
+                dates.append(d)
+        keep_dates = set(dates[:days])
+        n = sum(1 for t in times if t[:10] in keep_dates)
+        out["hourly"] = {k: (block.get(k) or [])[:n] for k in ("time", *hourly)}
+
+    return out
+
+
+def _derive(cell, hourly, daily, days):
+    with _lock:
+        keys = list(_by_cell.get(cell, ()))
+    for key in keys:
+        _, _, k_hourly, k_daily, k_days = key
+        if k_days < days or not set(hourly) <= set(k_hourly) or not set(daily) <= set(k_daily):
+            continue
+        data = _cache.peek(key)
+        if data is None:
+            with _lock:
+                _by_cell.get(cell, set()).discard(key)
+            continue
+        # версия именно того ответа, из которого вырезали
+        return _slice_days(data, hourly, daily, days), _cache.version_of(key, data)
+    return None
+
+
+def get_forecast(lat, lon, *, hourly=None, daily=None, forecast_days=None):
+    """fetch_open_meteo с кэшем по координатам, округлённым до GRID_DEG.
+
+    Запрос на меньшее число дней или подмножество полей обслуживается из
+    уже закэшированного более широкого ответа для той же ячейки.
+    """
+    return get_forecast_versioned(
+        lat, lon, hourly=hourly, daily=daily, forecast_days=forecast_days
+    )[0]
+
+
+def _lookup(lat, lon, hourly, daily, forecast_days):
+    # (ключ, (данные, версия)) — если ответ уже есть в кэше, иначе (ключ, None).
+    # Версия — version_of прочитанного значения: если запись успели обновить,
+    # None (ответ без ETag), но не версия чужого тела
+    cell = (quantize(lat), quantize(lon))
+    hourly = tuple(sorted(hourly or ()))
+    daily = tuple(sorted(daily or ()))
+    days = forecast_days or DEFAULT_FORECAST_DAYS
+    key = (*cell, hourly, daily, days)
+
+    # точка внутри региональной сетки — считаем на месте, без источника
+    grid = forecast_grid.lookup(*cell, hourly, daily, days)
+    if grid is not None:
+        _count("grid_hits")
+        data, version = grid
+        return key, (_slice_days(data, hourly, daily, days), version)
+
+    data = _cache.peek(key)
+    if data is not None:
+        _count("hits")
+        return key, (data, _cache.version_of(key, data))
+
+    derived = _derive(cell, hourly, daily, days)
+    if derived is not None:
+        _count("derived_hits")
+        return key, derived
+
+    _count("misses")
+    return key, None
+
+
+def _fetch_kwargs(key):
+    lat, lon, hourly, daily, days = key
+    return dict(lat=lat, lon=lon, hourly=list(hourly) or None, daily=list(daily) or None, forecast_days=days)
+
+
+def _remember(key):
+    cell = key[:2]
+    with _lock:
+        _by_cell.setdefault(cell, set()).add(key)
+        # ключи, вытесненные из LRU, не копим
+        if len(_by_cell) > _cache.maxsize:
+            live = set(_cache.keys())
+            for c in list(_by_cell):
+                _by_cell[c] &= live
+                if not _by_cell[c]:
+                    del _by_cell[c]
+
+
+def get_forecast_versioned(lat, lon, *, hourly=None, daily=None, forecast_days=None):
+    # (данные, версия): версия — время записи в кэш, для ETag ответа
+    key, found = _lookup(lat, lon, hourly, daily, forecast_days)
+    if found is not None:
+        return found
+    data = _cache.get_or_compute(key, lambda: fetch_open_meteo(**_fetch_kwargs(key)))
+    _remember(key)
+    return data, _cache.version_of(key, data)
+
+
+async def aget_forecast_versioned(lat, lon, *, hourly=None, daily=None, forecast_days=None):
+    """Асинхронный get_forecast_versioned: тот же кэш, запрос через httpx."""
+    key, found = _lookup(lat, lon, hourly, daily, forecast_days)
+    if found is not None:
+        return found
+    data = await _cache.aget_or_compute(key, lambda: afetch_open_meteo(**_fetch_kwargs(key)))
+    _remember(key)
+    return data, _cache.version_of(key, data)
+
+
+def stats():
+    with _lock:
+        s = dict(_stats)
+    served = s["grid_hits"] + s["hits"] + s["derived_hits"]
+    s["hit_ratio"] = served / s["requests"] if s["requests"] else 0.0
+    s["grid_deg"] = GRID_DEG
+    s["cells"] = len(_by_cell)
+    s["entries"] = _cache.stats()["size"]
+    s["grid"] = forecast_grid.stats()
+    return s
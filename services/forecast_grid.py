@@ -0,0 +1,243 @@
+import os
+import threading
+import time
+
+from services import metrics
+from services.cache import ttl_cache
+from services.weather import DEFAULT_CURRENT_FIELDS, fetch_open_meteo_many
+
+try:
+    import numpy as np
+except ImportError:  # без numpy сетки нет, все запросы идут в Open-Meteo
+    np = None
+
+# Прогноз по региону на регулярной сетке lat/lon. Планировщик раз в
+# REFRESH_SECONDS забирает всю сетку пачками (fetch_open_meteo_many), а /api/weather и
+# /api/weather/weekly для точки внутри области считаются на месте:
+# билинейная интерполяция по четырём соседним узлам, коды погоды, направление
+# ветра и восход/закат — из ближайшего узла. В Open-Meteo уходят только
+# координаты вне области.
+#
+# Время в ответах Open-Meteo местное (timezone=auto), а в область может
+# попасть несколько часовых поясов (Калининград — UTC+2, остальное — UTC+3).
+# Поэтому узлы группируются по utc_offset_seconds: у каждой группы своя ось
+# времени и свои массивы (время × переменная × узел), узлы чужих групп в
+# них — NaN. Точка берёт группу ближайшего узла и интерполирует только по
+# узлам этой группы.
+
+# Сетка включается явно: каждый узел — отдельный прогноз в квоте Open-Meteo
+# (а переменных у него ~18), и обновляет её каждый лидер планировщика.
+# Например, FORECAST_GRID_BBOX="54.0,19.5,69.5,37.0" (Северо-Запад) при шаге
+# 1.5° — 143 узла, два запроса раз в три часа.
+# lat_min,lon_min,lat_max,lon_max; "" — выключено
+BBOX = os.getenv("FORECAST_GRID_BBOX", "")
+STEP = float(os.getenv("FORECAST_GRID_STEP", "1.5"))
+REFRESH_SECONDS = int(os.getenv("FORECAST_GRID_REFRESH_SECONDS", str(3 * 3600)))
+FORECAST_DAYS = 7
+# сетка старше этого не используется — лучше спросить источник
+MAX_AGE = 2 * REFRESH_SECONDS
+# свои предохранитель и очередь (services/admission.py): сетка не должна
+# разомкнуть предохранитель или занять очередь пользовательских запросов
+UPSTREAM = "open-meteo-grid"
+# как часто воркер сверяется с кэшем (в том числе общим) на новую сетку
+CHECK_SECONDS = 10
+
+HOURLY = ("temperature_2m", "apparent_temperature", "precipitation", "weather_code", "wind_speed_10m")
+DAILY = (
+    "weather_code", "temperature_2m_max", "temperature_2m_min",
+    "precipitation_sum", "wind_speed_10m_max", "sunrise", "sunset",
+)
+CURRENT = tuple(DEFAULT_CURRENT_FIELDS.split(","))
+
+# не интерполируются: берутся из ближайшего узла
+NEAREST = {"weather_code", "wind_direction_10m"}
+STRINGS = {"sunrise", "sunset"}
+
+
+def _bbox():
+    if not BBOX:
+        return None
+    lat0, lon0, lat1, lon1 = (float(v) for v in BBOX.split(","))
+    return lat0, lon0, lat1, lon1
+
+
+def enabled():
+    return np is not None and _bbox() is not None
+
+
+class _Block:
+    # один блок ответа (hourly / daily / current) для группы узлов
+    def __init__(self, times, fields, units, ncells):
+        self.times = times
+        self.fields = [f for f in fields if f not in STRINGS]
+        self.strings = {f: [None] * ncells for f in fields if f in STRINGS}
+        self.units = units
+        n = 1 if isinstance(times, str) else len(times)
+        self.values = np.full((n, len(self.fields), ncells), np.nan, dtype=np.float32)
+
+    def fill(self, cell, block):
+        n = self.values.shape[0]
+        for v, name in enumerate(self.fields):
+            col = block.get(name)
+            if not isinstance(col, list):
+                col = [col]
+            col = np.array(col[:n], dtype=float)
+            self.values[:len(col), v, cell] = col
+        for name, per_cell in self.strings.items():
+            per_cell[cell] = block.get(name)
+
+    def at(self, corners, weights, nearest):
+        # (время × переменная) в точке: взвешенная сумма по углам без NaN
+        # (узлы других групп и пропуски) с перенормировкой весов; NEAREST — из узла
+        values = self.values[:, :, corners]
+        w = np.where(np.isnan(values), 0.0, weights)
+        with np.errstate(invalid="ignore"):
+            out = np.nansum(values * w, axis=2) / w.sum(axis=2)
+        for v, name in enumerate(self.fields):
+            if name in NEAREST:
+                out[:, v] = self.values[:, v, nearest]
+        return np.round(out, 1)
+
+    def render(self, corners, weights, nearest):
+        out = self.at(corners, weights, nearest)
+        block = {"time": self.times}
+        for v, name in enumerate(self.fields):
+            col = [None if x != x else x for x in out[:, v].tolist()]
+            if name in NEAREST:
+                col = [None if x is None else int(x) for x in col]
+            block[name] = col[0] if isinstance(self.times, str) else col
+        for name, per_cell in self.strings.items():
+            block[name] = per_cell[nearest]
+        return block
+
+
+class _Group:
+    def __init__(self, sample, ncells):
+        self.timezone = sample.get("timezone")
+        self.abbreviation = sample.get("timezone_abbreviation")
+        self.offset = sample.get("utc_offset_seconds", 0)
+        self.blocks = {}
+        for name, fields in (("hourly", HOURLY), ("daily", DAILY), ("current", CURRENT)):
+            block = sample.get(name) or {}
+            times = block.get("time") or ([] if name != "current" else "")
+            self.blocks[name] = _Block(times, fields, sample.get(f"{name}_units", {}), ncells)
+
+
+class ForecastGrid:
+    def __init__(self, bbox, step, responses):
+        self.lat0, self.lon0, lat1, lon1 = bbox
+        self.step = step
+        self.ny = int(round((lat1 - self.lat0) / step)) + 1
+        self.nx = int(round((lon1 - self.lon0) / step)) + 1
+        ncells = self.ny * self.nx
+
+        offsets = [r.get("utc_offset_seconds", 0) for r in responses]
+        self.groups = []
+        index = {}
+        for offset, r in zip(offsets, responses):
+            if offset not in index:
+                index[offset] = len(self.groups)
+                self.groups.append(_Group(r, ncells))
+        self.cell_group = np.array([index[o] for o in offsets], dtype=np.int16)
+        for cell, r in enumerate(responses):
+            group = self.groups[self.cell_group[cell]]
+            for name, block in group.blocks.items():
+                block.fill(cell, r.get(name) or {})
+
+    @staticmethod
+    def points(bbox, step):
+        # узлы построчно: сначала широта, затем долгота
+        lat0, lon0, lat1, lon1 = bbox
+        ny = int(round((lat1 - lat0) / step)) + 1
+        nx = int(round((lon1 - lon0) / step)) + 1
+        return [(round(lat0 + i * step, 4), round(lon0 + j * step, 4)) for i in range(ny) for j in range(nx)]
+
+    def forecast(self, lat, lon):
+        """Ответ в формате Open-Meteo для точки; None — точка вне сетки."""
+        fy = (lat - self.lat0) / self.step
+        fx = (lon - self.lon0) / self.step
+        if not (0 <= fy <= self.ny - 1 and 0 <= fx <= self.nx - 1):
+            return None
+        i, j = min(int(fy), self.ny - 2), min(int(fx), self.nx - 2)
+        ty, tx = fy - i, fx - j
+        corners = np.array([i * self.nx + j, i * self.nx + j + 1, (i + 1) * self.nx + j, (i + 1) * self.nx + j + 1])
+        weights = np.array([(1 - ty) * (1 - tx), (1 - ty) * tx, ty * (1 - tx), ty * tx])
+        nearest = int(corners[weights.argmax()])
+        group = self.groups[self.cell_group[nearest]]
+
+        out = {
+            "latitude": lat,
+            "longitude": lon,
+            "timezone": group.timezone,
+            "timezone_abbreviation": group.abbreviation,
+            "utc_offset_seconds": group.offset,
+        }
+        for name, block in group.blocks.items():
+            out[name] = block.render(corners, weights, nearest)
+            out[f"{name}_units"] = block.units
+        return out
+
+    def stats(self):
+        return {"cells": self.ny * self.nx, "shape": [self.ny, self.nx], "step": self.step, "groups": len(self.groups)}
+
+
+@metrics.timed("forecast_grid")
+@ttl_cache(REFRESH_SECONDS, maxsize=1)
+def _build_grid():
+    bbox = _bbox()
+    points = ForecastGrid.points(bbox, STEP)
+    responses = fetch_open_meteo_many(
+        points, hourly=HOURLY, daily=DAILY, forecast_days=FORECAST_DAYS, timeout=60, upstream=UPSTREAM,
+    )
+    return ForecastGrid(bbox, STEP, responses)
+
+
+_lock = threading.Lock()
+_state = {"grid": None, "version": None, "checked": 0.0}
+
+
+def refresh():
+    if not enabled():
+        return
+    _build_grid.cache_refresh()
+    with _lock:
+        _state["checked"] = 0.0
+
+
+def current():
+    """(сетка, версия) или (None, None); к источнику не обращается."""
+    now = time.monotonic()
+    with _lock:
+        check = now - _state["checked"] >= CHECK_SECONDS
+        if check:
+            _state["checked"] = now
+    if check:
+        grid, version = _build_grid.cache_latest()
+        if grid is not None:
+            with _lock:
+                if _state["version"] is None or version >= _state["version"]:
+                    _state["grid"], _state["version"] = grid, version
+    with _lock:
+        grid, version = _state["grid"], _state["version"]
+    if grid is None or time.time() - version > MAX_AGE:
+        return None, None
+    return grid, version
+
+
+def lookup(lat, lon, hourly, daily, days):
+    """(данные, версия) для точки внутри сетки, если она покрывает запрошенные
+    поля и дни; иначе None."""
+    if not enabled() or days > FORECAST_DAYS:
+        return None
+    if not set(hourly) <= set(HOURLY) or not set(daily) <= set(DAILY):
+        return None
+    grid, version = current()
+    if grid is None:
+        return None
+    data = grid.forecast(lat, lon)
+    return (data, version) if data is not None else None
+
+
+def stats():
+    grid, version = current() if enabled() else (None, None)
+    return {"enabled": enabled(), "version": version, **(grid.stats() if grid is not None else {})}
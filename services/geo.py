@@ -1,13 +1,49 @@
 # services/geo.py
-import requests
+import asyncio
+import os
 
+from services import geocoder, metrics, resilience
+from services.cache import ttl_cache
+
+GEOCODING_URL = os.getenv("OPEN_METEO_GEOCODING_URL", "https://geocoding-api.open-meteo.com/v1/search")
+
+# список городов почти не меняется — ответы держим сутки
+@metrics.timed("search_cities")
+@ttl_cache(86400, maxsize=1024)
 def search_cities(name: str, count: int = 5, lang: str = "ru"):
     if not name.strip():
         return []
-    url = "https://geocoding-api.open-meteo.com/v1/search"
-    r = requests.get(url, params={"name": name, "count": count, "language": lang, "format": "json"}, timeout=12)
-    r.raise_for_status()
-    data = r.json() or {}
+    # сначала локальный индекс GeoNames; удалённый API — только если там пусто
+    local = geocoder.search(name, count=count, lang=lang)
+    if local:
+        return local
+    r = resilience.get(
+        "open-meteo-geocoding", GEOCODING_URL,
+        params={"name": name, "count": count, "language": lang, "format": "json"},
+        max_timeout=12,
+    )
+    return _parse_results(r.json() or {}, count)
+
+@metrics.timed("search_cities")
+@search_cities.cache_async
+async def asearch_cities(name: str, count: int = 5, lang: str = "ru"):
+    if not name.strip():
+        return []
+    # поиск по mmap-индексу быстрый; загрузка (или сборка) индекса — нет
+    if geocoder.ready():
+        local = geocoder.search(name, count=count, lang=lang)
+    else:
+        local = await asyncio.to_thread(geocoder.search, name, count=count, lang=lang)
+    if local:
+        return local
+    r = await resilience.aget(
+        "open-meteo-geocoding", GEOCODING_URL,
+        params={"name": name, "count": count, "language": lang, "format": "json"},
+        max_timeout=12,
+    )
+    return _parse_results(r.json() or {}, count)
+
+def _parse_results(data, count):
     results = []
     for it in data.get("results", [])[:count]:
         results.append({
@@ -0,0 +1,425 @@
+import fcntl
+import glob
+import logging
+import mmap
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+from array import array
+
+log = logging.getLogger(__name__)
+
+# Локальный геокодер для автодополнения городов.
+#
+# Источник — дамп GeoNames (cities15000.txt / cities5000.txt, формат
+# «geonameid, name, asciiname, alternatenames, lat, lon, ...»), рядом можно
+# положить countryInfo.txt и admin1CodesASCII.txt для названий стран и регионов
+# и alternateNamesV2.txt (GEONAMES_ALTERNATES) для их русских названий.
+# Из дампа строится индекс — каталог-версия v-*/ в GEOCODER_INDEX_DIR:
+#   places.bin — записи «name, name_ru, country, country_ru, cc, admin1,
+#                admin1_ru, lat, lon, population» по строке
+#   keys.bin   — отсортированные ключи «ключ \t написание \t номер записи»
+#   keys.idx   — смещения строк keys.bin (uint32) для двоичного поиска
+# Версия собирается во временном каталоге под файловой блокировкой и
+# публикуется целиком заменой ссылки current. Строится не в запросе, а при
+# старте (prepare() в create_app) или заранее: python -m services.geocoder build.
+# Файлы читаются через mmap: в памяти процесса почти ничего не хранится,
+# а страницы общие для всех воркеров.
+#
+# В выдаче — каноническое название места, а не совпавшее написание («питер»
+# и «Saint Petersburg» дают «Санкт-Петербург»). Если для lang="ru" у места нет
+# русского названия, поиск возвращает пусто и geo.py идёт в удалённый API.
+
+GEONAMES_PATH = os.getenv("GEONAMES_PATH", "data/geonames/cities15000.txt")
+GEONAMES_ALTERNATES = os.getenv("GEONAMES_ALTERNATES", "")
+INDEX_DIR = os.getenv("GEOCODER_INDEX_DIR", ".cache/geocoder")
+# формат places.bin; индекс другого формата пересобирается
+INDEX_FORMAT = "2"
+
+# сколько совпадений по префиксу просматривать перед ранжированием
+MAX_PREFIX_SCAN = 2000
+# сколько ключей просматривать при поиске с опечаткой
+MAX_FUZZY_SCAN = 20000
+
+COUNTRY_RU = {
+    "RU": "Россия", "BY": "Беларусь", "UA": "Украина", "KZ": "Казахстан",
+    "FI": "Финляндия", "EE": "Эстония", "LV": "Латвия", "LT": "Литва",
+    "PL": "Польша", "NO": "Норвегия", "SE": "Швеция", "DE": "Германия",
+    "GE": "Грузия", "AM": "Армения", "AZ": "Азербайджан", "UZ": "Узбекистан",
+    "KG": "Киргизия", "TJ": "Таджикистан", "TM": "Туркмения", "MD": "Молдавия",
+    "TR": "Турция", "CN": "Китай", "MN": "Монголия", "US": "США",
+    "GB": "Великобритания", "FR": "Франция", "IT": "Италия", "ES": "Испания",
+}
+
+_CYRILLIC = re.compile("[а-яё]", re.IGNORECASE)
+_LATIN_ONLY = re.compile(r"^[a-z0-9 .'\-]+$", re.IGNORECASE)
+
+
+def normalize(text):
+    return " ".join((text or "").lower().replace("ё", "е").replace("-", " ").split())
+
+
+def _keep_alternate(name):
+    # русские и латинские написания; прочие алфавиты и коды (аэропорты и т.п.) — нет
+    if len(name) < 2 or name.isupper():
+        return False
+    return bool(_CYRILLIC.search(name) or _LATIN_ONLY.match(name))
+
+
+def _read_lookup(path, key_col, value_col):
+    out = {}
+    if not os.path.exists(path):
+        return out
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("#"):
+                continue
+            cols = line.rstrip("\n").split("\t")
+            if len(cols) > max(key_col, value_col):
+                out[cols[key_col]] = cols[value_col]
+    return out
+
+
+def _read_ru_names(path, wanted):
+    # geonameid -> русское название из alternateNamesV2.txt: «id, geonameid,
+    # isolanguage, name, isPreferredName, isShortName, isColloquial, isHistoric».
+    # Разговорные («Питер») и исторические не берём; предпочтительное — первым,
+    # для стран — краткое («Россия», а не «Российская Федерация»).
+    best = {}
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            cols = line.rstrip("\n").split("\t")
+            if len(cols) < 4 or cols[2] != "ru" or cols[1] not in wanted:
+                continue
+            preferred, short, colloquial, historic = (
+                (cols[i] if len(cols) > i else "") == "1" for i in (4, 5, 6, 7))
+            if colloquial or historic:
+                continue
+            if wanted[cols[1]]:
+                rank = (not short, not preferred)
+            else:
+                rank = (not preferred, short)
+            if cols[1] not in best or rank < best[cols[1]][0]:
+                best[cols[1]] = (rank, cols[3])
+    return {gid: name for gid, (_, name) in best.items()}
+
+
+def _current(index_dir):
+    # каталог опубликованной версии текущего формата
+    link = os.path.join(index_dir, "current")
+    if not os.path.exists(link):
+        return None
+    path = os.path.realpath(link)
+    try:
+        with open(os.path.join(path, "format")) as f:
+            if f.read().strip() != INDEX_FORMAT:
+                return None
+    except OSError:
+        return None
+    return path
+
+
+def _stale(dump_path, index_dir):
+    current = _current(index_dir)
+    return current is None or os.path.getmtime(os.path.join(current, "keys.idx")) < os.path.getmtime(dump_path)
+
+
+def build_index(dump_path=GEONAMES_PATH, out_dir=INDEX_DIR, force=True):
+    """Строит и публикует новую версию индекса; (мест, ключей) или None, если
+    force=False и индекс уже новее дампа (его успел собрать другой процесс)."""
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if not force and not _stale(dump_path, out_dir):
+                return None
+            return _build(dump_path, out_dir)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _build(dump_path, out_dir):
+    base = os.path.dirname(dump_path)
+    countries = _read_lookup(os.path.join(base, "countryInfo.txt"), 0, 4)
+    country_ids = _read_lookup(os.path.join(base, "countryInfo.txt"), 0, 16)
+    admin1 = _read_lookup(os.path.join(base, "admin1CodesASCII.txt"), 0, 1)
+    admin1_ids = _read_lookup(os.path.join(base, "admin1CodesASCII.txt"), 0, 3)
+
+    places = []
+    with open(dump_path, encoding="utf-8") as f:
+        for line in f:
+            cols = line.rstrip("\n").split("\t")
+            if len(cols) >= 15 and cols[6] == "P":
+                places.append(cols)
+
+    # alternateNames большой — из него берём только нужные id
+    # (значение — предпочитать ли краткое название, как у стран)
+    wanted = {cols[0]: False for cols in places}
+    wanted.update((gid, False) for gid in admin1_ids.values() if gid)
+    wanted.update((gid, True) for gid in country_ids.values() if gid)
+    ru = _read_ru_names(GEONAMES_ALTERNATES or os.path.join(base, "alternateNamesV2.txt"), wanted)
+
+    records = []
+    keys = []
+    for cols in places:
+        name, ascii_name, alternates = cols[1], cols[2], cols[3]
+        cc = cols[8]
+        admin1_code = f"{cc}.{cols[10]}"
+        rec_no = len(records)
+        records.append("\t".join((
+            name,
+            ru.get(cols[0], ""),
+            countries.get(cc, cc),
+            ru.get(country_ids.get(cc), "") or COUNTRY_RU.get(cc, ""),
+            cc,
+            admin1.get(admin1_code, ""),
+            ru.get(admin1_ids.get(admin1_code), ""),
+            cols[4],
+            cols[5],
+            cols[14] or "0",
+        )))
+        seen = set()
+        for variant in (name, ascii_name, *alternates.split(",")):
+            if variant is not name and variant is not ascii_name and not _keep_alternate(variant):
+                continue
+            key = normalize(variant)
+            if key and key not in seen:
+                seen.add(key)
+                keys.append((key.encode(), variant, rec_no))
+
+    keys.sort(key=lambda k: k[0])
+    version = f"v-{time.time_ns()}-{os.getpid()}"
+    tmp = os.path.join(out_dir, f".{version}.tmp")
+    os.makedirs(tmp)
+    try:
+        _write_version(tmp, records, keys)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    os.rename(tmp, os.path.join(out_dir, version))
+
+    # публикация одной заменой ссылки: читатели видят либо старую версию
+    # целиком, либо новую; открытые mmap старых файлов остаются валидны
+    link_tmp = os.path.join(out_dir, f".current.{os.getpid()}.tmp")
+    os.symlink(version, link_tmp)
+    os.replace(link_tmp, os.path.join(out_dir, "current"))
+    for old in sorted(glob.glob(os.path.join(out_dir, "v-*")))[:-2]:
+        for path in glob.glob(os.path.join(old, "*")):
+            os.remove(path)
+        os.rmdir(old)
+    return len(records), len(keys)
+
+
+def _write_version(path, records, keys):
+    with open(os.path.join(path, "places.bin"), "w", encoding="utf-8") as f:
+        f.write("\n".join(records) + "\n")
+    offsets = array("I")
+    with open(os.path.join(path, "keys.bin"), "wb") as f:
+        pos = 0
+        for key, variant, rec_no in keys:
+            line = key + b"\t" + variant.encode() + b"\t" + str(rec_no).encode() + b"\n"
+            offsets.append(pos)
+            f.write(line)
+            pos += len(line)
+    with open(os.path.join(path, "keys.idx"), "wb") as f:
+        offsets.tofile(f)
+    with open(os.path.join(path, "format"), "w") as f:
+        f.write(INDEX_FORMAT + "\n")
+
+
+def _within(a, b, limit):
+    # расстояние Дамерау–Левенштейна не больше limit (с отсечением по полосе)
+    if abs(len(a) - len(b)) > limit:
+        return False
+    prev2 = None
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if prev2 is not None and i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+        if min(cur) > limit:
+            return False
+        prev2, prev = prev, cur
+    return prev[-1] <= limit
+
+
+class Geocoder:
+    def __init__(self, index_dir):
+        self._files = []
+        self.keys = self._map(os.path.join(index_dir, "keys.bin"))
+        self.places = self._map(os.path.join(index_dir, "places.bin"))
+        self.offsets = memoryview(self._map(os.path.join(index_dir, "keys.idx"))).cast("I")
+        # смещения строк places.bin — одно сканирование при загрузке
+        self.place_offsets = array("I", [0])
+        pos = self.places.find(b"\n")
+        while pos != -1 and pos + 1 < len(self.places):
+            self.place_offsets.append(pos + 1)
+            pos = self.places.find(b"\n", pos + 1)
+
+    def _map(self, path):
+        f = open(path, "rb")
+        self._files.append(f)
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _line(self, i):
+        start = self.offsets[i]
+        end = self.keys.find(b"\n", start)
+        return self.keys[start:end]
+
+    def _key(self, i):
+        line = self._line(i)
+        return line[:line.index(b"\t")]
+
+    def _lower_bound(self, prefix):
+        lo, hi = 0, len(self.offsets)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < prefix:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _range(self, prefix, limit):
+        i = self._lower_bound(prefix)
+        n = len(self.offsets)
+        while i < n and limit > 0:
+            line = self._line(i)
+            key, variant, rec_no = line.split(b"\t")
+            if not key.startswith(prefix):
+                break
+            yield key, variant, int(rec_no)
+            i += 1
+            limit -= 1
+
+    def _record(self, rec_no):
+        start = self.place_offsets[rec_no]
+        end = self.places.find(b"\n", start)
+        name, name_ru, country, country_ru, cc, admin1, admin1_ru, lat, lon, population = (
+            self.places[start:end].decode().split("\t"))
+        return (name, name_ru, country, country_ru, cc, admin1, admin1_ru,
+                float(lat), float(lon), int(population or 0))
+
+    def _fuzzy(self, q, limit_dist):
+        # опечатка чаще не в первых буквах; перестановку первых двух тоже ловим
+        heads = {q[:2]}
+        if len(q) > 2:
+            heads.add(q[1] + q[0])
+        seen = set()
+        for head in heads:
+            for key, variant, rec_no in self._range(head.encode(), MAX_FUZZY_SCAN):
+                if rec_no in seen:
+                    continue
+                k = key.decode()
+                if any(_within(q, k[:len(q) + d], limit_dist) for d in (-1, 0, 1)):
+                    seen.add(rec_no)
+                    yield key, variant, rec_no
+
+    def search(self, query, count=5, lang="ru"):
+        q = normalize(query)
+        if not q:
+            return []
+        qb = q.encode()
+        matches = {}  # номер записи -> было ли точное совпадение
+        for key, variant, rec_no in self._range(qb, MAX_PREFIX_SCAN):
+            matches[rec_no] = matches.get(rec_no, False) or key == qb
+        if len(matches) < count and len(q) >= 3:
+            limit_dist = 1 if len(q) < 6 else 2
+            for key, variant, rec_no in self._fuzzy(q, limit_dist):
+                matches.setdefault(rec_no, False)
+                if len(matches) >= MAX_PREFIX_SCAN:
+                    break
+
+        ranked = []
+        for rec_no, exact in matches.items():
+            record = self._record(rec_no)
+            ranked.append((not exact, -record[-1], rec_no, record))
+        ranked.sort()
+
+        results = []
+        for _, _, _, record in ranked[:count]:
+            name, name_ru, country, country_ru, cc, admin1, admin1_ru, lat, lon, _ = record
+            if lang == "ru":
+                # без русского названия отдаём пусто — ответит удалённый API
+                if not name_ru or not country_ru:
+                    return []
+                name, country, admin1 = name_ru, country_ru, admin1_ru
+            results.append({
+                "name": name,
+                "country": country,
+                "admin1": admin1 or None,
+                "lat": lat,
+                "lon": lon,
+            })
+        return results
+
+
+_geocoder = None
+_load_lock = threading.Lock()
+_load_failed = False
+
+
+def prepare():
+    """Собирает индекс, если дамп новее, и загружает его — при старте
+    приложения (create_app), а не в первом запросе. Ошибки не фатальны:
+    поиск уходит в удалённый API."""
+    try:
+        if os.path.exists(GEONAMES_PATH):
+            built = build_index(force=False)
+            if built is not None:
+                log.info("geocoder index built: %d places, %d keys", *built)
+    except Exception:
+        log.warning("geocoder index build failed", exc_info=True)
+    return get_geocoder()
+
+
+def get_geocoder():
+    """Загружает готовый индекс при первом обращении; индекс не строит.
+
+    Без индекса (или если он не читается) возвращает None — тогда работает
+    только удалённый API.
+    """
+    global _geocoder, _load_failed
+    if _geocoder is not None or _load_failed:
+        return _geocoder
+    with _load_lock:
+        if _geocoder is None and not _load_failed:
+            current = _current(INDEX_DIR)
+            try:
+                if current is not None:
+                    _geocoder = Geocoder(current)
+                else:
+                    _load_failed = True
+            except Exception:
+                log.warning("geocoder index %s unreadable", current, exc_info=True)
+                _load_failed = True
+    return _geocoder
+
+
+def ready():
+    # индекс уже загружен (или его нет) — search не будет сканировать places.bin
+    return _geocoder is not None or _load_failed
+
+
+def search(query, count=5, lang="ru"):
+    geocoder = get_geocoder()
+    if geocoder is None:
+        return []
+    return geocoder.search(query, count=count, lang=lang)
+
+
+if __name__ == "__main__":
+    # python -m services.geocoder build [path/to/cities15000.txt]
+    if len(sys.argv) >= 2 and sys.argv[1] == "build":
+        n_places, n_keys = build_index(sys.argv[2] if len(sys.argv) > 2 else GEONAMES_PATH)
+        print(f"indexed {n_places} places, {n_keys} keys -> {INDEX_DIR}")
+    else:
+        print("usage: python -m services.geocoder build [cities15000.txt]")
@@ -0,0 +1,163 @@
+import asyncio
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from services.fanout import POOL_SIZES
+
+try:
+    import httpx  # нужен только асинхронному режиму (asgi.py)
+except ImportError:
+    httpx = None
+
+# Общая HTTP-сессия для всех внешних запросов: keep-alive и пул соединений
+# на хост, чтобы не платить за TCP+TLS на каждый вызов.
+
+# Соединений на хост в пуле процесса: столько потоков воркера могут
+# одновременно ходить к одному источнику
+POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", str(POOL_SIZES["upstream"])))
+
+# Контакт для операторов источников (URL репозитория или почта) — из окружения;
+# без него User-Agent без контакта, а не с чужим адресом
+HTTP_CONTACT = os.getenv("HTTP_CONTACT", "")
+USER_AGENT = os.getenv(
+    "HTTP_USER_AGENT", f"nw-weather-site/1.0 (+{HTTP_CONTACT})" if HTTP_CONTACT else "nw-weather-site/1.0"
+)
+
+try:
+    import brotli  # noqa: F401  — urllib3 умеет распаковывать br, если модуль есть
+    ACCEPT_ENCODING = "br, gzip, deflate"
+except ImportError:
+    ACCEPT_ENCODING = "gzip, deflate"
+
+# Повторяем только то, что безопасно: ошибки соединения и 502/503/504.
+# Таймаут чтения не повторяем — это удвоило бы время ожидания.
+RETRY = Retry(
+    total=2,
+    connect=2,
+    read=0,
+    status=2,
+    backoff_factor=0.3,
+    status_forcelist=(502, 503, 504),
+    allowed_methods=frozenset({"GET", "HEAD"}),
+    respect_retry_after_header=True,
+    raise_on_status=False,
+)
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+# Задержка по хостам: count, total, max (секунды)
+_timings = {}
+_timings_lock = threading.Lock()
+
+
+def _make_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=POOL_SIZE, max_retries=RETRY)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"User-Agent": USER_AGENT, "Accept-Encoding": ACCEPT_ENCODING})
+    return session
+
+
+def session():
+    # сессия создаётся заново в каждом процессе: после fork (gunicorn
+    # --preload) соединения пула принадлежат мастеру
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session_pid != pid:
+                _reset_locked()
+            if _session is None:
+                _session, _session_pid = _make_session(), pid
+    return _session
+
+
+def _reset_locked():
+    global _session
+    if _session is not None:
+        _session.close()
+    _session = None
+
+
+def _record(host, elapsed):
+    with _timings_lock:
+        t = _timings.get(host)
+        if t is None:
+            t = _timings[host] = {"count": 0, "total": 0.0, "max": 0.0}
+        t["count"] += 1
+        t["total"] += elapsed
+        t["max"] = max(t["max"], elapsed)
+
+
+def get(url, *, params=None, headers=None, timeout=15):
+    started = time.monotonic()
+    try:
+        return session().get(url, params=params, headers=headers, timeout=timeout)
+    finally:
+        _record(urlparse(url).netloc, time.monotonic() - started)
+
+
+# -----------------------------
+# Асинхронный клиент
+# -----------------------------
+# Один httpx.AsyncClient на event loop: в асинхронном воркере сотни
+# ожиданий внешних источников держат соединения, а не потоки.
+
+# Соединений на хост у асинхронного клиента: ожидание не занимает поток,
+# поэтому предел выше, чем у пула requests
+ASYNC_POOL_SIZE = int(os.getenv("HTTP_ASYNC_POOL_SIZE", "100"))
+
+_async_clients = {}
+
+
+def async_client():
+    if httpx is None:
+        raise RuntimeError("async mode requires httpx (pip install httpx)")
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = httpx.AsyncClient(
+            headers={"User-Agent": USER_AGENT, "Accept-Encoding": ACCEPT_ENCODING},
+            # limits — у транспорта: при явном transport= клиент свои limits не применяет.
+            # Повтор только при ошибке соединения, как и у RETRY
+            transport=httpx.AsyncHTTPTransport(
+                retries=RETRY.connect,
+                limits=httpx.Limits(
+                    max_connections=ASYNC_POOL_SIZE * 4,
+                    max_keepalive_connections=ASYNC_POOL_SIZE,
+                ),
+            ),
+            follow_redirects=True,
+        )
+    return client
+
+
+async def aclose():
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+async def aget(url, *, params=None, headers=None, timeout=15):
+    started = time.monotonic()
+    try:
+        return await async_client().get(url, params=params, headers=headers, timeout=timeout)
+    finally:
+        _record(urlparse(url).netloc, time.monotonic() - started)
+
+
+def timings():
+    with _timings_lock:
+        return {
+            host: {**t, "avg": t["total"] / t["count"] if t["count"] else 0.0}
+            for host, t in _timings.items()
+        }
@@ -0,0 +1,78 @@
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Кэш готовых ответов (страниц и JSON) по ETag. ETag строится из версий
+# данных, поэтому после обновления курсов/новостей/погоды ключ меняется сам:
+# старые тела становятся недостижимы и вытесняются LRU.
+
+MAX_ENTRIES = 256
+PAGE_ENTRIES = 32
+GZIP_LEVEL = 6
+
+# Cache-Control по маршрутам: страницы — коротко, справочные данные — дольше
+CACHE_CONTROL = {
+    "page": "public, max-age=60, stale-while-revalidate=300",
+    "rates": "public, max-age=300, stale-while-revalidate=3600",
+    "weather": "public, max-age=600, stale-while-revalidate=1800",
+}
+
+
+def make_etag(*parts):
+    # сильный ETag (без кавычек) из версий данных и параметров запроса
+    return hashlib.blake2b(repr(parts).encode(), digest_size=12).hexdigest()
+
+
+def encoded_etag(etag, gzipped):
+    # у сжатого и несжатого представлений разные сильные валидаторы (RFC 9110),
+    # иначе кэш по 304 может отдать не то тело
+    return f"{etag}-gz" if gzipped else etag
+
+
+class ResponseCache:
+    def __init__(self, maxsize=MAX_ENTRIES):
+        self.maxsize = maxsize
+        self._data = OrderedDict()  # etag -> gzip-тело
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def get_gzip(self, etag, render):
+        """Сжатое тело для etag; render() вызывается только при промахе."""
+        with self._lock:
+            body = self._data.get(etag)
+            if body is not None:
+                self.hits += 1
+                self._data.move_to_end(etag)
+                return body
+            self.misses += 1
+        raw = render()
+        if isinstance(raw, str):
+            raw = raw.encode()
+        body = gzip.compress(raw, GZIP_LEVEL)
+        with self._lock:
+            self._data[etag] = body
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return body
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "not_modified": self.not_modified,
+                "bytes": sum(len(b) for b in self._data.values()),
+            }
+
+
+responses = ResponseCache()
+pages = ResponseCache(PAGE_ENTRIES)
+
+
+def cache_for(kind):
+    # у страниц свой кэш: их не вытеснят ответы по тысячам координат погоды
+    return pages if kind == "page" else responses
@@ -0,0 +1,328 @@
+import bisect
+import cProfile
+import glob
+import inspect
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from functools import wraps
+
+from services.cache import CACHES
+
+log = logging.getLogger(__name__)
+
+# Метрики в формате Prometheus (/metrics): гистограммы задержек маршрутов,
+# внешних источников и обёрнутых функций, ошибки, размеры ответов, статистика
+# кэшей. Запись — инкремент в словаре под одним локом, статистика кэшей
+# снимается только при сбросе, так что метрики можно держать включёнными.
+#
+# Воркеры gunicorn — отдельные процессы. Каждый раз в METRICS_FLUSH_SECONDS
+# сбрасывает свои значения в METRICS_DIR/<pid>.json, а /metrics (в любом
+# воркере) складывает файлы всех воркеров. METRICS_DIR="" — только свой процесс.
+
+METRICS_DIR = os.getenv("METRICS_DIR", ".cache/metrics")
+FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+# файлы завершившихся воркеров старше этого срока удаляются
+DEAD_WORKER_TTL = 3600
+
+# Выборочное профилирование: доля запросов под cProfile; профиль
+# сохраняется, только если запрос оказался медленнее PROFILE_SLOW
+PROFILE_RATE = float(os.getenv("METRICS_PROFILE_RATE", "0"))
+PROFILE_SLOW = float(os.getenv("METRICS_PROFILE_SLOW", "1.0"))
+PROFILE_DIR = os.getenv("METRICS_PROFILE_DIR", ".cache/profiles")
+PROFILE_KEEP = 50
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# имя -> (тип, описание, границы корзин)
+METRICS = {
+    "nw_http_request_duration_seconds": ("histogram", "HTTP request latency by route", LATENCY_BUCKETS),
+    "nw_http_response_size_bytes": ("histogram", "HTTP response body size by route", SIZE_BUCKETS),
+    "nw_upstream_request_duration_seconds": ("histogram", "Upstream call latency", LATENCY_BUCKETS),
+    "nw_upstream_response_size_bytes": ("histogram", "Upstream response body size", SIZE_BUCKETS),
+    "nw_upstream_errors_total": ("counter", "Failed upstream calls", None),
+    "nw_call_duration_seconds": ("histogram", "Latency of instrumented functions (including cache)", LATENCY_BUCKETS),
+    "nw_call_errors_total": ("counter", "Exceptions raised by instrumented functions", None),
+    "nw_cache_lookups_total": ("counter", "Cache lookups by result", None),
+    "nw_cache_evictions_total": ("counter", "Cache LRU evictions", None),
+    "nw_cache_refresh_errors_total": ("counter", "Failed background cache refreshes", None),
+    "nw_cache_entries": ("gauge", "Entries held in cache", None),
+    "nw_profiles_saved_total": ("counter", "Slow-request profiles written to disk", None),
+    "nw_admission_rejected_total": ("counter", "Requests rejected by per-client rate limits", None),
+    "nw_upstream_shed_total": ("counter", "Upstream calls shed by the concurrency cap", None),
+}
+
+_lock = threading.Lock()
+_hist = {}      # (имя, метки) -> [счётчики корзин..., +Inf, сумма]
+_counters = {}  # (имя, метки) -> значение
+_flusher_pid = None
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def observe(name, value, **labels):
+    buckets = METRICS[name][2]
+    key = _key(name, labels)
+    i = bisect.bisect_left(buckets, value)
+    with _lock:
+        h = _hist.get(key)
+        if h is None:
+            h = _hist[key] = [0] * (len(buckets) + 1) + [0.0]
+        h[i] += 1
+        h[-1] += value
+    if _flusher_pid != os.getpid():
+        _start_flusher()
+
+
+def inc(name, value=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+    if _flusher_pid != os.getpid():
+        _start_flusher()
+
+
+# -----------------------------
+# Точки записи
+# -----------------------------
+
+def observe_request(route, method, status, seconds, size=None):
+    observe("nw_http_request_duration_seconds", seconds, route=route, method=method, status=str(status))
+    if size is not None:
+        observe("nw_http_response_size_bytes", size, route=route)
+
+
+def observe_upstream(upstream, seconds, error=None):
+    observe("nw_upstream_request_duration_seconds", seconds, upstream=upstream)
+    if error is not None:
+        inc("nw_upstream_errors_total", upstream=upstream, error=error)
+
+
+def observe_upstream_size(upstream, size):
+    observe("nw_upstream_response_size_bytes", size, upstream=upstream)
+
+
+def timed(name):
+    """Декоратор: задержка и исключения функции (синхронной или корутины) под меткой name."""
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @wraps(fn)
+            async def awrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                except Exception as e:
+                    inc("nw_call_errors_total", fn=name, error=type(e).__name__)
+                    raise
+                finally:
+                    observe("nw_call_duration_seconds", time.perf_counter() - started, fn=name)
+            return awrapper
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                inc("nw_call_errors_total", fn=name, error=type(e).__name__)
+                raise
+            finally:
+                observe("nw_call_duration_seconds", time.perf_counter() - started, fn=name)
+        return wrapper
+    return decorator
+
+
+# -----------------------------
+# Профилирование медленных запросов
+# -----------------------------
+
+def start_profile():
+    """cProfile для выбранного запроса (доля PROFILE_RATE) или None."""
+    if PROFILE_RATE <= 0 or random.random() >= PROFILE_RATE:
+        return None
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError:
+        return None  # в потоке уже работает другой профилировщик
+    return profile
+
+
+def finish_profile(profile, route, seconds):
+    if profile is None:
+        return
+    profile.disable()
+    if seconds < PROFILE_SLOW:
+        return
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        slug = re.sub(r"[^a-zA-Z0-9]+", "_", route).strip("_") or "root"
+        path = os.path.join(PROFILE_DIR, f"{int(time.time() * 1000)}-{os.getpid()}-{slug}-{int(seconds * 1000)}ms.prof")
+        profile.dump_stats(path)
+        inc("nw_profiles_saved_total", route=route)
+        # держим только последние PROFILE_KEEP файлов
+        files = sorted(glob.glob(os.path.join(PROFILE_DIR, "*.prof")))
+        for old in files[:-PROFILE_KEEP]:
+            os.remove(old)
+    except OSError:
+        log.warning("failed to save profile for %s", route, exc_info=True)
+
+
+# -----------------------------
+# Снимки и сбор по воркерам
+# -----------------------------
+
+def _cache_series():
+    # статистика кэшей — в момент снимка, а не на каждом обращении
+    counters, gauges = [], []
+    for name, cache in list(CACHES.items()):
+        s = cache.stats()
+        for result, field in (("hit", "hits"), ("stale", "stale_hits"), ("shared", "shared_hits"), ("miss", "misses")):
+            counters.append(("nw_cache_lookups_total", (("cache", name), ("result", result)), s[field]))
+        counters.append(("nw_cache_evictions_total", (("cache", name),), s["evictions"]))
+        counters.append(("nw_cache_refresh_errors_total", (("cache", name),), s["refresh_errors"]))
+        gauges.append(("nw_cache_entries", (("cache", name),), s["size"]))
+    return counters, gauges
+
+
+def snapshot():
+    with _lock:
+        hist = [(name, labels, list(h)) for (name, labels), h in _hist.items()]
+        counters = [(name, labels, v) for (name, labels), v in _counters.items()]
+    cache_counters, gauges = _cache_series()
+    return {
+        "pid": os.getpid(),
+        "ts": time.time(),
+        "hist": hist,
+        "counters": counters + cache_counters,
+        "gauges": gauges,
+    }
+
+
+def flush():
+    if not METRICS_DIR:
+        return
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = os.path.join(METRICS_DIR, f"{os.getpid()}.json")
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(snapshot(), f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_SECONDS)
+        try:
+            flush()
+        except Exception:
+            log.warning("metrics flush failed", exc_info=True)
+
+
+def _start_flusher():
+    global _flusher_pid
+    with _lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+    if METRICS_DIR:
+        threading.Thread(target=_flush_loop, name="metrics-flush", daemon=True).start()
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _snapshots():
+    if not METRICS_DIR:
+        return [snapshot()]
+    flush()
+    out = []
+    for path in glob.glob(os.path.join(METRICS_DIR, "*.json")):
+        try:
+            with open(path, encoding="utf-8") as f:
+                snap = json.load(f)
+        except (OSError, ValueError):
+            continue
+        snap["alive"] = _alive(snap["pid"])
+        if not snap["alive"] and time.time() - snap["ts"] > DEAD_WORKER_TTL:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            continue
+        out.append(snap)
+    return out
+
+
+def collect():
+    """Сумма по воркерам: {(имя, метки): значение или список корзин}."""
+    hist, counters, gauges = {}, {}, {}
+    for snap in _snapshots():
+        for name, labels, h in snap["hist"]:
+            key = (name, tuple(map(tuple, labels)))
+            acc = hist.get(key)
+            if acc is None:
+                hist[key] = list(h)
+            else:
+                for i, v in enumerate(h):
+                    acc[i] += v
+        for name, labels, v in snap["counters"]:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + v
+        # текущие размеры — только у живых воркеров
+        if snap.get("alive", True):
+            for name, labels, v in snap["gauges"]:
+                key = (name, tuple(map(tuple, labels)))
+                gauges[key] = gauges.get(key, 0) + v
+    return hist, counters, gauges
+
+
+def _labels(labels, extra=()):
+    pairs = (*labels, *extra)
+    if not pairs:
+        return ""
+    esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in pairs) + "}"
+
+
+def _num(v):
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+def render():
+    """Текстовый формат Prometheus 0.0.4."""
+    hist, counters, gauges = collect()
+    by_name = {}
+    for (name, labels), v in (*hist.items(), *counters.items(), *gauges.items()):
+        by_name.setdefault(name, []).append((labels, v))
+
+    lines = []
+    for name in sorted(by_name):
+        kind, help_text, buckets = METRICS.get(name, ("untyped", "", None))
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, v in sorted(by_name[name]):
+            if kind != "histogram":
+                lines.append(f"{name}{_labels(labels)} {_num(v)}")
+                continue
+            cumulative = 0
+            for bound, count in zip((*buckets, "+Inf"), v[:-1]):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(labels, (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {_num(v[-1])}")
+            lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
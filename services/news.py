@@ -1,23 +1,146 @@
+import asyncio
+import calendar
+import os
+import threading
+from urllib.parse import urlparse
+
 from services.cache import ttl_cache
-import feedparser
+from services.fanout import run_parallel
+from services import metrics, resilience, warmstate
 
 FEEDS = [
     "https://www.interfax.ru/rss.asp",  # Интерфакс
     "https://tass.ru/rss/v2.xml",       # ТАСС
 ]
+# NEWS_FEEDS — список лент через запятую вместо встроенного
+if os.getenv("NEWS_FEEDS"):
+    FEEDS = [u.strip() for u in os.environ["NEWS_FEEDS"].split(",") if u.strip()]
+
+# сколько записей ленты сохранять после разбора
+MAX_ENTRIES_PER_FEED = 50
+
+# сколько новостей держать в общем хранилище (самые свежие)
+MAX_STORE = 500
+
+# общий дедлайн на опрос всех лент (секунды)
+INGEST_DEADLINE = 12
+
+def _entry_ts(e):
+    parsed = e.get("published_parsed") or e.get("updated_parsed")
+    return calendar.timegm(parsed) if parsed else 0
+
+def _parse_feed(response):
+    # feedparser тяжёлый (~0.1 с на импорт): грузим при первом разборе, а не при старте
+    import feedparser
+    feed = feedparser.parse(response.content)
+    if feed.bozo and not feed.entries:
+        raise ValueError(f"{response.url}: unreadable feed ({feed.get('bozo_exception')})")
+    source = feed.feed.get("title", "RSS")
+    return [
+        {
+            "id": e.get("id") or e.get("link") or e.get("title"),
+            "ts": _entry_ts(e),
+            "title": e.get("title"),
+            "link": e.get("link"),
+            "published": e.get("published"),
+            "source": source,
+        }
+        for e in feed.entries[:MAX_ENTRIES_PER_FEED]
+    ]
+
+def _fetch_feed(url):
+    # скачиваем сами (с таймаутом и предохранителем), feedparser только разбирает,
+    # и только если лента изменилась (ETag / Last-Modified)
+    return resilience.get_parsed("rss:" + urlparse(url).netloc, url, _parse_feed, max_timeout=10)
+
+async def _afetch_feed(url):
+    return await resilience.aget_parsed("rss:" + urlparse(url).netloc, url, _parse_feed, max_timeout=10)
+
+# Хранилище новостей: отсортировано по времени публикации (новые сверху),
+# без повторов по guid/ссылке. Новые записи вливаются, старые вытесняются.
+_store = ()
+_store_lock = threading.Lock()
+
+def _merge(current, incoming):
+    seen = set()
+    merged = []
+    for item in sorted((*incoming, *current), key=lambda it: it.get("ts", 0), reverse=True):
+        keys = {item.get("id"), item.get("link")} - {None}
+        if keys & seen:
+            continue
+        seen |= keys
+        merged.append(item)
+        if len(merged) >= MAX_STORE:
+            break
+    return tuple(merged)
 
-@ttl_cache(600)
-def get_headlines(limit=10):
-    items = []
+@ttl_cache(600, maxsize=1)
+def _ingest():
+    # все ленты опрашиваются одновременно: новые источники не добавляют задержки
+    results = run_parallel({url: (lambda url=url: _fetch_feed(url)) for url in FEEDS}, timeout=INGEST_DEADLINE)
+    return _ingest_results(results)
+
+@_ingest.cache_async
+async def _aingest():
+    async def one(url):
+        try:
+            return await _afetch_feed(url), None
+        except Exception as e:
+            return None, e
+    tasks = {url: asyncio.ensure_future(one(url)) for url in FEEDS}
+    done, pending = await asyncio.wait(tasks.values(), timeout=INGEST_DEADLINE)
+    for task in pending:
+        task.cancel()
+    results = {
+        url: task.result() if task in done else (None, TimeoutError(f"{url}: deadline exceeded"))
+        for url, task in tasks.items()
+    }
+    return _ingest_results(results)
+
+def _ingest_results(results):
+    global _store
+    incoming = []
+    errors = []
     for url in FEEDS:
-        feed = feedparser.parse(url)
-        for e in feed.entries[: limit // len(FEEDS) + 2]:
-            items.append({
-                "title": e.get("title"),
-                "link": e.get("link"),
-                "published": e.get("published"),
-                "source": feed.feed.get("title", "RSS"),
-            })
-    # обрежем общий список
-
-    return items[:limit]
+        entries, err = results[url]
+        if err is not None:
+            # одна недоступная лента не должна лишать нас остальных
+            errors.append(err)
+            continue
+        incoming.extend(entries)
+    if len(errors) == len(FEEDS):
+        raise errors[0]
+
+    with _store_lock:
+        _store = _merge(_store, incoming)
+        return _store
+
+def _restore_store(store):
+    # хранилище из снимка (services/warmstate.py): следующий опрос вливается в него
+    global _store
+    with _store_lock:
+        _store = _merge(_store, store)
+
+warmstate.register(_ingest, on_load=_restore_store)
+
+@metrics.timed("get_headlines")
+def get_headlines(limit=10, offset=0):
+    # срез готового списка — O(limit), разные размеры страниц не требуют новых запросов
+    return list(_ingest()[offset:offset + limit])
+
+@metrics.timed("get_headlines")
+async def aget_headlines(limit=10, offset=0):
+    return list((await _aingest())[offset:offset + limit])
+
+def refresh_headlines():
+    _ingest.cache_refresh()
+
+def get_headlines_versioned(limit=10, offset=0):
+    # (новости, версия хранилища, из которого они взяты)
+    store, version = _ingest.cache_versioned()
+    return list(store[offset:offset + limit]), version
+
+def latest_headlines(limit=20):
+    # (новости, версия) из кэша без опроса лент
+    store, version = _ingest.cache_latest()
+    return (list(store[:limit]), version) if store is not None else (None, None)
@@ -1,10 +1,16 @@
+import json
+import logging
+import os
+import threading
 from datetime import datetime
 from typing import Optional
 
 from services.cache import ttl_cache
-import requests
-
-CBR_DAILY = "https://www.cbr-xml-daily.ru/daily_json.js"
+from services import metrics, rates_history, resilience, warmstate
+
+log = logging.getLogger(__name__)
+
+CBR_DAILY = os.getenv("CBR_DAILY_URL", "https://www.cbr-xml-daily.ru/daily_json.js")
 
 CURRENCY_META = {
     "USD": {
@@ -23,7 +29,12 @@ CURRENCY_META = {
         "accent": "from-rose-900/90 via-red-700/80 to-amber-600/70",
     },
 }
-
+
+# Фолбэк для фиатных валют: флаг и символ
+FIAT_META = {"USD":{"emoji":"🇺🇸","symbol":"$"},"EUR":{"emoji":"🇪🇺","symbol":"€"},"GBP":{"emoji":"🇬🇧","symbol":"£"},"CNY":{"emoji":"🇨🇳","symbol":"¥"},"JPY":{"emoji":"🇯🇵","symbol":"¥"},"TRY":{"emoji":"🇹🇷","symbol":"₺"},"KZT":{"emoji":"🇰🇿","symbol":"₸"},"UAH":{"emoji":"🇺🇦","symbol":"₴"},"AED":{"emoji":"🇦🇪","symbol":"د.إ"},"BYN":{"emoji":"🇧🇾","symbol":"Br"},"AMD":{"emoji":"🇦🇲","symbol":"֏"},"AZN":{"emoji":"🇦🇿","symbol":"₼"},"EGP":{"emoji":"🇪🇬","symbol":"E£"},"CDF":{"emoji":"🇨🇩","symbol":"FC"}}
+
+SEARCH_LIMIT = 10
+
 def _format_timestamp(raw: str) -> Optional[str]:
     if not raw:
         return None
@@ -40,11 +51,17 @@ def _format_timestamp(raw: str) -> Optional[str]:
     return f"{dt.strftime('%d.%m.%Y %H:%M')}{offset}".strip()
 
 
-@ttl_cache(600)
-def _get_all_cbr_rates():
-    r = requests.get(CBR_DAILY, timeout=10)
-    r.raise_for_status()
-    payload = r.json()
+def _record_history(payload):
+    # каждый новый файл ЦБ — строка в истории курсов (services/rates_history.py)
+    try:
+        rates_history.record_payload(payload)
+    except Exception:
+        log.warning("failed to record rates history", exc_info=True)
+
+
+def _parse_cbr(response):
+    payload = response.json()
+    _record_history(payload)
     data = payload.get("Valute", {})
     updated_label = (
         _format_timestamp(payload.get("Date"))
@@ -77,9 +94,41 @@ def _get_all_cbr_rates():
     return res, updated_label
 
 
+# курсы меняются раз в сутки; свежесть поддерживает планировщик (cbr_cadence).
+# Опрос условный: пока файл не изменился, ЦБ отвечает 304 и разбор не нужен
+@warmstate.register
+@metrics.timed("cbr_rates")
+@ttl_cache(3600)
+def _get_all_cbr_rates():
+    return resilience.get_parsed("cbr", CBR_DAILY, _parse_cbr, max_timeout=10)
+
+
+@metrics.timed("cbr_rates")
+@_get_all_cbr_rates.cache_async
+async def _aget_all_cbr_rates():
+    return await resilience.aget_parsed("cbr", CBR_DAILY, _parse_cbr, max_timeout=10)
+
+
+def refresh_rates():
+    _get_all_cbr_rates.cache_refresh()
+
+
+def get_cbr_rates_versioned(codes=None):
+    # ((курсы, подпись), версия) — версия того же значения, что и курсы
+    (res, updated_label), version = _get_all_cbr_rates.cache_versioned()
+    return _pick(res, updated_label, codes), version
+
+
+def latest_rates():
+    # ((курсы, подпись), версия) из кэша без запроса к ЦБ
+    return _get_all_cbr_rates.cache_latest()
+
+
 def get_cbr_rates(codes=None):
-    res, updated_label = _get_all_cbr_rates()
+    return _pick(*_get_all_cbr_rates(), codes)
+
 
+def _pick(res, updated_label, codes):
     if codes is None:
         return res, updated_label
 
@@ -89,3 +138,144 @@ def get_cbr_rates(codes=None):
             filtered[code] = res[code]
 
     return filtered, updated_label
+
+
+# -----------------------------
+# Поиск по курсам
+# -----------------------------
+
+def _normalize(text):
+    return (text or "").strip().lower().replace("ё", "е")
+
+
+def _ngrams(text, n):
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def _dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+class RatesIndex:
+    """Индекс для /api/rates/search, строится один раз на обновление курсов.
+
+    Постинги по 1–3-граммам кода и названия (русские и латинские буквы
+    одинаково) сужают кандидатов, готовые JSON-фрагменты элементов
+    склеиваются в ответ без повторной сериализации.
+    """
+
+    MAX_N = 3
+    MEMO_SIZE = 1024
+
+    def __init__(self, rates, updated):
+        self.source = rates
+        self.updated = updated
+        self.codes = sorted(rates)
+        self._code = {}
+        self._words = {}
+        self._text = {}
+        self._fragments = {}
+        self._postings = {}
+
+        for code in self.codes:
+            payload = rates[code]
+            meta = FIAT_META.get(code, {})
+            item = {
+                "code": code,
+                "name": payload.get("name"),
+                "value": payload.get("value"),
+                "symbol": payload.get("symbol") or meta.get("symbol"),
+                "emoji": payload.get("emoji") or meta.get("emoji"),
+                "accent": payload.get("accent"),
+                "change": payload.get("change"),
+                "change_percent": payload.get("change_percent"),
+            }
+            self._fragments[code] = _dumps(item)
+
+            code_lc = _normalize(code)
+            name_lc = _normalize(payload.get("name"))
+            self._code[code] = code_lc
+            self._words[code] = tuple(name_lc.split())
+            self._text[code] = (code_lc, name_lc)
+            for field in (code_lc, name_lc):
+                for n in range(1, self.MAX_N + 1):
+                    for gram in _ngrams(field, n):
+                        self._postings.setdefault(gram, set()).add(code)
+
+        self._head = _dumps(self.updated)
+        self.empty_json = self._render(self.codes[:SEARCH_LIMIT])
+        self._memo = {}
+        self._memo_lock = threading.Lock()
+
+    def _render(self, codes):
+        return b'{"updated":' + self._head + b',"items":[' + b",".join(self._fragments[c] for c in codes) + b"]}"
+
+    def _rank(self, code, q):
+        # 0 — точное совпадение кода, 1 — начало кода, 2 — начало слова в названии, 3 — подстрока
+        code_lc = self._code[code]
+        if code_lc == q:
+            return 0
+        if code_lc.startswith(q):
+            return 1
+        if any(w.startswith(q) for w in self._words[code]):
+            return 2
+        return 3
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        q = _normalize(query)
+        if not q:
+            return self.codes[:limit]
+        grams = _ngrams(q, min(len(q), self.MAX_N))
+        candidates = None
+        for gram in grams:
+            posting = self._postings.get(gram)
+            if not posting:
+                return []
+            candidates = posting if candidates is None else candidates & posting
+        # n-граммы дают надмножество — подстроку проверяем явно
+        matched = [c for c in candidates if any(q in field for field in self._text[c])]
+        matched.sort(key=lambda c: (self._rank(c, q), c))
+        return matched[:limit]
+
+    def search_json(self, query):
+        q = _normalize(query)
+        if not q:
+            return self.empty_json
+        body = self._memo.get(q)
+        if body is None:
+            body = self._render(self.search(q))
+            with self._memo_lock:
+                if len(self._memo) >= self.MEMO_SIZE:
+                    self._memo.clear()
+                self._memo[q] = body
+        return body
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def _index_for(res, updated_label):
+    global _index
+    index = _index
+    if index is None or index.source is not res or index.updated != updated_label:
+        with _index_lock:
+            if _index is None or _index.source is not res or _index.updated != updated_label:
+                _index = RatesIndex(res, updated_label)
+            index = _index
+    return index
+
+
+def get_rates_index():
+    return _index_for(*_get_all_cbr_rates())
+
+
+def search_rates_json(query):
+    # (готовый JSON, версия курсов) для ETag
+    rates, version = _get_all_cbr_rates.cache_versioned()
+    return _index_for(*rates).search_json(query), version
+
+
+async def asearch_rates_json(query):
+    rates, version = await _aget_all_cbr_rates.cache_versioned()
+    return _index_for(*rates).search_json(query), version
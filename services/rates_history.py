@@ -0,0 +1,363 @@
+import bisect
+import fcntl
+import glob
+import logging
+import math
+import mmap
+import os
+import sys
+import threading
+import time
+from array import array
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
+
+from services import resilience
+from services.fanout import run_parallel
+
+log = logging.getLogger(__name__)
+
+# История курсов ЦБ в колоночных файлах:
+#   dates.i32   — номера дней (date.toordinal), по возрастанию
+#   <CODE>.f64  — курс за 1 единицу валюты на каждую дату, NaN — нет данных
+# Новый день дописывается в конец всех файлов; вставка в середину (догрузка
+# архива) пишет новое поколение gen-*/ и атомарно переключает ссылку current.
+# Чтение — через mmap, на запрос ничего не разбирается и не копируется целиком.
+
+HISTORY_DIR = os.getenv("RATES_HISTORY_DIR", ".cache/rates_history")
+ARCHIVE_URL = os.getenv(
+    "CBR_ARCHIVE_URL", "https://www.cbr-xml-daily.ru/archive/{day:%Y/%m/%d}/daily_json.js"
+)
+# сколько дней истории догружать из архива
+BACKFILL_DAYS = int(os.getenv("RATES_HISTORY_BACKFILL_DAYS", "1095"))
+BACKFILL_PARALLEL = 4
+BACKFILL_CHUNK = 60  # дней на одно поколение файлов при догрузке
+# планировщик догружает архив не чаще раза за столько секунд на хост
+BACKFILL_EVERY = 20 * 3600
+# 404 за последние дни — ещё не опубликованный архив или сбой, а не выходной:
+# запоминаем только дни старше этого запаса, свежие спрашиваем снова
+MISSING_AFTER_DAYS = 7
+
+# не больше стольких точек в ответе: шаг подбирается сам, если не задан
+MAX_POINTS = 1000
+STEPS = {"day": 1, "week": 7, "month": 30, "quarter": 91, "year": 365}
+
+MSK = timezone(timedelta(hours=3))
+NAN = float("nan")
+
+
+def values_from_payload(payload):
+    """(дата, {код: курс за 1 единицу}) из ответа daily_json.js."""
+    raw = payload.get("Date") or payload.get("Timestamp")
+    day = datetime.fromisoformat(raw.replace("Z", "+00:00")).date()
+    values = {}
+    for code, v in (payload.get("Valute") or {}).items():
+        value, nominal = (v or {}).get("Value"), (v or {}).get("Nominal") or 1
+        if value is not None:
+            values[code] = value / nominal
+    return day, values
+
+
+def _read_array(path, typecode):
+    out = array(typecode)
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            out.frombytes(f.read())
+    return out
+
+
+class _Mapped:
+    # mmap файла, который может расти: переоткрывается при изменении размера
+    def __init__(self, path, typecode):
+        self.path = path
+        self.typecode = typecode
+        self.size = -1
+        self.view = memoryview(b"").cast(typecode)
+        self._map = None
+
+    def get(self):
+        try:
+            size = os.stat(self.path).st_size
+        except FileNotFoundError:
+            size = 0
+        if size != self.size:
+            self.size = size
+            if size:
+                with open(self.path, "rb") as f:
+                    self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self.view = memoryview(self._map).cast(self.typecode)
+            else:
+                self._map, self.view = None, memoryview(b"").cast(self.typecode)
+        return self.view
+
+
+class RatesHistory:
+    def __init__(self, root=HISTORY_DIR):
+        self.root = root
+        self._gen = None
+        self._files = {}
+        self._read_lock = threading.Lock()
+
+    # -----------------------------
+    # Запись
+    # -----------------------------
+
+    @contextmanager
+    def _locked(self, name=".lock", blocking=True):
+        # запись из нескольких воркеров — под файловой блокировкой;
+        # blocking=False — None вместо ожидания, если блокировка занята
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, name), "w") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _current(self):
+        link = os.path.join(self.root, "current")
+        return os.path.realpath(link) if os.path.exists(link) else None
+
+    def _load(self, gen):
+        dates = _read_array(os.path.join(gen, "dates.i32"), "i") if gen else array("i")
+        columns = {}
+        if gen:
+            for path in glob.glob(os.path.join(gen, "*.f64")):
+                col = _read_array(path, "d")
+                columns[os.path.basename(path)[:-4]] = col[:len(dates)]
+        return dates, columns
+
+    def _write_generation(self, dates, columns):
+        gen = os.path.join(self.root, f"gen-{time.time_ns()}")
+        os.makedirs(gen)
+        for code, col in columns.items():
+            with open(os.path.join(gen, f"{code}.f64"), "wb") as f:
+                col.tofile(f)
+        with open(os.path.join(gen, "dates.i32"), "wb") as f:
+            dates.tofile(f)
+        tmp = os.path.join(self.root, "current.tmp")
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        os.symlink(os.path.basename(gen), tmp)
+        os.replace(tmp, os.path.join(self.root, "current"))
+        # старые поколения: читатели держат свои mmap, файлы можно удалять
+        for old in sorted(glob.glob(os.path.join(self.root, "gen-*")))[:-2]:
+            for path in glob.glob(os.path.join(old, "*")):
+                os.remove(path)
+            os.rmdir(old)
+
+    def record(self, day, values):
+        """Добавляет курсы за день; False — этот день уже записан."""
+        return self.merge({day: values}) > 0
+
+    def merge(self, rows):
+        """Вливает {дата: {код: курс}}; возвращает число новых дней."""
+        with self._locked():
+            gen = self._current()
+            # какие дни уже есть — по одному dates.i32; колонки читаем,
+            # только если придётся переписывать поколение
+            dates = self.dates(gen) if gen is not None else ()
+            have = set(dates)
+            new = sorted((d.toordinal(), v) for d, v in rows.items() if d.toordinal() not in have)
+            if not new:
+                return 0
+            if gen is not None and new[0][0] > (dates[-1] if len(dates) else -1):
+                self._append(gen, len(dates), self.codes(gen), new)
+            else:
+                self._rewrite(*self._load(gen), new)
+            return len(new)
+
+    def _append(self, gen, n, existing, new):
+        codes = set(existing).union(*(v for _, v in new))
+        for code in codes:
+            col = array("d", [v.get(code, NAN) for _, v in new])
+            path = os.path.join(gen, f"{code}.f64")
+            with open(path, "ab") as f:
+                if code not in existing:
+                    array("d", [NAN] * n).tofile(f)
+                else:
+                    f.truncate(n * 8)  # хвост от прерванной записи
+                col.tofile(f)
+        # даты последними: пока их нет, новые строки для читателей не видны
+        with open(os.path.join(gen, "dates.i32"), "ab") as f:
+            array("i", [d for d, _ in new]).tofile(f)
+
+    def _rewrite(self, dates, columns, new):
+        rows = {d: {code: col[i] for code, col in columns.items()} for i, d in enumerate(dates)}
+        rows.update(new)
+        order = sorted(rows)
+        codes = set(columns).union(*(v for _, v in new))
+        self._write_generation(
+            array("i", order),
+            {code: array("d", [rows[d].get(code, NAN) for d in order]) for code in codes},
+        )
+
+    # -----------------------------
+    # Чтение
+    # -----------------------------
+
+    def _mapped(self, name, typecode, gen=None):
+        # gen — поколение, уже выбранное запросом: все его файлы из одного поколения
+        gen = self._current() if gen is None else gen
+        with self._read_lock:
+            if gen != self._gen:
+                if gen is not None and self._gen is not None and os.path.basename(gen) < os.path.basename(self._gen):
+                    # запрос начался до переключения на новое поколение — без кэша
+                    return _Mapped(os.path.join(gen, name), typecode).get()
+                self._gen, self._files = gen, {}
+            if gen is None:
+                return memoryview(b"").cast(typecode)
+            m = self._files.get(name)
+            if m is None:
+                m = self._files[name] = _Mapped(os.path.join(gen, name), typecode)
+            return m.get()
+
+    def dates(self, gen=None):
+        return self._mapped("dates.i32", "i", gen)
+
+    def codes(self, gen=None):
+        gen = self._current() if gen is None else gen
+        if gen is None:
+            return []
+        return sorted(os.path.basename(p)[:-4] for p in glob.glob(os.path.join(gen, "*.f64")))
+
+    def series(self, code, start=None, end=None, step=None):
+        """[(дата ISO, курс)] за [start, end]; при step > 1 — последний курс каждого
+        интервала в step дней. None — нет такой валюты."""
+        if not (code.isascii() and code.isalnum()):
+            return None
+        gen = self._current()
+        if gen is None:
+            return None
+        dates = self.dates(gen)
+        col = self._mapped(f"{code}.f64", "d", gen)
+        if not len(col):
+            return None
+        n = min(len(dates), len(col))
+        lo = bisect.bisect_left(dates, start.toordinal(), 0, n) if start else 0
+        hi = bisect.bisect_right(dates, end.toordinal(), 0, n) if end else n
+        if hi <= lo:
+            return []
+        if step is None:
+            span = dates[hi - 1] - dates[lo] + 1
+            step = max(1, math.ceil(span / MAX_POINTS))
+
+        points = []
+        if step == 1:
+            for i in range(lo, hi):
+                v = col[i]
+                if v == v:  # не NaN
+                    points.append((date.fromordinal(dates[i]).isoformat(), v))
+            return points
+
+        # конец каждого интервала — двоичным поиском, без прохода по всем дням
+        base, last_day = dates[lo], dates[hi - 1]
+        i = lo
+        while i < hi:
+            bucket_end = base + ((dates[i] - base) // step + 1) * step - 1
+            j = bisect.bisect_right(dates, min(bucket_end, last_day), i, hi) - 1
+            k = j
+            while k >= i and col[k] != col[k]:
+                k -= 1
+            if k >= i:
+                points.append((date.fromordinal(dates[k]).isoformat(), col[k]))
+            i = j + 1
+        return points
+
+    # -----------------------------
+    # Догрузка из архива ЦБ
+    # -----------------------------
+
+    def _missing_days(self):
+        # дни без курса (выходные, праздники), на которые архив ответил 404
+        return set(_read_array(os.path.join(self.root, "missing.i32"), "i"))
+
+    def _remember_missing(self, days):
+        if not days:
+            return
+        with self._locked(), open(os.path.join(self.root, "missing.i32"), "ab") as f:
+            array("i", sorted(d.toordinal() for d in days)).tofile(f)
+
+    def backfill(self, start=None, end=None):
+        """Догружает отсутствующие дни из архива; возвращает число добавленных."""
+        today = datetime.now(MSK).date()
+        end = end or today
+        start = start or end - timedelta(days=BACKFILL_DAYS)
+        # 404 за последние MISSING_AFTER_DAYS дней не запоминаем и не учитываем
+        recent = today.toordinal() - MISSING_AFTER_DAYS
+        skip = set(self.dates()) | {d for d in self._missing_days() if d < recent}
+        todo = [
+            start + timedelta(days=i)
+            for i in range((end - start).days + 1)
+            if (start + timedelta(days=i)).toordinal() not in skip
+        ]
+        added = 0
+        for i in range(0, len(todo), BACKFILL_CHUNK):
+            chunk = todo[i:i + BACKFILL_CHUNK]
+            rows, missing = {}, []
+            for j in range(0, len(chunk), BACKFILL_PARALLEL):
+                batch = chunk[j:j + BACKFILL_PARALLEL]
+                results = run_parallel({day: (lambda day=day: _fetch_archive(day)) for day in batch}, timeout=30)
+                for day in batch:
+                    value, err = results[day]
+                    if err is not None:
+                        if getattr(getattr(err, "response", None), "status_code", None) == 404:
+                            if day.toordinal() < recent:
+                                missing.append(day)
+                            continue
+                        raise err
+                    rows[value[0]] = value[1]
+            added += self.merge(rows)
+            self._remember_missing(missing)
+        return added
+
+    def backfill_once(self, every=BACKFILL_EVERY):
+        """backfill для планировщика: один процесс на хост и не чаще раза в every
+        секунд (отметка — файл backfill.done), остальные воркеры пропускают."""
+        stamp = os.path.join(self.root, "backfill.done")
+        with self._locked(".backfill.lock", blocking=False) as got:
+            if not got:
+                return 0
+            try:
+                if time.time() - os.path.getmtime(stamp) < every:
+                    return 0
+            except FileNotFoundError:
+                pass
+            added = self.backfill()
+            with open(stamp, "w"):
+                pass
+            return added
+
+
+def _fetch_archive(day):
+    r = resilience.get("cbr-archive", ARCHIVE_URL.format(day=day), max_timeout=15)
+    return values_from_payload(r.json())
+
+
+_history = RatesHistory()
+
+
+def get_history():
+    return _history
+
+
+def record_payload(payload):
+    day, values = values_from_payload(payload)
+    return _history.record(day, values)
+
+
+def backfill():
+    return _history.backfill_once()
+
+
+if __name__ == "__main__":
+    # python -m services.rates_history backfill [YYYY-MM-DD [YYYY-MM-DD]]
+    if len(sys.argv) >= 2 and sys.argv[1] == "backfill":
+        args = [date.fromisoformat(a) for a in sys.argv[2:4]]
+        print(f"added {_history.backfill(*args)} days -> {HISTORY_DIR}")
+    else:
+        print("usage: python -m services.rates_history backfill [from [to]]")
@@ -0,0 +1,342 @@
+import asyncio
+import logging
+import threading
+import time
+
+from services import admission, http_client, metrics
+from services.cache import persistent_backend
+
+log = logging.getLogger(__name__)
+
+# Предохранитель (circuit breaker) на каждый внешний источник: после серии
+# ошибок или слишком медленных ответов запросы к нему на время прекращаются,
+# а кэш отдаёт последнее удачное значение. Число одновременных запросов
+# к источнику ограничено (services/admission.py).
+#
+# Задержки у запросов к одному источнику бывают очень разными (поиск монеты
+# и полный каталог CoinGecko, один прогноз и пачка в сотню точек), поэтому
+# предохранитель с адаптивным таймаутом заводится на пару (источник, endpoint):
+# "coingecko/list", "open-meteo/batch". Очередь к источнику при этом общая.
+
+FAILURE_THRESHOLD = 5      # ошибок подряд до размыкания
+SLOW_CALL_SECONDS = 5.0    # ответ дольше — считается сбоем
+COOLDOWN = 30.0            # пауза перед пробным запросом
+MAX_COOLDOWN = 300.0
+MIN_SAMPLES = 10           # до стольких замеров таймаут — максимальный
+
+
+class UpstreamUnavailable(Exception):
+    pass
+
+
+def is_upstream_failure(exc):
+    # 4xx (кроме 429) — ошибка запроса, а не недоступность источника
+    response = getattr(exc, "response", None)
+    status = getattr(response, "status_code", None)
+    if status is not None and 400 <= status < 500 and status != 429:
+        return False
+    return True
+
+
+class CircuitBreaker:
+    def __init__(self, name, *, max_timeout=15.0, min_timeout=2.0,
+                 failure_threshold=FAILURE_THRESHOLD, slow_call=SLOW_CALL_SECONDS):
+        self.name = name
+        self.max_timeout = max_timeout
+        self.min_timeout = min_timeout
+        self.failure_threshold = failure_threshold
+        self.slow_call = slow_call
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.cooldown = COOLDOWN
+        self.probing = False
+        # сглаженные среднее и отклонение задержки (как RTT в TCP)
+        self.samples = 0
+        self.avg = 0.0
+        self.dev = 0.0
+        self.calls = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def _timeout_locked(self):
+        if self.samples < MIN_SAMPLES:
+            return self.max_timeout
+        return min(max(self.avg + 4 * self.dev, self.min_timeout), self.max_timeout)
+
+    def timeout(self):
+        with self._lock:
+            return self._timeout_locked()
+
+    def before_call(self):
+        with self._lock:
+            self.calls += 1
+            if self.state == "closed":
+                return
+            if self.state == "open" and time.time() - self.opened_at >= self.cooldown:
+                self.state = "half_open"
+            if self.state == "half_open" and not self.probing:
+                # пропускаем один пробный запрос
+                self.probing = True
+                return
+            self.rejected += 1
+            raise UpstreamUnavailable(f"{self.name}: circuit open")
+
+    def _observe(self, latency):
+        if self.samples == 0:
+            self.avg, self.dev = latency, latency / 2
+        else:
+            self.dev += 0.25 * (abs(latency - self.avg) - self.dev)
+            self.avg += 0.125 * (latency - self.avg)
+        self.samples += 1
+
+    def on_success(self, latency):
+        with self._lock:
+            self._observe(latency)
+            if latency > self.slow_call:
+                self._fail_locked()
+                return
+            self.failures = 0
+            self.probing = False
+            if self.state != "closed":
+                self.state = "closed"
+                self.cooldown = COOLDOWN
+
+    def on_failure(self):
+        with self._lock:
+            self._fail_locked()
+
+    def _fail_locked(self):
+        self.failures += 1
+        if self.state == "half_open":
+            # проба не удалась — размыкаем снова и ждём дольше
+            self.cooldown = min(self.cooldown * 2, MAX_COOLDOWN)
+            self._open()
+        elif self.failures >= self.failure_threshold:
+            self._open()
+
+    def _open(self):
+        self.state = "open"
+        self.opened_at = time.time()
+        self.probing = False
+
+    def status(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "calls": self.calls,
+                "rejected": self.rejected,
+                "latency_avg": round(self.avg, 4),
+                "latency_dev": round(self.dev, 4),
+                "timeout": round(self._timeout_locked(), 3),
+            }
+
+
+BREAKERS = {}
+_registry_lock = threading.Lock()
+
+
+def get_breaker(name, **kwargs):
+    with _registry_lock:
+        b = BREAKERS.get(name)
+        if b is None:
+            b = BREAKERS[name] = CircuitBreaker(name, **kwargs)
+        return b
+
+
+def _before_call(breaker):
+    try:
+        breaker.before_call()
+    except UpstreamUnavailable:
+        metrics.inc("nw_upstream_errors_total", upstream=breaker.name, error="circuit_open")
+        raise
+
+
+def _on_error(breaker, exc, latency):
+    if is_upstream_failure(exc):
+        breaker.on_failure()
+    else:
+        breaker.on_success(latency)
+    metrics.observe_upstream(breaker.name, latency, error=type(exc).__name__)
+
+
+def _on_cancel(breaker, latency):
+    # отмена посреди запроса (дедлайн вызывающего, отключился клиент): считаем
+    # сбоем, иначе пробный запрос полуоткрытого предохранителя не завершится никогда
+    breaker.on_failure()
+    metrics.observe_upstream(breaker.name, latency, error="Cancelled")
+
+
+def _on_success(breaker, latency):
+    breaker.on_success(latency)
+    metrics.observe_upstream(breaker.name, latency)
+
+
+def breaker_for(upstream, endpoint, max_timeout):
+    # медленным считается ответ дольше половины бюджета endpoint, но не быстрее SLOW_CALL_SECONDS
+    name = f"{upstream}/{endpoint}" if endpoint else upstream
+    return get_breaker(name, max_timeout=max_timeout, slow_call=max(SLOW_CALL_SECONDS, max_timeout / 2))
+
+
+def call(upstream, fn, *, max_timeout=15.0, endpoint=None):
+    """Вызывает fn(timeout) через предохранитель (upstream, endpoint).
+
+    Таймаут подбирается по наблюдаемой задержке, но не больше max_timeout.
+    При разомкнутом предохранителе сразу бросает UpstreamUnavailable,
+    при переполненной очереди к источнику — admission.Overloaded.
+    """
+    breaker = breaker_for(upstream, endpoint, max_timeout)
+    slot = admission.gate(upstream)
+    slot.acquire(min(admission.QUEUE_SECONDS, max_timeout))
+    try:
+        _before_call(breaker)
+        started = time.monotonic()
+        try:
+            result = fn(min(breaker.timeout(), max_timeout))
+        except Exception as e:
+            _on_error(breaker, e, time.monotonic() - started)
+            raise
+        except BaseException:
+            _on_cancel(breaker, time.monotonic() - started)
+            raise
+        _on_success(breaker, time.monotonic() - started)
+        return result
+    finally:
+        slot.release()
+
+
+async def acall(upstream, afn, *, max_timeout=15.0, endpoint=None):
+    """Асинхронный call: afn(timeout) — корутинная функция, предохранитель общий."""
+    breaker = breaker_for(upstream, endpoint, max_timeout)
+    slot = admission.gate(upstream)
+    await slot.aacquire(min(admission.QUEUE_SECONDS, max_timeout))
+    try:
+        _before_call(breaker)
+        started = time.monotonic()
+        try:
+            result = await afn(min(breaker.timeout(), max_timeout))
+        except Exception as e:
+            _on_error(breaker, e, time.monotonic() - started)
+            raise
+        except BaseException:
+            _on_cancel(breaker, time.monotonic() - started)
+            raise
+        _on_success(breaker, time.monotonic() - started)
+        return result
+    finally:
+        slot.release()
+
+
+def get(upstream, url, *, params=None, headers=None, max_timeout=15.0, endpoint=None):
+    """GET через общую HTTP-сессию и предохранитель; HTTP-ошибки поднимаются как исключения."""
+    def _do(timeout):
+        r = http_client.get(url, params=params, headers=headers, timeout=timeout)
+        metrics.observe_upstream_size(upstream, len(r.content))
+        r.raise_for_status()
+        return r
+    return call(upstream, _do, max_timeout=max_timeout, endpoint=endpoint)
+
+
+async def aget(upstream, url, *, params=None, headers=None, max_timeout=15.0, endpoint=None):
+    """Асинхронный get через httpx (services.http_client.aget)."""
+    async def _do(timeout):
+        r = await http_client.aget(url, params=params, headers=headers, timeout=timeout)
+        metrics.observe_upstream_size(upstream, len(r.content))
+        r.raise_for_status()
+        return r
+    return await acall(upstream, _do, max_timeout=max_timeout, endpoint=endpoint)
+
+
+# Сколько хранить ETag/Last-Modified вместе с разобранным ответом
+VALIDATORS_TTL = 7 * 86400
+
+
+def _load_validators(key, url):
+    try:
+        saved = persistent_backend().get(key)
+    except Exception:
+        log.warning("validators read failed for %s", url, exc_info=True)
+        saved = None
+    saved = saved[0] if saved is not None else None
+
+    headers = {}
+    if saved:
+        if saved.get("etag"):
+            headers["If-None-Match"] = saved["etag"]
+        if saved.get("last_modified"):
+            headers["If-Modified-Since"] = saved["last_modified"]
+    return saved, headers
+
+
+def _store_validators(key, url, r, result):
+    etag, last_modified = r.headers.get("ETag"), r.headers.get("Last-Modified")
+    if etag or last_modified:
+        now = time.time()
+        try:
+            persistent_backend().set(
+                key,
+                {"etag": etag, "last_modified": last_modified, "result": result},
+                now,
+                now + VALIDATORS_TTL,
+            )
+        except Exception:
+            log.warning("validators write failed for %s", url, exc_info=True)
+
+
+def get_parsed(upstream, url, parse, *, params=None, max_timeout=15.0, endpoint=None):
+    """Условный GET: parse(response) вызывается только если данные изменились.
+
+    ETag/Last-Modified и результат parse хранятся по URL в постоянном
+    хранилище; на 304 возвращается сохранённый результат без повторного разбора.
+    """
+    key = f"validators:{url}:{params!r}"
+    saved, headers = _load_validators(key, url)
+
+    def _do(timeout):
+        r = http_client.get(url, params=params, headers=headers, timeout=timeout)
+        metrics.observe_upstream_size(upstream, len(r.content))
+        if r.status_code != 304:
+            r.raise_for_status()
+        return r
+
+    r = call(upstream, _do, max_timeout=max_timeout, endpoint=endpoint)
+    if r.status_code == 304 and saved:
+        return saved["result"]
+
+    result = parse(r)
+    _store_validators(key, url, r, result)
+    return result
+
+
+async def aget_parsed(upstream, url, parse, *, params=None, max_timeout=15.0, endpoint=None):
+    """Асинхронный get_parsed; валидаторы общие с синхронным путём.
+
+    Хранилище валидаторов и parse (feedparser, запись истории курсов) —
+    блокирующие, поэтому выполняются в потоке, а не в event loop.
+    """
+    key = f"validators:{url}:{params!r}"
+    saved, headers = await asyncio.to_thread(_load_validators, key, url)
+
+    async def _do(timeout):
+        r = await http_client.aget(url, params=params, headers=headers, timeout=timeout)
+        metrics.observe_upstream_size(upstream, len(r.content))
+        if r.status_code != 304:
+            r.raise_for_status()
+        return r
+
+    r = await acall(upstream, _do, max_timeout=max_timeout, endpoint=endpoint)
+    if r.status_code == 304 and saved:
+        return saved["result"]
+
+    def _finish():
+        result = parse(r)
+        _store_validators(key, url, r, result)
+        return result
+    return await asyncio.to_thread(_finish)
+
+
+def status():
+    with _registry_lock:
+        breakers = list(BREAKERS.values())
+    return {b.name: b.status() for b in breakers}
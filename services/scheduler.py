@@ -0,0 +1,141 @@
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from services.cache import persistent_backend
+from services.fanout import get_pool
+
+log = logging.getLogger(__name__)
+
+# Лок лидера: обновления запускает только один воркер. Без общего кэша лок
+# берётся в локальном SQLite (persistent_backend) — один лидер на хост
+LEADER_LOCK = "scheduler-leader"
+LEADER_TTL = 90
+
+MSK = timezone(timedelta(hours=3))
+
+
+def every(seconds):
+    return lambda now: seconds
+
+
+def cbr_cadence(now):
+    # ЦБ публикует курсы на завтра днём по Москве: в это окно проверяем часто,
+    # в остальное время — раз в 50 минут (кэш курсов живёт час)
+    hour = datetime.fromtimestamp(now, MSK).hour
+    return 300 if 11 <= hour < 16 else 3000
+
+
+class Job:
+    def __init__(self, name, fn, cadence, jitter=0.1, max_backoff=1800):
+        self.name = name
+        self.fn = fn
+        self.cadence = cadence
+        self.jitter = jitter
+        self.max_backoff = max_backoff
+        self.failures = 0
+        self.running = False
+        self.next_run = 0.0
+        self.last_ok = None
+        self.last_error = None
+
+    def _delay(self, now):
+        if self.failures:
+            # экспоненциальная задержка после ошибок, но не реже обычного расписания
+            base = min(15 * 2 ** (self.failures - 1), self.max_backoff, self.cadence(now))
+        else:
+            base = self.cadence(now)
+        return base * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def run(self):
+        try:
+            self.fn()
+        except Exception as e:
+            self.failures += 1
+            self.last_error = f"{type(e).__name__}: {e}"
+            log.warning("scheduler job %s failed (%d in a row)", self.name, self.failures, exc_info=True)
+        else:
+            self.failures = 0
+            self.last_ok = time.time()
+            self.last_error = None
+        finally:
+            self.next_run = time.time() + self._delay(time.time())
+            self.running = False
+
+    def status(self):
+        return {
+            "next_run": self.next_run,
+            "last_ok": self.last_ok,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
+
+
+class Scheduler:
+    def __init__(self, tick=1.0):
+        self.jobs = []
+        self.tick = tick
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock_checked = 0.0
+        self._leader = False
+
+    def add_job(self, name, fn, cadence, **kwargs):
+        job = Job(name, fn, cadence, **kwargs)
+        # первый прогрев — сразу после старта, с небольшим разбросом между воркерами
+        job.next_run = time.time() + random.uniform(0, 2)
+        self.jobs.append(job)
+        return job
+
+    def is_leader(self):
+        now = time.time()
+        if now - self._lock_checked >= LEADER_TTL / 3:
+            self._lock_checked = now
+            try:
+                self._leader = persistent_backend().acquire_lock(LEADER_LOCK, self.owner, LEADER_TTL)
+            except Exception:
+                log.warning("scheduler leader lock failed", exc_info=True)
+                self._leader = False
+        return self._leader
+
+    def _loop(self):
+        pool = get_pool("scheduler")
+        while not self._stop.is_set():
+            now = time.time()
+            if self.is_leader():
+                for job in self.jobs:
+                    if not job.running and job.next_run <= now:
+                        job.running = True
+                        pool.submit(job.run)
+            self._stop.wait(self.tick)
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        # после fork (gunicorn --preload) поток и лок нужно заводить заново
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._leader:
+            try:
+                persistent_backend().release_lock(LEADER_LOCK, self.owner)
+            except Exception:
+                pass
+
+    def status(self):
+        return {
+            "leader": self._leader,
+            "jobs": {job.name: job.status() for job in self.jobs},
+        }
+
+
+scheduler = Scheduler()
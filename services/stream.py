@@ -0,0 +1,289 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from services import forecast
+from services.news import latest_headlines
+from services.rates import latest_rates
+from services.weather import latest_region_weather
+
+log = logging.getLogger(__name__)
+
+# Server-Sent Events: /api/stream?topics=rates,region_weather,news.
+#
+# Один поток-наблюдатель на процесс раз в POLL_SECONDS сверяет версии кэшей
+# (локальных или общего хранилища — к источникам он не ходит) и при новой
+# версии публикует дельту в хаб. Хаб кодирует событие один раз и раздаёт
+# готовые байты всем подписчикам.
+#
+# У подписчика не очередь, а по одному ожидающему событию на тему: если
+# клиент не успевает читать, новое событие заменяет старое, а вместо дельты
+# он получит полный снимок. Память на медленного клиента — O(число тем).
+#
+# id события — "<эпоха процесса>-<номер>". При переподключении с
+# Last-Event-ID из этого же процесса досылаются пропущенные события из
+# кольцевого буфера, иначе — снимки тем.
+
+POLL_SECONDS = float(os.getenv("STREAM_POLL_SECONDS", "2"))
+HEARTBEAT_SECONDS = float(os.getenv("STREAM_HEARTBEAT_SECONDS", "15"))
+MAX_CLIENTS = int(os.getenv("STREAM_MAX_CLIENTS", "5000"))
+REPLAY_EVENTS = 256
+HEADLINES = 20
+
+RETRY_MS = 5000
+
+
+class TooManyClients(Exception):
+    pass
+
+
+class Event:
+    __slots__ = ("seq", "topic", "delta", "snapshot")
+
+    def __init__(self, seq, topic, delta, snapshot):
+        self.seq = seq
+        self.topic = topic
+        self.delta = delta        # готовые байты SSE
+        self.snapshot = snapshot
+
+
+def _encode(event_id, topic, kind, version, data):
+    payload = forecast.dumps({"topic": topic, "type": kind, "version": version, "data": data})
+    return b"id: %s\nevent: %s\ndata: %s\n\n" % (event_id.encode(), topic.encode(), payload)
+
+
+# -----------------------------
+# Темы: текущее состояние и дельта
+# -----------------------------
+
+def _rates():
+    value, version = latest_rates()
+    if value is None:
+        return None, None
+    rates, updated = value
+    return {"updated": updated, "rates": rates}, version
+
+
+def _rates_delta(old, new):
+    changed = {code: item for code, item in new["rates"].items() if old["rates"].get(code) != item}
+    return {"updated": new["updated"], "rates": changed}
+
+
+def _weather_delta(old, new):
+    before = {c["city"]: c for c in old}
+    return [c for c in new if before.get(c["city"]) != c]
+
+
+def _news_delta(old, new):
+    seen = {it.get("id") for it in old}
+    return [it for it in new if it.get("id") not in seen]
+
+
+TOPICS = {
+    # тема -> (текущее (данные, версия), дельта(старое, новое))
+    "rates": (_rates, _rates_delta),
+    "region_weather": (latest_region_weather, _weather_delta),
+    "news": (lambda: latest_headlines(HEADLINES), _news_delta),
+}
+
+
+# -----------------------------
+# Подписчики и хаб
+# -----------------------------
+
+class Subscriber:
+    def __init__(self, topics, wake):
+        self.topics = topics
+        self._wake = wake
+        self._pending = {}  # тема -> (событие, нужен ли снимок)
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def offer(self, event, snapshot=False):
+        with self._lock:
+            if event.topic in self._pending:
+                # клиент не забрал прошлое событие — отдадим снимок вместо цепочки дельт
+                self.coalesced += 1
+                snapshot = True
+            self._pending[event.topic] = (event, snapshot)
+        self._wake()
+
+    def drain(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        events = sorted(pending.values(), key=lambda p: p[0].seq)
+        return b"".join(e.snapshot if snap else e.delta for e, snap in events)
+
+
+class Hub:
+    def __init__(self):
+        self.epoch = f"{int(time.time()):x}{os.getpid():x}"
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._latest = {}  # тема -> последнее событие
+        self._recent = deque(maxlen=REPLAY_EVENTS)
+        self.published = 0
+
+    def publish(self, topic, version, delta, snapshot, first=False):
+        with self._lock:
+            self._seq += 1
+            event_id = f"{self.epoch}-{self._seq}"
+            snap = _encode(event_id, topic, "snapshot", version, snapshot)
+            event = Event(self._seq, topic, snap if first else _encode(event_id, topic, "delta", version, delta), snap)
+            self._latest[topic] = event
+            self._recent.append(event)
+            subscribers = [s for s in self._subscribers if topic in s.topics]
+            self.published += 1
+        for s in subscribers:
+            s.offer(event)
+
+    def subscribe(self, topics, wake, last_event_id=None):
+        sub = Subscriber(topics, wake)
+        with self._lock:
+            if len(self._subscribers) >= MAX_CLIENTS:
+                raise TooManyClients()
+            self._subscribers.add(sub)
+            replay = self._replay(topics, last_event_id)
+        for event, snapshot in replay:
+            sub.offer(event, snapshot)
+        return sub
+
+    def _replay(self, topics, last_event_id):
+        # что отправить сразу после подключения
+        epoch, _, seq = (last_event_id or "").rpartition("-")
+        if epoch == self.epoch and seq.isdigit():
+            last = int(seq)
+            oldest = self._recent[0].seq if self._recent else self._seq + 1
+            if last >= oldest - 1:
+                # все пропущенные события ещё в буфере: по одному на тему, с учётом склейки
+                missed = {}
+                for e in self._recent:
+                    if e.seq > last and e.topic in topics:
+                        missed[e.topic] = (e, e.topic in missed)
+                return list(missed.values())
+        return [(e, True) for t, e in self._latest.items() if t in topics]
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "clients": len(self._subscribers),
+                "published": self.published,
+                "coalesced": sum(s.coalesced for s in self._subscribers),
+                "topics": {t: e.seq for t, e in self._latest.items()},
+            }
+
+
+hub = Hub()
+
+
+# -----------------------------
+# Наблюдатель за кэшами
+# -----------------------------
+
+_state = {}  # тема -> (версия, данные)
+_watcher_pid = None
+_watcher_lock = threading.Lock()
+
+
+def poll_once():
+    for topic, (current, delta) in TOPICS.items():
+        try:
+            data, version = current()
+        except Exception:
+            log.warning("stream source %s failed", topic, exc_info=True)
+            continue
+        if data is None:
+            continue
+        prev = _state.get(topic)
+        if prev is not None and prev[0] == version:
+            continue
+        _state[topic] = (version, data)
+        if prev is None:
+            hub.publish(topic, version, data, data, first=True)
+            continue
+        changes = delta(prev[1], data)
+        if changes:
+            hub.publish(topic, version, changes, data)
+
+
+def _watch():
+    while True:
+        try:
+            poll_once()
+        except Exception:
+            log.exception("stream watcher failed")
+        time.sleep(POLL_SECONDS)
+
+
+def start_watcher():
+    # после fork поток нужно запустить заново — проверяем pid
+    global _watcher_pid, hub
+    if _watcher_pid == os.getpid():
+        return
+    with _watcher_lock:
+        if _watcher_pid == os.getpid():
+            return
+        if _watcher_pid is not None:
+            hub = Hub()
+            _state.clear()
+        _watcher_pid = os.getpid()
+        threading.Thread(target=_watch, name="stream-watcher", daemon=True).start()
+
+
+def parse_topics(raw):
+    topics = {t.strip() for t in (raw or "").split(",") if t.strip()} or set(TOPICS)
+    unknown = topics - set(TOPICS)
+    if unknown:
+        raise ValueError(f"unknown topics: {', '.join(sorted(unknown))}")
+    return frozenset(topics)
+
+
+# -----------------------------
+# Потоки ответа
+# -----------------------------
+
+async def aevents(topics, last_event_id=None):
+    """Асинхронный генератор SSE (asgi.py): тысячи соединений в одном event loop."""
+    start_watcher()
+    loop = asyncio.get_running_loop()
+    wakeup = asyncio.Event()
+    sub = hub.subscribe(topics, lambda: loop.call_soon_threadsafe(wakeup.set), last_event_id)
+    try:
+        yield b"retry: %d\n\n" % RETRY_MS
+        while True:
+            try:
+                await asyncio.wait_for(wakeup.wait(), HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield b": ping\n\n"
+                continue
+            wakeup.clear()
+            chunk = sub.drain()
+            if chunk:
+                yield chunk
+    finally:
+        hub.unsubscribe(sub)
+
+
+# Подписка происходит при первом шаге генератора; aopen_events делает его
+# сразу, чтобы TooManyClients случился до отправки заголовков ответа.
+
+async def aopen_events(topics, last_event_id=None):
+    chunks = aevents(topics, last_event_id)
+    return _aprepend(await chunks.__anext__(), chunks)
+
+
+async def _aprepend(first, rest):
+    try:
+        yield first
+        async for chunk in rest:
+            yield chunk
+    finally:
+        await rest.aclose()
@@ -0,0 +1,82 @@
+import logging
+import os
+import threading
+from functools import wraps
+
+from services.cache import dumps, loads
+
+log = logging.getLogger(__name__)
+
+# Снимок «тёплого» состояния: последние курсы, новости и погода по регионам.
+# Пишется после каждого фонового обновления, читается при старте (create_app),
+# так что новый воркер отвечает данными сразу, а не после похода к источникам.
+# Значения кладутся в кэш со своим временем записи: устаревшие отдаются по
+# stale-while-revalidate и обновляются в фоне. WARM_STATE_PATH="" — выключить.
+
+WARM_STATE_PATH = os.getenv("WARM_STATE_PATH", ".cache/warm_state.bin")
+
+_registered = {}  # имя кэша -> (кэш, on_load)
+_lock = threading.Lock()
+
+
+def register(fn, on_load=None):
+    """Включает кэш функции с @ttl_cache в снимок; on_load(value) — после загрузки."""
+    _registered[fn.cache.name] = (fn.cache, on_load)
+    return fn
+
+
+def save(path=None):
+    path = WARM_STATE_PATH if path is None else path
+    if not path:
+        return
+    state = {name: cache.entries() for name, (cache, _) in _registered.items()}
+    state = {name: entries for name, entries in state.items() if entries}
+    if not state:
+        return
+    blob = dumps(state)
+    with _lock:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(blob)
+        os.replace(tmp, path)
+
+
+def load(path=None):
+    """Число восстановленных записей; битый или чужой файл пропускается."""
+    path = WARM_STATE_PATH if path is None else path
+    if not path:
+        return 0
+    try:
+        with open(path, "rb") as f:
+            state = loads(f.read())
+    except FileNotFoundError:
+        return 0
+    except Exception:
+        log.warning("unreadable warm state %s", path, exc_info=True)
+        return 0
+
+    restored = 0
+    for name, entries in state.items():
+        cache, on_load = _registered.get(name, (None, None))
+        if cache is None:
+            continue
+        for key, value, ts in entries:
+            if cache.restore(key, value, ts):
+                restored += 1
+                if on_load is not None:
+                    on_load(value)
+    return restored
+
+
+def saving(job):
+    # фоновая задача, после которой снимок переписывается
+    @wraps(job)
+    def wrapper(*args, **kwargs):
+        result = job(*args, **kwargs)
+        try:
+            save()
+        except Exception:
+            log.warning("failed to save warm state", exc_info=True)
+        return result
+    return wrapper
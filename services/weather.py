@@ -1,27 +1,34 @@
-import requests
+import os
+
+from services import metrics, resilience, warmstate
+
+from services.cache import ttl_cache
+from services.fanout import run_parallel
 
 DEFAULT_CURRENT_FIELDS = (
     "temperature_2m,apparent_temperature,precipitation,weather_code,"
     "wind_speed_10m,wind_direction_10m"
 )
-
-CITIES = [
-    {"name": "Санкт-Петербург", "lat": 59.9386, "lon": 30.3141},
-    {"name": "Петрозаводск", "lat": 61.7850, "lon": 34.3469},
-    {"name": "Мурманск", "lat": 68.9730, "lon": 33.0925},
-    {"name": "Псков", "lat": 57.8136, "lon": 28.3496},
-    {"name": "Великий Новгород", "lat": 58.5215, "lon": 31.2755},
-    {"name": "Калининград", "lat": 54.7104, "lon": 20.4522},
-]
-
-def fetch_open_meteo(
-    lat,
-    lon,
-    *,
-    hourly=None,
-    daily=None,
-    forecast_days=None,
-):
+
+CITIES = [
+    {"name": "Санкт-Петербург", "lat": 59.9386, "lon": 30.3141},
+    {"name": "Петрозаводск", "lat": 61.7850, "lon": 34.3469},
+    {"name": "Мурманск", "lat": 68.9730, "lon": 33.0925},
+    {"name": "Псков", "lat": 57.8136, "lon": 28.3496},
+    {"name": "Великий Новгород", "lat": 58.5215, "lon": 31.2755},
+    {"name": "Калининград", "lat": 54.7104, "lon": 20.4522},
+]
+
+# Общий дедлайн на блок погоды по региону (секунды)
+REGION_DEADLINE = 8
+
+# адреса источников переопределяются окружением (например, для bench/)
+OPEN_METEO_FORECAST = os.getenv("OPEN_METEO_FORECAST_URL", "https://api.open-meteo.com/v1/forecast")
+
+# Сколько точек отправлять в одном запросе — держим URL в разумных пределах
+MAX_POINTS_PER_REQUEST = 100
+
+def _forecast_url(lat, lon, hourly=None, daily=None, forecast_days=None):
     params = [
         f"latitude={lat}",
         f"longitude={lon}",
@@ -34,69 +41,183 @@ def fetch_open_meteo(
         params.append("daily=" + ",".join(daily))
     if forecast_days:
         params.append(f"forecast_days={forecast_days}")
-    url = "https://api.open-meteo.com/v1/forecast?" + "&".join(params)
-    r = requests.get(url, timeout=15)
-    r.raise_for_status()
-    return r.json()
-
-def code_to_icon_desc(code: int):
-    # Мини-карта кодов Open-Meteo → эмодзи + краткое описание
-    # https://open-meteo.com/en/docs#weathervariables
-    groups = [
-        ((0,),               "☀️", "Ясно", "sunny"),
-        ((1, 2),             "🌤️", "Переменная облачность", "partly"),
-        ((3,),               "☁️", "Облачно", "cloudy"),
-        ((45, 48),           "🌫️", "Туман/изморозь", "foggy"),
-        ((51, 53, 55),       "🌦️", "Морось", "rainy"),
-        ((56, 57),           "🌧️", "Ледяная морось", "icy-rain"),
-        ((61, 63, 65),       "🌧️", "Дождь", "rainy"),
-        ((66, 67),           "🌧️", "Ледяной дождь", "icy-rain"),
-        ((71, 73, 75, 77),   "❄️", "Снег/снежные зёрна", "snowy"),
-        ((80, 81, 82),       "🌦️", "Ливни", "rainy"),
-        ((85, 86),           "🌨️", "Снегопад", "snowy"),
-        ((95, 96, 99),       "⛈️", "Гроза", "stormy"),
+    return OPEN_METEO_FORECAST + "?" + "&".join(params)
+
+@metrics.timed("fetch_open_meteo")
+def fetch_open_meteo(
+    lat,
+    lon,
+    *,
+    hourly=None,
+    daily=None,
+    forecast_days=None,
+):
+    url = _forecast_url(lat, lon, hourly, daily, forecast_days)
+    return resilience.get("open-meteo", url, max_timeout=15).json()
+
+@metrics.timed("fetch_open_meteo")
+async def afetch_open_meteo(
+    lat,
+    lon,
+    *,
+    hourly=None,
+    daily=None,
+    forecast_days=None,
+):
+    url = _forecast_url(lat, lon, hourly, daily, forecast_days)
+    return (await resilience.aget("open-meteo", url, max_timeout=15)).json()
+
+@metrics.timed("fetch_open_meteo_many")
+def _fetch_chunk(points, hourly, daily, forecast_days, timeout, upstream, endpoint):
+    url = _forecast_url(
+        ",".join(str(lat) for lat, _ in points),
+        ",".join(str(lon) for _, lon in points),
+        hourly, daily, forecast_days,
+    )
+    data = resilience.get(upstream, url, max_timeout=timeout, endpoint=endpoint).json()
+    # для одной точки Open-Meteo отвечает объектом, для нескольких — массивом
+    if isinstance(data, dict):
+        data = [data]
+    if len(data) != len(points):
+        raise ValueError(f"Open-Meteo returned {len(data)} forecasts for {len(points)} points")
+    return data
+
+def fetch_open_meteo_many(
+    points,
+    *,
+    hourly=None,
+    daily=None,
+    forecast_days=None,
+    timeout=15,
+    upstream="open-meteo",
+    endpoint="batch",
+):
+    """Прогноз для списка точек [(lat, lon), ...] минимальным числом запросов.
+
+    Возвращает список ответов в том же порядке, что и points. Большие списки
+    режутся на части по MAX_POINTS_PER_REQUEST, части запрашиваются параллельно.
+    timeout — общий дедлайн по часам, а не таймаут сокета: медленная отдача
+    или повторы после ошибок соединения его не продлевают.
+    upstream и endpoint — имена очереди и предохранителя (services/resilience.py).
+    """
+    points = [(lat, lon) for lat, lon in points]
+    chunks = [
+        points[i:i + MAX_POINTS_PER_REQUEST]
+        for i in range(0, len(points), MAX_POINTS_PER_REQUEST)
     ]
-    for codes, icon, desc, anim in groups:
-        if code in codes:
-            return icon, desc, anim
-    return "🌡️", "Погода", "calm"
-
-def get_region_weather():
-    out = []
-    for c in CITIES:
-        try:
-            data = fetch_open_meteo(
-                c["lat"],
-                c["lon"],
-                daily=[
-                    "temperature_2m_max",
-                    "temperature_2m_min",
-                    "precipitation_sum",
-                    "wind_speed_10m_max",
-                ],
-                forecast_days=1,
-            )
-            cur = data.get("current", {})
-            code = cur.get("weather_code")
-            icon, desc, anim = code_to_icon_desc(int(code) if code is not None else -1)
-            daily = data.get("daily", {})
-            out.append({
-                "city": c["name"],
-                "temp": cur.get("temperature_2m"),
-                "feels": cur.get("apparent_temperature"),
-                "precip": cur.get("precipitation"),
-                "wind": cur.get("wind_speed_10m"),
-                "wdir": cur.get("wind_direction_10m"),
-                "code": code,
-                "icon": icon,
-                "desc": desc,
-                "anim": anim,   # класс анимации для иконки
-                "time": cur.get("time"),
-                "temp_max": (daily.get("temperature_2m_max") or [None])[0],
-                "temp_min": (daily.get("temperature_2m_min") or [None])[0],
-                "precip_sum": (daily.get("precipitation_sum") or [None])[0],
-                "wind_max": (daily.get("wind_speed_10m_max") or [None])[0],
-            })
-        except Exception as e:
-            out.append({"city": c["name"], "error": str(e)})
-    return out
+    # даже одна часть идёт через run_parallel — ради дедлайна
+    results = run_parallel(
+        {
+            idx: (lambda chunk=chunk: _fetch_chunk(chunk, hourly, daily, forecast_days, timeout, upstream, endpoint))
+            for idx, chunk in enumerate(chunks)
+        },
+        timeout=timeout,
+    )
+    out = []
+    for idx in range(len(chunks)):
+        data, err = results[idx]
+        if err is not None:
+            raise err
+        out.extend(data)
+    return out
+
+# Мини-карта кодов Open-Meteo → эмодзи + краткое описание
+# https://open-meteo.com/en/docs#weathervariables
+WEATHER_CODE_GROUPS = [
+    ((0,),               "☀️", "Ясно", "sunny"),
+    ((1, 2),             "🌤️", "Переменная облачность", "partly"),
+    ((3,),               "☁️", "Облачно", "cloudy"),
+    ((45, 48),           "🌫️", "Туман/изморозь", "foggy"),
+    ((51, 53, 55),       "🌦️", "Морось", "rainy"),
+    ((56, 57),           "🌧️", "Ледяная морось", "icy-rain"),
+    ((61, 63, 65),       "🌧️", "Дождь", "rainy"),
+    ((66, 67),           "🌧️", "Ледяной дождь", "icy-rain"),
+    ((71, 73, 75, 77),   "❄️", "Снег/снежные зёрна", "snowy"),
+    ((80, 81, 82),       "🌦️", "Ливни", "rainy"),
+    ((85, 86),           "🌨️", "Снегопад", "snowy"),
+    ((95, 96, 99),       "⛈️", "Гроза", "stormy"),
+]
+
+CODE_DEFAULT = ("🌡️", "Погода", "calm")
+
+# код → (иконка, описание, анимация): поиск за O(1) вместо перебора групп
+CODE_TABLE = {
+    code: (icon, desc, anim)
+    for codes, icon, desc, anim in WEATHER_CODE_GROUPS
+    for code in codes
+}
+
+def code_to_icon_desc(code: int):
+    return CODE_TABLE.get(code, CODE_DEFAULT)
+
+# прогноз обновляется раз в час; планировщик обновляет блок раньше истечения
+@warmstate.register
+@ttl_cache(3600, maxsize=4)
+def _fetch_region_batch():
+    # один запрос на все города региона
+    return fetch_open_meteo_many(
+        [(c["lat"], c["lon"]) for c in CITIES],
+        daily=[
+            "temperature_2m_max",
+            "temperature_2m_min",
+            "precipitation_sum",
+            "wind_speed_10m_max",
+        ],
+        forecast_days=1,
+        timeout=REGION_DEADLINE,
+    )
+
+def _city_summary(name, data):
+    cur = data.get("current", {})
+    code = cur.get("weather_code")
+    icon, desc, anim = code_to_icon_desc(int(code) if code is not None else -1)
+    daily = data.get("daily", {})
+    return {
+        "city": name,
+        "temp": cur.get("temperature_2m"),
+        "feels": cur.get("apparent_temperature"),
+        "precip": cur.get("precipitation"),
+        "wind": cur.get("wind_speed_10m"),
+        "wdir": cur.get("wind_direction_10m"),
+        "code": code,
+        "icon": icon,
+        "desc": desc,
+        "anim": anim,   # класс анимации для иконки
+        "time": cur.get("time"),
+        "temp_max": (daily.get("temperature_2m_max") or [None])[0],
+        "temp_min": (daily.get("temperature_2m_min") or [None])[0],
+        "precip_sum": (daily.get("precipitation_sum") or [None])[0],
+        "wind_max": (daily.get("wind_speed_10m_max") or [None])[0],
+    }
+
+def refresh_region_weather():
+    _fetch_region_batch.cache_refresh()
+
+def get_region_weather_versioned():
+    # (сводка, версия); при ошибке версии нет — такую страницу не кэшируем
+    try:
+        batch, version = _fetch_region_batch.cache_versioned()
+    except Exception as e:
+        return [{"city": c["name"], "error": str(e)} for c in CITIES], None
+    return _region_summaries(batch), version
+
+def latest_region_weather():
+    # (сводка, версия) из кэша без запроса к источнику — для services/stream.py
+    batch, version = _fetch_region_batch.cache_latest()
+    return (_region_summaries(batch), version) if batch is not None else (None, None)
+
+def get_region_weather():
+    try:
+        batch = _fetch_region_batch()
+    except Exception as e:
+        return [{"city": c["name"], "error": str(e)} for c in CITIES]
+    return _region_summaries(batch)
+
+def _region_summaries(batch):
+    out = []
+    for c, data in zip(CITIES, batch):
+        try:
+            out.append(_city_summary(c["name"], data))
+        except Exception as e:
+            out.append({"city": c["name"], "error": str(e)})
+    return out
@@ -0,0 +1,70 @@
+import threading
+import time
+
+from services.cache import RedisBackend
+
+# Заменитель клиента redis-py для тестов RedisBackend: get/set(px=, nx=)/delete
+# и eval двух Lua-скриптов бэкенда, выполненных на Python. Срок жизни ключей
+# (px) соблюдается; значения, как и у Redis, хранятся байтами.
+
+
+class FakeRedis:
+    def __init__(self):
+        self._data = {}  # ключ -> (значение, истекает в момент или None)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def _live(self, key):
+        item = self._data.get(key)
+        if item is not None and item[1] is not None and time.time() >= item[1]:
+            del self._data[key]
+            return None
+        return item
+
+    @staticmethod
+    def _bytes(value):
+        if isinstance(value, bytes):
+            return value
+        return str(value).encode()
+
+    def get(self, key):
+        with self._lock:
+            self.calls += 1
+            item = self._live(key)
+            return item[0] if item is not None else None
+
+    def set(self, key, value, px=None, nx=False):
+        with self._lock:
+            self.calls += 1
+            if nx and self._live(key) is not None:
+                return None
+            self._data[key] = (self._bytes(value), time.time() + px / 1000 if px else None)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            return 1 if self._data.pop(key, None) is not None else 0
+
+    def eval(self, script, numkeys, *args):
+        keys, argv = args[:numkeys], args[numkeys:]
+        if script == RedisBackend._RELEASE:
+            with self._lock:
+                item = self._live(keys[0])
+                if item is not None and item[0] == self._bytes(argv[0]):
+                    del self._data[keys[0]]
+                    return 1
+                return 0
+        if script == RedisBackend._TAKE:
+            return self._take(keys[0], float(argv[0]), float(argv[1]), float(argv[2]))
+        raise NotImplementedError("unknown script")
+
+    def _take(self, key, rate, burst, now):
+        with self._lock:
+            item = self._live(key)
+            tokens, ts = item[0] if item is not None else (burst, now)
+            tokens = min(burst, tokens + max(0.0, now - ts) * rate)
+            allowed = 0
+            if tokens >= 1:
+                tokens, allowed = tokens - 1, 1
+            self._data[key] = ((tokens, now), time.time() + burst / rate + 1)
+            return [allowed, repr(tokens)]
@@ -0,0 +1,61 @@
+import threading
+import time
+
+import pytest
+
+from services import admission
+from services.admission import Overloaded, UpstreamGate
+
+
+def test_client_ip_ignores_forwarded_for_without_trusted_proxies(monkeypatch):
+    monkeypatch.setattr(admission, "TRUSTED_PROXIES", 0)
+    assert admission.client_ip("10.0.0.1", "1.2.3.4") == "10.0.0.1"
+
+
+def test_client_ip_takes_hop_added_by_trusted_proxy(monkeypatch):
+    monkeypatch.setattr(admission, "TRUSTED_PROXIES", 1)
+    # левее — что угодно от клиента, правее — адрес, который дописал прокси
+    assert admission.client_ip("10.0.0.1", "6.6.6.6, 1.2.3.4") == "1.2.3.4"
+    assert admission.client_ip(None) == "-"
+
+
+def test_memory_buckets_refuse_after_burst():
+    buckets = admission._MemoryBuckets(maxsize=2)
+    assert [buckets.take_token("r|a", 1, 2)[0] for _ in range(3)] == [True, True, False]
+    allowed, retry_after = buckets.take_token("r|a", 1, 2)
+    assert not allowed and 0 < retry_after <= 1
+    buckets.take_token("r|b", 1, 2)
+    buckets.take_token("r|c", 1, 2)
+    assert len(buckets._data) == 2  # самая давняя корзина вытеснена
+
+
+def test_gate_times_out_when_full():
+    gate = UpstreamGate("t", 1)
+    gate.acquire(1)
+    with pytest.raises(Overloaded):
+        gate.acquire(0.05)
+    assert gate.status() == {"limit": 1, "active": 1, "waiting": 0, "shed": 1}
+    gate.release()
+    gate.acquire(0.05)
+
+
+def test_gate_hands_slot_to_waiter():
+    gate = UpstreamGate("t", 1)
+    gate.acquire(1)
+    got = []
+    t = threading.Thread(target=lambda: got.append(gate.acquire(2)))
+    t.start()
+    while not gate.status()["waiting"]:
+        time.sleep(0.001)
+    gate.release()
+    t.join()
+    assert got == [None]
+    assert gate.status()["active"] == 1
+
+
+def test_gate_sheds_when_queue_full(monkeypatch):
+    monkeypatch.setattr(admission, "MAX_QUEUE", 0)
+    gate = UpstreamGate("t", 1)
+    gate.acquire(1)
+    with pytest.raises(Overloaded, match="queue_full"):
+        gate.acquire(1)
@@ -0,0 +1,207 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from services import cache
+from services.cache import RedisBackend, SQLiteBackend, TTLCache
+from tests.fake_redis import FakeRedis
+
+
+@pytest.fixture(params=["sqlite", "redis"])
+def backend(request, tmp_path):
+    if request.param == "sqlite":
+        b = SQLiteBackend(str(tmp_path / "cache.sqlite3"))
+    else:
+        b = RedisBackend(FakeRedis())
+    previous = cache.get_backend()
+    cache.set_backend(b)
+    yield b
+    cache.set_backend(previous)
+
+
+@pytest.fixture
+def no_backend():
+    previous = cache.get_backend()
+    cache.set_backend(None)
+    yield
+    cache.set_backend(previous)
+
+
+def _expire(c, key, age):
+    # запись с истёкшим age секунд назад сроком
+    now = time.time()
+    with c._lock:
+        value = c._data[key][0]
+        c._data[key] = (value, now - age - 1, now - age)
+
+
+# -----------------------------
+# Память процесса
+# -----------------------------
+
+def test_single_flight_threads(no_backend):
+    c = TTLCache(60, name="t.single_flight")
+    calls = []
+    started = threading.Event()
+
+    def compute():
+        calls.append(1)
+        started.set()
+        time.sleep(0.1)
+        return "value"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(c.get_or_compute("k", compute))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert calls == [1]
+    assert results == ["value"] * 8
+
+
+def test_single_flight_async(no_backend):
+    c = TTLCache(60, name="t.single_flight_async")
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "value"
+
+    async def main():
+        return await asyncio.gather(*(c.aget_or_compute("k", compute) for _ in range(8)))
+
+    assert asyncio.run(main()) == ["value"] * 8
+    assert calls == [1]
+
+
+def test_single_flight_error_reaches_waiters(no_backend):
+    c = TTLCache(60, name="t.single_flight_error")
+    release = threading.Event()
+
+    def compute():
+        release.wait(1)
+        raise RuntimeError("down")
+
+    errors = []
+
+    def call():
+        try:
+            c.get_or_compute("k", compute)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=call) for _ in range(4)]
+    for t in threads:
+        t.start()
+    release.set()
+    for t in threads:
+        t.join()
+    assert errors == ["down"] * 4
+    assert c._inflight == {}
+
+
+def test_lru_eviction(no_backend):
+    c = TTLCache(60, maxsize=2, name="t.lru")
+    c.get_or_compute("a", lambda: 1)
+    c.get_or_compute("b", lambda: 2)
+    c.get_or_compute("a", lambda: 0)  # a — самый свежий по обращению
+    c.get_or_compute("c", lambda: 3)
+    assert c.keys() == ["a", "c"]
+    assert c.stats()["evictions"] == 1
+    assert c.get_or_compute("b", lambda: 20) == 20
+
+
+def test_stale_within_window_refreshes_in_background(no_backend):
+    c = TTLCache(60, name="t.swr", max_stale=60)
+    c.get_or_compute("k", lambda: "old")
+    _expire(c, "k", 5)
+    assert c.get_or_compute("k", lambda: "new") == "old"
+    deadline = time.time() + 2
+    while c.peek("k") != "new" and time.time() < deadline:
+        time.sleep(0.01)
+    assert c.peek("k") == "new"
+
+
+def test_stale_beyond_window_refreshes_synchronously(no_backend):
+    c = TTLCache(60, name="t.max_stale", max_stale=60)
+    c.get_or_compute("k", lambda: "old")
+    _expire(c, "k", 600)
+    assert c.get_or_compute("k", lambda: "new") == "new"
+
+    _expire(c, "k", 600)
+
+    def down():
+        raise RuntimeError("down")
+
+    # источник недоступен — лучше старое значение, чем ошибка
+    assert c.get_or_compute("k", down) == "new"
+    assert c.stats()["refresh_errors"] == 1
+
+
+# -----------------------------
+# Общее хранилище
+# -----------------------------
+
+def test_backend_roundtrip(backend):
+    now = time.time()
+    backend.set("k", {"a": [1, 2]}, now, now + 60)
+    assert backend.get("k") == ({"a": [1, 2]}, now, now + 60)
+    assert backend.get("missing") is None
+
+
+def test_backend_lock_ownership(backend):
+    assert backend.acquire_lock("leader", "w1", 30)
+    assert not backend.acquire_lock("leader", "w2", 30)
+    assert backend.acquire_lock("leader", "w1", 30)  # продление своего
+    backend.release_lock("leader", "w2")  # чужой лок не снимается
+    assert not backend.acquire_lock("leader", "w2", 30)
+    backend.release_lock("leader", "w1")
+    assert backend.acquire_lock("leader", "w2", 30)
+
+
+def test_backend_token_bucket(backend):
+    taken = [backend.take_token("route|ip", 1, 3)[0] for _ in range(4)]
+    assert taken == [True, True, True, False]
+    allowed, retry_after = backend.take_token("route|ip", 1, 3)
+    assert not allowed and 0 < retry_after <= 1
+
+
+def test_shared_hit_skips_compute(backend):
+    leader = TTLCache(60, name="t.shared")
+    follower = TTLCache(60, name="t.shared")
+    leader.get_or_compute("k", lambda: "from leader")
+
+    def compute():
+        raise AssertionError("follower must not call upstream")
+
+    assert follower.get_or_compute("k", compute) == "from leader"
+    assert follower.stats()["shared_hits"] == 1
+
+
+def test_expired_local_entry_uses_newer_shared(backend):
+    leader = TTLCache(60, name="t.shared_expired")
+    follower = TTLCache(60, name="t.shared_expired")
+    follower.get_or_compute("k", lambda: "old")
+    _expire(follower, "k", 5)
+    leader.put("k", "fresh")
+
+    def compute():
+        raise AssertionError("follower must not call upstream")
+
+    assert follower.get_or_compute("k", compute) == "fresh"
+    assert follower.stats()["shared_hits"] == 1
+
+
+def test_async_shared_hit(backend):
+    leader = TTLCache(60, name="t.shared_async")
+    follower = TTLCache(60, name="t.shared_async")
+    leader.put("k", "from leader")
+
+    async def compute():
+        raise AssertionError("follower must not call upstream")
+
+    assert asyncio.run(follower.aget_or_compute("k", compute)) == "from leader"
@@ -0,0 +1,87 @@
+import pytest
+
+from services import geocoder
+from services.geocoder import Geocoder, build_index
+
+
+def _place(gid, name, ascii_name, alternates, lat, lon, cc, admin1, population):
+    cols = [gid, name, ascii_name, ",".join(alternates), lat, lon, "P", "PPLA", cc, "", admin1,
+            "", "", "", str(population)]
+    return "\t".join(cols) + "\n"
+
+
+@pytest.fixture
+def index(tmp_path):
+    data = tmp_path / "geonames"
+    data.mkdir()
+    (data / "cities.txt").write_text(
+        _place("524901", "Moscow", "Moscow", ["Moskva", "Москва"], "55.75", "37.62", "RU", "48", 10381222)
+        + _place("498817", "Saint Petersburg", "Saint Petersburg", ["Питер", "Санкт-Петербург"],
+                 "59.94", "30.31", "RU", "66", 5351935)
+        + _place("1850147", "Tokyo", "Tokyo", ["Токио"], "35.69", "139.69", "JP", "40", 8336599)
+        + _place("9999999", "Smallville", "Smallville", [], "40.0", "-90.0", "US", "IL", 45001),
+        encoding="utf-8",
+    )
+    country = ["RU", "RUS", "643", "RS", "Russia", "Moscow", "17100000", "140702000", "EU", ".ru",
+               "RUB", "Ruble", "7", "", "", "ru", "2017370", "", ""]
+    japan = ["JP", "JPN", "392", "JA", "Japan", "Tokyo", "377835", "127288000", "AS", ".jp",
+             "JPY", "Yen", "81", "", "", "ja", "1861060", "", ""]
+    (data / "countryInfo.txt").write_text(
+        "#ISO\tISO3\n" + "\t".join(country) + "\n" + "\t".join(japan) + "\n", encoding="utf-8")
+    (data / "admin1CodesASCII.txt").write_text(
+        "RU.48\tMoscow\tMoscow\t524894\n"
+        "RU.66\tSt.-Petersburg\tSt.-Petersburg\t536203\n"
+        "JP.40\tTokyo\tTokyo\t1850144\n",
+        encoding="utf-8",
+    )
+    (data / "alternateNamesV2.txt").write_text(
+        "1\t524901\tru\tМосква\t1\t\t\t\t\t\n"
+        "2\t498817\tru\tПитер\t\t\t1\t\t\t\n"
+        "3\t498817\tru\tЛенинград\t\t\t\t1\t\t\n"
+        "4\t498817\tru\tСанкт-Петербург\t1\t\t\t\t\t\n"
+        "5\t2017370\tru\tРоссийская Федерация\t1\t\t\t\t\t\n"
+        "6\t2017370\tru\tРоссия\t\t1\t\t\t\t\n"
+        "7\t524894\tru\tМосква\t1\t\t\t\t\t\n"
+        "8\t536203\tru\tСанкт-Петербург\t1\t\t\t\t\t\n"
+        "9\t1850147\tru\tТокио\t1\t\t\t\t\t\n"
+        "10\t1861060\tru\tЯпония\t1\t\t\t\t\t\n"
+        "11\t1850147\ten\tTokyo\t1\t\t\t\t\t\n",
+        encoding="utf-8",
+    )
+    out = tmp_path / "index"
+    build_index(str(data / "cities.txt"), str(out))
+    return Geocoder(geocoder._current(str(out)))
+
+
+def test_alias_returns_canonical_russian_name(index):
+    [spb] = index.search("питер", count=1)
+    assert spb["name"] == "Санкт-Петербург"
+    assert spb["admin1"] == "Санкт-Петербург"
+    assert spb["country"] == "Россия"
+
+
+def test_latin_query_returns_russian_name(index):
+    [moscow] = index.search("moscow", count=1)
+    assert moscow == {"name": "Москва", "country": "Россия", "admin1": "Москва", "lat": 55.75, "lon": 37.62}
+
+
+def test_country_name_from_alternates(index):
+    assert index.search("Токио", count=1)[0]["country"] == "Япония"
+
+
+def test_english_names_for_other_languages(index):
+    [spb] = index.search("питер", count=1, lang="en")
+    assert (spb["name"], spb["country"], spb["admin1"]) == ("Saint Petersburg", "Russia", "St.-Petersburg")
+
+
+def test_no_russian_name_falls_back_to_remote(index):
+    # пусто — geo.search_cities уйдёт в удалённый API
+    assert index.search("smallville", lang="ru") == []
+    assert index.search("smallville", lang="en")[0]["name"] == "Smallville"
+
+
+def test_old_index_format_is_rebuilt(tmp_path, index):
+    out = tmp_path / "index"
+    (out / "current" / "format").write_text("1\n")
+    assert geocoder._current(str(out)) is None
+    assert geocoder._stale(str(tmp_path / "geonames" / "cities.txt"), str(out))
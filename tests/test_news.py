@@ -0,0 +1,35 @@
+from services import news
+
+
+def _item(id_, link, ts):
+    return {"id": id_, "link": link, "ts": ts, "title": f"{id_ or link}@{ts}"}
+
+
+def test_merge_orders_newest_first():
+    current = (_item("a", "/a", 10), _item("b", "/b", 5))
+    merged = news._merge(current, [_item("c", "/c", 7)])
+    assert [it["id"] for it in merged] == ["a", "c", "b"]
+
+
+def test_merge_dedupes_by_id_and_link():
+    current = (_item("a", "/a", 10),)
+    incoming = [
+        _item("a", "/a?utm=1", 11),  # тот же guid, другая ссылка
+        _item(None, "/b", 9),
+        _item("b", "/b", 8),  # та же ссылка, что у записи без guid
+    ]
+    merged = news._merge(current, incoming)
+    assert [(it["id"], it["ts"]) for it in merged] == [("a", 11), (None, 9)]
+
+
+def test_merge_keeps_incoming_on_equal_time():
+    current = (_item("a", "/a", 10),)
+    merged = news._merge(current, [dict(_item("a", "/a", 10), title="new")])
+    assert [it["title"] for it in merged] == ["new"]
+
+
+def test_merge_evicts_oldest_beyond_limit(monkeypatch):
+    monkeypatch.setattr(news, "MAX_STORE", 3)
+    current = tuple(_item(str(i), f"/{i}", i) for i in range(3))
+    merged = news._merge(current, [_item("9", "/9", 9), _item("4", "/4", 4)])
+    assert [it["id"] for it in merged] == ["9", "4", "2"]
@@ -0,0 +1,79 @@
+import os
+from datetime import date, datetime, timedelta
+
+import pytest
+import requests
+
+from services import rates_history
+from services.rates_history import MSK, RatesHistory
+
+
+@pytest.fixture
+def history(tmp_path):
+    return RatesHistory(str(tmp_path / "history"))
+
+
+def _gen(h):
+    return os.path.basename(h._current())
+
+
+def test_merge_appends_new_days_in_place(history):
+    history.merge({date(2024, 1, 1): {"USD": 90.0}})
+    gen = _gen(history)
+    assert history.merge({date(2024, 1, 3): {"USD": 92.0}, date(2024, 1, 2): {"USD": 91.0, "EUR": 99.0}}) == 2
+    assert _gen(history) == gen
+    assert history.series("USD") == [("2024-01-01", 90.0), ("2024-01-02", 91.0), ("2024-01-03", 92.0)]
+    # новая валюта дописана с NaN на прошлые дни
+    assert history.series("EUR") == [("2024-01-02", 99.0)]
+
+
+def test_merge_out_of_order_rewrites_generation(history):
+    history.merge({date(2024, 1, 1): {"USD": 90.0}, date(2024, 1, 3): {"USD": 92.0}})
+    gen = _gen(history)
+    assert history.merge({date(2024, 1, 2): {"USD": 91.0}}) == 1
+    assert _gen(history) != gen
+    assert [d for d, _ in history.series("USD")] == ["2024-01-01", "2024-01-02", "2024-01-03"]
+
+
+def test_merge_skips_known_days(history):
+    history.merge({date(2024, 1, 1): {"USD": 90.0}})
+    assert history.merge({date(2024, 1, 1): {"USD": 1.0}}) == 0
+    assert not history.record(date(2024, 1, 1), {"USD": 1.0})
+    assert history.series("USD") == [("2024-01-01", 90.0)]
+
+
+def test_series_step_takes_last_rate_of_each_bucket(history):
+    start = date(2024, 1, 1)
+    history.merge({start + timedelta(days=i): {"USD": float(i)} for i in range(10) if i != 6})
+    # интервалы по 7 дней от первого дня: [0..6] без 6-го -> 5, [7..9] -> 9
+    assert history.series("USD", step=7) == [("2024-01-06", 5.0), ("2024-01-10", 9.0)]
+    assert history.series("USD", start=date(2024, 1, 3), end=date(2024, 1, 5), step=2) == [
+        ("2024-01-04", 3.0), ("2024-01-05", 4.0)]
+    assert history.series("XXX") is None
+
+
+def _not_found(day):
+    response = requests.Response()
+    response.status_code = 404
+    raise requests.HTTPError("404", response=response)
+
+
+def test_backfill_remembers_only_old_missing_days(history, monkeypatch):
+    monkeypatch.setattr(rates_history, "_fetch_archive", _not_found)
+    today = datetime.now(MSK).date()
+    old = today - timedelta(days=30)
+    recent = today - timedelta(days=2)
+    history.backfill(old, old)
+    history.backfill(recent, recent)
+    assert history._missing_days() == {old.toordinal()}
+
+    fetched = []
+
+    def fetch(day):
+        fetched.append(day)
+        return day, {"USD": 90.0}
+
+    monkeypatch.setattr(rates_history, "_fetch_archive", fetch)
+    # свежий день спрашиваем снова, запомненный старый — нет
+    assert history.backfill(old, recent) == len(fetched)
+    assert old not in fetched and recent in fetched
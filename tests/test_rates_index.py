@@ -0,0 +1,54 @@
+import json
+
+from services.rates import RatesIndex
+
+RATES = {
+    "USD": {"name": "Доллар США", "value": 90.0},
+    "AUD": {"name": "Австралийский доллар", "value": 60.0},
+    "EUR": {"name": "Евро", "value": 100.0},
+    "HUF": {"name": "Венгерских форинтов", "value": 0.25},
+}
+
+
+def _index():
+    return RatesIndex(RATES, "2024-01-01")
+
+
+def test_exact_code_first_then_prefix_then_substring():
+    index = _index()
+    assert index.search("usd") == ["USD"]
+    # начало кода, затем подстрока кода — по алфавиту
+    assert index.search("u") == ["USD", "AUD", "EUR", "HUF"]
+
+
+def test_name_word_prefix_ranked_before_substring():
+    index = _index()
+    assert index.search("дол") == ["AUD", "USD"]
+    assert index.search("ЕВРО") == ["EUR"]
+    assert index.search("ор") == ["HUF"]
+    assert index.search("йен") == []
+
+
+def test_empty_query_and_limit():
+    index = _index()
+    assert index.search("") == ["AUD", "EUR", "HUF", "USD"]
+    assert index.search("u", limit=2) == ["USD", "AUD"]
+
+
+def test_search_json_renders_items_and_memoizes():
+    index = _index()
+    body = index.search_json(" USD ")
+    payload = json.loads(body)
+    assert payload["updated"] == "2024-01-01"
+    assert [item["code"] for item in payload["items"]] == ["USD"]
+    assert payload["items"][0]["value"] == 90.0
+    assert index.search_json("usd") is body  # тот же нормализованный запрос — из памяти
+    assert index.search_json("") is index.empty_json
+
+
+def test_memo_is_bounded():
+    index = _index()
+    index.MEMO_SIZE = 2
+    for q in ("usd", "eur", "aud"):
+        index.search_json(q)
+    assert len(index._memo) <= 2
@@ -9,7 +9,7 @@ else:
         content = f.read()
 
     # Проверяем, есть ли уже /health
-    if '@app.route("/health")' in content:
+    if '.route("/health")' in content:
         print("✅ Endpoint /health already exists.")
     else:
         # Добавляем endpoint перед последней строкой с if __name__ ...